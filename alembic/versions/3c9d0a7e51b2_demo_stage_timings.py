@@ -0,0 +1,35 @@
+"""demo stage timings
+
+Revision ID: 3c9d0a7e51b2
+Revises: f2da672b18aa
+Create Date: 2026-10-19 09:12:40.518231
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c9d0a7e51b2'
+down_revision = 'f2da672b18aa'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('demo_stage_timings',
+    sa.Column('id', sa.INTEGER(), autoincrement=True, nullable=False),
+    sa.Column('trace_id', sa.VARCHAR(length=32), nullable=False),
+    sa.Column('stage', sa.VARCHAR(length=32), nullable=False),
+    sa.Column('started_at', sa.FLOAT(), nullable=False),
+    sa.Column('finished_at', sa.FLOAT(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_demo_stage_timings_trace_id'), 'demo_stage_timings', ['trace_id'], unique=False)
+    op.create_index(op.f('ix_demo_stage_timings_stage'), 'demo_stage_timings', ['stage'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_demo_stage_timings_stage'), table_name='demo_stage_timings')
+    op.drop_index(op.f('ix_demo_stage_timings_trace_id'), table_name='demo_stage_timings')
+    op.drop_table('demo_stage_timings')
@@ -0,0 +1,38 @@
+"""archived urls
+
+Revision ID: 8a41f7c2d903
+Revises: 3c9d0a7e51b2
+Create Date: 2026-10-19 11:03:17.204466
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a41f7c2d903'
+down_revision = '3c9d0a7e51b2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('archived_urls',
+    sa.Column('id', sa.INTEGER(), autoincrement=True, nullable=False),
+    sa.Column('normalized_url', sa.VARCHAR(length=2048), nullable=False),
+    sa.Column('url', sa.VARCHAR(length=2048), nullable=False),
+    sa.Column('reversed_domain', sa.VARCHAR(length=255), nullable=False),
+    sa.Column('first_message_url', sa.VARCHAR(length=255), nullable=False),
+    sa.Column('first_seen_at', sa.FLOAT(), nullable=False),
+    sa.Column('last_seen_at', sa.FLOAT(), nullable=False),
+    sa.Column('occurrences', sa.INTEGER(), nullable=False),
+    sa.Column('skip_reason', sa.VARCHAR(length=255), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('normalized_url')
+    )
+    op.create_index(op.f('ix_archived_urls_reversed_domain'), 'archived_urls', ['reversed_domain'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_archived_urls_reversed_domain'), table_name='archived_urls')
+    op.drop_table('archived_urls')
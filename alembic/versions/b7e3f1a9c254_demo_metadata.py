@@ -0,0 +1,43 @@
+"""demo metadata
+
+Revision ID: b7e3f1a9c254
+Revises: d57e2b9c4a16
+Create Date: 2026-10-19 15:22:48.906131
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e3f1a9c254'
+down_revision = 'd57e2b9c4a16'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('demo_metadata',
+    sa.Column('id', sa.INTEGER(), autoincrement=True, nullable=False),
+    sa.Column('content_hash', sa.VARCHAR(length=64), nullable=False),
+    sa.Column('filename', sa.VARCHAR(length=255), nullable=False),
+    sa.Column('message_url', sa.VARCHAR(length=255), nullable=True),
+    sa.Column('player', sa.VARCHAR(length=255, collation='NOCASE'), nullable=True),
+    sa.Column('map', sa.VARCHAR(length=255, collation='NOCASE'), nullable=True),
+    sa.Column('physics', sa.VARCHAR(length=64, collation='NOCASE'), nullable=True),
+    sa.Column('time', sa.VARCHAR(length=32), nullable=True),
+    sa.Column('time_ms', sa.INTEGER(), nullable=True),
+    sa.Column('analyzer_version', sa.INTEGER(), nullable=False),
+    sa.Column('analyzed_at', sa.FLOAT(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('content_hash')
+    )
+    op.create_index(op.f('ix_demo_metadata_player'), 'demo_metadata', ['player'], unique=False)
+    op.create_index('ix_demo_metadata_map_physics_time_ms', 'demo_metadata', ['map', 'physics', 'time_ms'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_demo_metadata_map_physics_time_ms', table_name='demo_metadata')
+    op.drop_index(op.f('ix_demo_metadata_player'), table_name='demo_metadata')
+    op.drop_table('demo_metadata')
@@ -0,0 +1,29 @@
+"""rendered demo content hash
+
+Revision ID: d57e2b9c4a16
+Revises: 8a41f7c2d903
+Create Date: 2026-10-19 12:41:05.318842
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd57e2b9c4a16'
+down_revision = '8a41f7c2d903'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing rows get their hashes when the bot loads RenderedDemoCache and finds the archived files. The index is not
+    # unique, because legacy rows can be renders of the same demo.
+    op.add_column('rendered_demos', sa.Column('content_hash', sa.VARCHAR(length=64), nullable=True))
+    op.create_index(op.f('ix_rendered_demos_content_hash'), 'rendered_demos', ['content_hash'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_rendered_demos_content_hash'), table_name='rendered_demos')
+    with op.batch_alter_table('rendered_demos') as batch_op:
+        batch_op.drop_column('content_hash')
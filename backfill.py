@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Archives the history of the given channels within a date range, several channels at once. It reuses the archiving
+and deduplication of DownloaderClient, but it keeps its own savepoints in STATE_DIRECTORY/backfill, so it doesn't
+interfere with the savepoints of the bot.
+
+With --no-render, no demos are enqueued for rendering and the backfill can run alongside the bot. Otherwise, it needs
+the bot to be stopped, because both would write the same rendering queue; the queued demos are rendered after the bot
+is started again.
+"""
+import argparse
+import asyncio
+import datetime
+import logging
+import os
+import sys
+import urllib.parse
+from typing import List, Optional
+
+import discord
+import filelock
+
+from discord_downloader.attachment_downloader import ResumableAttachmentDownloader
+from discord_downloader.db import create_current_db_engine
+from discord_downloader.db_writer import BatchingDbWriter
+from discord_downloader.demo_analyzer import DemoAnalyzer
+from discord_downloader.local_queue import NopRenderingQueue
+from discord_downloader.persistent_state import Savepoint
+from discord_downloader.tracing import DbStageTracer
+from download import DownloaderClient, create_uploader, configure_logging, DEFAULT_HISTORY_START, monitor_event_loop
+from settings import DISCORD_TOKEN, CHANNELS, STATE_DIRECTORY, DEMOCLEANER_EXE, TEMP_DIRECTORY, \
+    DB_WRITE_BATCH_WINDOW
+
+BACKFILL_STATE_DIRECTORY = os.path.join(STATE_DIRECTORY, "backfill")
+
+
+class BackfillClient(DownloaderClient):
+
+    def __init__(self, channel_names: List[str], after: Optional[datetime.datetime],
+                 before: Optional[datetime.datetime], concurrency: int, enqueue_renders: bool, **kwargs):
+        super(BackfillClient, self).__init__(**kwargs)
+        self._channel_names = channel_names
+        self._after = after
+        self._before = before
+        self._concurrency = concurrency
+        self._enqueue_renders = enqueue_renders
+
+    async def on_ready(self):
+        try:
+            try:
+                self._check_thread()
+                await self._init_channels()
+                missing = set(self._channel_names) - self._channels.keys()
+                if len(missing) > 0:
+                    raise Exception(f"Some channels were not found: {missing}")
+                if self._enqueue_renders:
+                    await self._load_rendered_demos()
+                semaphore = asyncio.Semaphore(self._concurrency)
+
+                async def backfill_with_semaphore(name: str):
+                    async with semaphore:
+                        await self._backfill_channel(name)
+
+                await asyncio.gather(*map(backfill_with_semaphore, self._channel_names))
+                self._logger.info("Backfill done")
+            finally:
+                await self.close()
+        except Exception as e:
+            self.ret = 1
+            self._logger.exception("Exception in on_ready")
+
+    async def on_message(self, message: discord.Message):
+        # new messages are handled by the bot
+        pass
+
+    async def _backfill_channel(self, name: str):
+        self._check_thread()
+        start_after = DEFAULT_HISTORY_START if self._after is None else discord.utils.time_snowflake(self._after)
+        before = None if self._before is None else discord.utils.time_snowflake(self._before)
+        savepoint = Savepoint(os.path.join(
+            BACKFILL_STATE_DIRECTORY,
+            f"{urllib.parse.quote(name)}-{start_after}-{before}.txt"
+        ))
+        self._logger.info(f"Backfilling {name}…")
+        await self._archive_history(
+            name,
+            self._channels[name],
+            check_all_messages=name in CHANNELS,
+            savepoint=savepoint,
+            start_after=start_after,
+            before=before,
+            enqueue_renders=self._enqueue_renders
+        )
+        self._check_thread()
+        self._logger.info(f"Backfill of {name} done")
+
+
+def parse_date(s: str) -> datetime.datetime:
+    # discord.py works with naive UTC datetimes
+    return datetime.datetime.fromisoformat(s)
+
+
+async def main(args):
+    db_writer = BatchingDbWriter(create_current_db_engine(), window=DB_WRITE_BATCH_WINDOW)
+    # Enqueuing renders modifies the state of the rendering queue, so we must not run alongside the bot.
+    lock_file = os.path.join(STATE_DIRECTORY, "backfill.lock" if args.no_render else "run.lock")
+    try:
+        with filelock.FileLock(lock_file).acquire(timeout=10):
+            os.makedirs(BACKFILL_STATE_DIRECTORY, exist_ok=True)
+            configure_logging()
+            monitors = monitor_event_loop('backfill')
+            tracer = DbStageTracer(db_writer)
+            if args.no_render:
+                state, uploader = None, NopRenderingQueue()
+            else:
+                state, uploader = create_uploader(tracer)
+            client = BackfillClient(
+                channel_names=args.channels,
+                after=args.after,
+                before=args.before,
+                concurrency=args.concurrency,
+                enqueue_renders=not args.no_render,
+                uploader=uploader,
+                demo_analyzer=DemoAnalyzer(DEMOCLEANER_EXE),
+                loop=loop,
+                db_writer=db_writer,
+                tracer=tracer,
+                attachment_downloader=ResumableAttachmentDownloader(TEMP_DIRECTORY)
+            )
+            try:
+                await client.start(DISCORD_TOKEN)
+            finally:
+                await client.close()
+                await db_writer.close()
+                for monitor in monitors:
+                    monitor.cancel()
+            if state is not None:
+                state.close()
+            sys.exit(client.ret)
+    except filelock.Timeout:
+        logging.getLogger().error(f"Unable to acquire {lock_file}. Is the bot or another backfill running?")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Archives history of the given channels.')
+    parser.add_argument('channels', nargs='+', help='channel names in the same format as in CHANNELS ("guild--channel")')
+    parser.add_argument('--after', type=parse_date, default=None, help='UTC date or datetime in ISO format')
+    parser.add_argument('--before', type=parse_date, default=None, help='UTC date or datetime in ISO format')
+    parser.add_argument('--concurrency', type=int, default=4, help='number of channels archived at once')
+    parser.add_argument('--no-render', action='store_true', help='archive demos, but do not enqueue renders')
+    loop = asyncio.ProactorEventLoop() if sys.platform == 'win32' else asyncio.SelectorEventLoop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(main(parser.parse_args()))
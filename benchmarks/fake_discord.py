@@ -0,0 +1,144 @@
+"""
+Local stand-ins for the parts of discord.py that DownloaderClient consumes. They don't talk to Discord at all; they
+just count the API calls that the real objects would have made.
+"""
+import datetime
+from collections import Counter
+from typing import List, Optional
+
+import discord
+
+HISTORY_PAGE_SIZE = 100  # discord.py fetches history in pages of 100 messages
+
+
+class ApiCalls(Counter):
+    pass
+
+
+class FakeUser:
+
+    def __init__(self, id: int, name: str):
+        self.id = id
+        self.name = name
+
+    def __eq__(self, other):
+        return isinstance(other, FakeUser) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class FakeAttachment:
+
+    def __init__(self, id: int, filename: str, data: bytes, api_calls: ApiCalls):
+        self.id = id
+        self.filename = filename
+        self.size = len(data)
+        self.url = f"https://cdn.example.com/attachments/{id}/{filename}"
+        self.proxy_url = self.url
+        self._data = data
+        self._api_calls = api_calls
+
+    async def save(self, fp, *, seek_begin=True, use_cached=False):
+        self._api_calls['attachment.save'] += 1
+        fp.write(self._data)
+        return len(self._data)
+
+    async def read(self, *, use_cached=False):
+        self._api_calls['attachment.read'] += 1
+        return self._data
+
+
+class FakeMessage:
+
+    def __init__(self, id: int, channel: 'FakeChannel', content: str, attachments: List[FakeAttachment],
+                 mentions: List[FakeUser], author: FakeUser):
+        self.id = id
+        self.channel = channel
+        self.content = content
+        self.attachments = attachments
+        self.mentions = mentions
+        self.author = author
+        self.reactions = []
+        self.created_at = discord.utils.snowflake_time(id)
+        self.jump_url = f"https://discord.com/channels/{channel.guild.id}/{channel.id}/{id}"
+        self._api_calls = channel.api_calls
+
+    async def add_reaction(self, emoji):
+        self._api_calls['message.add_reaction'] += 1
+
+    async def remove_reaction(self, emoji, member):
+        self._api_calls['message.remove_reaction'] += 1
+
+    async def reply(self, content=None, **kwargs):
+        self._api_calls['message.reply'] += 1
+
+    def to_reference(self):
+        return None
+
+
+class FakeGuild:
+
+    def __init__(self, id: int, name: str):
+        self.id = id
+        self.name = name
+
+    def __str__(self):
+        return self.name
+
+
+class FakeChannel:
+
+    def __init__(self, id: int, name: str, guild: FakeGuild, api_calls: Optional[ApiCalls] = None):
+        self.id = id
+        self.name = name
+        self.guild = guild
+        self.api_calls = api_calls if api_calls is not None else ApiCalls()
+        self.messages: List[FakeMessage] = []
+
+    @property
+    def last_message_id(self) -> Optional[int]:
+        return self.messages[-1].id if len(self.messages) > 0 else None
+
+    def history(self, *, limit=100, before=None, after=None, around=None, oldest_first=None):
+        return self._history(limit=limit, before=before, after=after, oldest_first=oldest_first)
+
+    async def _history(self, limit, before, after, oldest_first):
+        after_id = after.id if after is not None else 0
+        before_id = before.id if before is not None else None
+        selected = [m for m in self.messages if m.id > after_id and (before_id is None or m.id < before_id)]
+        if oldest_first is False or (oldest_first is None and after is None):
+            selected.reverse()
+        if limit is not None:
+            selected = selected[:limit]
+        for i, message in enumerate(selected):
+            if i % HISTORY_PAGE_SIZE == 0:
+                self.api_calls['channel.history_page'] += 1
+            yield message
+        if len(selected) % HISTORY_PAGE_SIZE == 0:
+            # the last (possibly empty) page tells the iterator that there is nothing more
+            self.api_calls['channel.history_page'] += 1
+
+    async def fetch_message(self, id: int):
+        self.api_calls['channel.fetch_message'] += 1
+        for message in self.messages:
+            if message.id == id:
+                return message
+        raise discord.errors.NotFound(_FakeResponse(404), 'Unknown Message')
+
+    async def send(self, content=None, **kwargs):
+        self.api_calls['channel.send'] += 1
+
+    def __str__(self):
+        return self.name
+
+
+class _FakeResponse:
+
+    def __init__(self, status: int):
+        self.status = status
+        self.reason = 'Fake'
+
+
+def snowflake_at(instant: datetime.datetime) -> int:
+    return discord.utils.time_snowflake(instant)
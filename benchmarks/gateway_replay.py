@@ -0,0 +1,213 @@
+"""
+Replays a recording of Discord traffic (see discord_downloader/gateway_recorder.py, GATEWAY_RECORDING_FILE) against
+DownloaderClient with the fakes from benchmarks/fake_discord.py, so a performance change can be checked offline on
+real traffic.
+
+Messages that arrived as on_message events are dispatched at their recorded times (divided by --speed; 0 dispatches
+them as fast as possible); all the other recorded messages are in the channels from the start and are archived by the
+initial catch-up (unless --skip-backlog). The latency of an event is the time from its dispatch to the end of its
+on_message handler.
+
+Usage (from the repository root, with settings.py present):
+
+    python -m benchmarks.gateway_replay state/gateway-recording.jsonl --speed 10
+"""
+import argparse
+import asyncio
+import base64
+import os
+import tempfile
+import time
+import urllib.parse
+from collections import Counter
+from typing import Dict, List, Tuple
+
+import download
+from benchmarks.fake_discord import FakeChannel, FakeGuild, FakeMessage, FakeAttachment, FakeUser, ApiCalls
+from benchmarks.ingest_benchmark import CountingRenderingQueue, FakeDemoAnalyzer, peak_rss_kib
+from benchmarks.results import save_result, print_comparison
+from discord_downloader import db
+from discord_downloader.attachment_downloader import SavingAttachmentDownloader
+from discord_downloader.db_writer import BatchingDbWriter
+from discord_downloader.gateway_recorder import read_recording
+from discord_downloader.tracing import NopStageTracer, percentile
+
+BENCHMARK_NAME = 'gateway-replay'
+
+
+class Replay:
+    """
+    The recording turned into fake channels, messages and a schedule of events.
+    """
+
+    def __init__(self, filename: str):
+        self.api_calls = ApiCalls()
+        self.bot_user = FakeUser(0, 'bot')
+        self.channels: Dict[int, Tuple[str, FakeChannel]] = {}
+        self.check_all_names = set()
+        self.recorded = Counter()
+        self.events: List[Tuple[float, FakeMessage]] = []  # (recorded time, message)
+        self.backlog: List[FakeMessage] = []
+        message_records = {}
+        attachment_data = {}
+        event_records = []
+        for record in read_recording(filename):
+            kind = record['kind']
+            self.recorded[kind] += 1
+            if kind == 'channels':
+                self.bot_user = FakeUser(record['bot_user']['id'], record['bot_user']['name'])
+                for c in record['channels']:
+                    if c['id'] not in self.channels:
+                        channel = FakeChannel(c['id'], c['name'], FakeGuild(c['guild_id'], c['guild']),
+                                              self.api_calls)
+                        self.channels[c['id']] = (f"{c['guild']}--{c['name']}", channel)
+                    if c['check_all']:
+                        self.check_all_names.add(f"{c['guild']}--{c['name']}")
+            elif kind == 'message':
+                message_records.setdefault(record['message']['id'], record['message'])
+            elif kind == 'on_message':
+                event_records.append(record)
+            elif kind == 'attachment':
+                attachment_data[record['id']] = base64.b64decode(record['data'])
+
+        messages = {id: self._message(m, attachment_data) for id, m in message_records.items()
+                    if m['channel_id'] in self.channels}
+        live = set()
+        if len(event_records) > 0:
+            start = event_records[0]['t']
+            for record in event_records:
+                message = messages.get(record['message_id'])
+                if message is not None and message.id not in live:
+                    live.add(message.id)
+                    self.events.append((max(record['t'] - start, 0.0), message))
+        self.backlog = sorted((m for m in messages.values() if m.id not in live), key=lambda m: m.id)
+        for message in self.backlog:
+            message.channel.messages.append(message)
+
+    def _message(self, record: dict, attachment_data: Dict[int, bytes]) -> FakeMessage:
+        _, channel = self.channels[record['channel_id']]
+        attachments = []
+        for a in record['attachments']:
+            attachment = FakeAttachment(a['id'], a['filename'], attachment_data.get(a['id'], b''), self.api_calls)
+            # attachments that have not been downloaded (e.g., skipped by ARCHIVE_RULES) keep their size
+            attachment.size = a['size']
+            attachment.url = a['url']
+            attachments.append(attachment)
+        return FakeMessage(
+            record['id'], channel, record['content'], attachments,
+            mentions=[FakeUser(u['id'], u['name']) for u in record['mentions']],
+            author=FakeUser(record['author']['id'], record['author']['name'])
+        )
+
+    @property
+    def channels_by_name(self) -> Dict[str, FakeChannel]:
+        return {name: channel for name, channel in self.channels.values()}
+
+
+def deliver(message: FakeMessage):
+    """
+    Makes the message visible in the history of its channel, like Discord does before sending the event.
+    """
+    messages = message.channel.messages
+    i = len(messages)
+    while i > 0 and messages[i - 1].id > message.id:
+        i -= 1
+    messages.insert(i, message)
+
+
+async def run_replay(args, replay: Replay, client: download.DownloaderClient):
+    client._channels = replay.channels_by_name
+    client._reverse_channels = {channel: name for name, channel in client._channels.items()}
+    client._output_channels = {}
+    if args.skip_backlog:
+        for name, channel in client._channels.items():
+            if channel.last_message_id is not None:
+                with open(os.path.join(download.STATE_DIRECTORY, urllib.parse.quote(name) + ".txt"), "w") as f:
+                    f.write(str(channel.last_message_id))
+
+    start = time.perf_counter()
+    await client._download_news()
+    catch_up_seconds = time.perf_counter() - start
+    client._prepared = True
+
+    latencies = []
+
+    async def dispatch(message: FakeMessage):
+        dispatched_at = time.perf_counter()
+        deliver(message)
+        await client.on_message(message)
+        latencies.append(time.perf_counter() - dispatched_at)
+
+    events_start = time.perf_counter()
+    tasks = []
+    for at, message in replay.events:
+        if args.speed > 0:
+            delay = events_start + at / args.speed - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        # discord.py runs every event handler as its own task
+        tasks.append(asyncio.get_running_loop().create_task(dispatch(message)))
+    await asyncio.gather(*tasks)
+    events_seconds = time.perf_counter() - events_start
+    return catch_up_seconds, events_seconds, sorted(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay of recorded Discord traffic')
+    parser.add_argument('recording', help='file recorded with GATEWAY_RECORDING_FILE')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='speed-up of the recorded event times; 0 dispatches the events without waiting')
+    parser.add_argument('--skip-backlog', action='store_true',
+                        help='start with the savepoints after the backlog, so only the events are archived')
+    parser.add_argument('--no-save', action='store_true', help='do not append the result to benchmarks/results')
+    args = parser.parse_args()
+
+    replay = Replay(args.recording)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for directory in ['state', 'attachments', 'tmp']:
+            os.mkdir(os.path.join(tmpdir, directory))
+        download.STATE_DIRECTORY = db.STATE_DIRECTORY = os.path.join(tmpdir, 'state')
+        download.ATTACHMENTS_DIRECTORY = os.path.join(tmpdir, 'attachments')
+        download.TEMP_DIRECTORY = os.path.join(tmpdir, 'tmp')
+        download.CHANNELS = {name: [] for name in replay.check_all_names}
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        queue = CountingRenderingQueue()
+        db_writer = BatchingDbWriter(db.create_current_db_engine())
+        client = download.DownloaderClient(
+            uploader=queue,
+            demo_analyzer=FakeDemoAnalyzer(),
+            loop=loop,
+            db_writer=db_writer,
+            tracer=NopStageTracer(),
+            attachment_downloader=SavingAttachmentDownloader(download.TEMP_DIRECTORY)
+        )
+        client._connection.user = replay.bot_user
+        catch_up_seconds, events_seconds, latencies = loop.run_until_complete(run_replay(args, replay, client))
+        loop.run_until_complete(db_writer.close())
+        loop.run_until_complete(client.http.close())
+        loop.close()
+
+    metrics = {
+        'catch_up_seconds': catch_up_seconds,
+        'backlog_messages': len(replay.backlog),
+        'events': len(replay.events),
+        'events_seconds': events_seconds,
+        'event_latency_p50_ms': percentile(latencies, 50) * 1000 if latencies else None,
+        'event_latency_p95_ms': percentile(latencies, 95) * 1000 if latencies else None,
+        'event_latency_max_ms': latencies[-1] * 1000 if latencies else None,
+        'peak_rss_kib': peak_rss_kib(),
+        'renders_enqueued': queue.uploads,
+        'recorded.history_calls': replay.recorded['history'],
+        **{f"api.{k}": v for k, v in sorted(replay.api_calls.items())},
+    }
+    params = {'recording': os.path.basename(args.recording), 'speed': args.speed, 'skip_backlog': args.skip_backlog}
+    result = {'commit': None, 'params': params, 'metrics': metrics}
+    if not args.no_save:
+        result = save_result(BENCHMARK_NAME, params, metrics)
+    print_comparison(BENCHMARK_NAME, result)
+
+
+if __name__ == '__main__':
+    main()
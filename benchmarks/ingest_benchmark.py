@@ -0,0 +1,190 @@
+"""
+Offline benchmark of channel-history ingest (DownloaderClient._download_channel_without_lock).
+
+Usage (from the repository root, with settings.py present):
+
+    python -m benchmarks.ingest_benchmark --messages 10000 --attachment-ratio 0.2 --demo-ratio 0.5
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import random
+import tempfile
+import time
+from typing import Optional, Callable, Awaitable, Any
+
+import download
+from benchmarks.fake_discord import FakeChannel, FakeGuild, FakeMessage, FakeAttachment, FakeUser, snowflake_at
+from benchmarks.results import save_result, print_comparison
+from discord_downloader import db
+from discord_downloader.attachment_downloader import SavingAttachmentDownloader
+from discord_downloader.db_writer import BatchingDbWriter
+from discord_downloader.local_queue import PollingRenderingQueue
+from discord_downloader.tracing import NopStageTracer
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BENCHMARK_NAME = 'ingest'
+CHANNEL_NAME = 'benchmark-guild--benchmark-channel'
+
+
+class CountingRenderingQueue(PollingRenderingQueue):
+
+    def __init__(self):
+        self.uploads = 0
+
+    async def upload(self, url: str, resolution: int, title: str, description: str, additional_data=None) -> None:
+        self.uploads += 1
+
+    async def check_for_done(self, done_callback: Callable[[str, Any], Awaitable[None]],
+                             failed_callback: Callable[[int, Exception, Any], Awaitable[None]]):
+        pass
+
+    async def retry_uploads(self):
+        pass
+
+
+class FakeDemoAnalyzer:
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+
+    async def analyze(self, file: str):
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        return {
+            'player': {'uncoloredName': 'benchmark'},
+            'client': {'mapname': 'st1'},
+            'game': {'gameplay': 'Promode (CPM)'},
+            'record': {'bestTime': '00.123'},
+        }
+
+
+class FsyncCounter:
+
+    def __init__(self):
+        self.count = 0
+        self._original = None
+
+    def __enter__(self):
+        self._original = os.fsync
+
+        def counting_fsync(fd):
+            self.count += 1
+            return self._original(fd)
+
+        os.fsync = counting_fsync
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        os.fsync = self._original
+
+
+def generate_channel(args, bot_user: FakeUser) -> FakeChannel:
+    rnd = random.Random(args.seed)
+    guild = FakeGuild(1, 'benchmark-guild')
+    channel = FakeChannel(2, 'benchmark-channel', guild)
+    author = FakeUser(3, 'author')
+    start = datetime.datetime(2026, 1, 1)
+    attachment_data = bytes(rnd.getrandbits(8) for _ in range(args.attachment_size))
+    attachment_id = 1
+    for i in range(args.messages):
+        message_id = snowflake_at(start + datetime.timedelta(seconds=i))
+        content = f"message {i}"
+        if rnd.random() < args.url_ratio:
+            content += f" https://example.com/{i}"
+        mentions = [bot_user] if rnd.random() < args.mention_ratio else []
+        attachments = []
+        if rnd.random() < args.attachment_ratio:
+            for _ in range(args.attachments_per_message):
+                is_demo = rnd.random() < args.demo_ratio
+                filename = f"run-{attachment_id}.dm_68" if is_demo else f"screenshot-{attachment_id}.png"
+                # unique prefix keeps every attachment distinct, so the mover never deduplicates
+                data = attachment_id.to_bytes(8, 'big') + attachment_data
+                attachments.append(FakeAttachment(attachment_id, filename, data, channel.api_calls))
+                attachment_id += 1
+        channel.messages.append(FakeMessage(message_id, channel, content, attachments, mentions, author))
+    return channel
+
+
+def peak_rss_kib() -> Optional[int]:
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+async def run_ingest(client: download.DownloaderClient, channel: FakeChannel, check_all_messages: bool):
+    await client._download_channel_without_lock(CHANNEL_NAME, channel, check_all_messages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmark of channel-history ingest')
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--attachment-ratio', type=float, default=0.1, help='share of messages with attachments')
+    parser.add_argument('--attachments-per-message', type=int, default=1)
+    parser.add_argument('--attachment-size', type=int, default=64 * 1024, help='bytes')
+    parser.add_argument('--demo-ratio', type=float, default=0.5, help='share of attachments that are demos')
+    parser.add_argument('--url-ratio', type=float, default=0.1, help='share of messages with an URL')
+    parser.add_argument('--mention-ratio', type=float, default=0.05, help='share of messages mentioning the bot')
+    parser.add_argument('--mentions-only', action='store_true',
+                        help='simulate a channel that is not in CHANNELS (only mentions are archived)')
+    parser.add_argument('--analyze-latency', type=float, default=0.0, help='seconds to analyze a demo')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--no-save', action='store_true', help='do not append the result to benchmarks/results')
+    args = parser.parse_args()
+
+    bot_user = FakeUser(4, 'bot')
+    channel = generate_channel(args, bot_user)
+    attachments_total = sum(len(m.attachments) for m in channel.messages
+                            if not args.mentions_only or bot_user in m.mentions)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for directory in ['state', 'attachments', 'tmp']:
+            os.mkdir(os.path.join(tmpdir, directory))
+        download.STATE_DIRECTORY = db.STATE_DIRECTORY = os.path.join(tmpdir, 'state')
+        download.ATTACHMENTS_DIRECTORY = os.path.join(tmpdir, 'attachments')
+        download.TEMP_DIRECTORY = os.path.join(tmpdir, 'tmp')
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        queue = CountingRenderingQueue()
+        db_writer = BatchingDbWriter(db.create_current_db_engine())
+        client = download.DownloaderClient(
+            uploader=queue,
+            demo_analyzer=FakeDemoAnalyzer(args.analyze_latency),
+            loop=loop,
+            db_writer=db_writer,
+            tracer=NopStageTracer(),
+            attachment_downloader=SavingAttachmentDownloader(download.TEMP_DIRECTORY)
+        )
+        client._connection.user = bot_user
+        with FsyncCounter() as fsyncs:
+            start = time.perf_counter()
+            loop.run_until_complete(run_ingest(client, channel, check_all_messages=not args.mentions_only))
+            elapsed = time.perf_counter() - start
+        loop.run_until_complete(db_writer.close())
+        loop.run_until_complete(client.http.close())
+        loop.close()
+
+    metrics = {
+        'seconds': elapsed,
+        'messages_per_s': args.messages / elapsed,
+        'attachments_per_s': attachments_total / elapsed,
+        'fsyncs_per_message': fsyncs.count / args.messages,
+        'peak_rss_kib': peak_rss_kib(),
+        'renders_enqueued': queue.uploads,
+        **{f"api.{k}": v for k, v in sorted(channel.api_calls.items())},
+    }
+    params = {k: v for k, v in vars(args).items() if k != 'no_save'}
+    result = {'commit': None, 'params': params, 'metrics': metrics}
+    if not args.no_save:
+        result = save_result(BENCHMARK_NAME, params, metrics)
+    print_comparison(BENCHMARK_NAME, result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+"""
+Load benchmark of the local rendering pipeline (LocalRenderingQueue.upload and run()).
+
+Rendering and uploading are done by tests/odfe-demo-renderer-test/fake-odfe.sh and
+tests/youtube-uploader-test/yt-uploader-mock.sh, so the numbers describe the scheduler and the state store, not oDFe.
+
+Usage (from the repository root, with settings.py present):
+
+    python -m benchmarks.rendering_pipeline_benchmark --jobs 2000 --render-latency 0.01 --render-failure-percent 5
+    python -m benchmarks.rendering_pipeline_benchmark --jobs 64 --render-latency 1 --render-demo-latency 0.1 --batch-size 8
+    python -m benchmarks.rendering_pipeline_benchmark --jobs 220 --flood-jobs 200 --render-latency 0.05
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import shutil
+import tempfile
+import time
+from os import path
+from os.path import dirname
+from typing import Dict, Optional, List
+
+from aiohttp import web
+
+from benchmarks.results import save_result, print_comparison
+from discord_downloader.demo_uploaders import OdfeDemoRenderer, YoutubeUploader
+from discord_downloader.local_rendering_queue import LocalRenderingQueue
+from discord_downloader.persistent_state import StoredState
+from discord_downloader.tracing import percentile
+
+BENCHMARK_NAME = 'rendering-pipeline'
+TESTS_DIRECTORY = path.join(dirname(__file__), '..', 'tests')
+
+
+class CountingStoredState(StoredState):
+
+    def __init__(self, filename, default_value):
+        super().__init__(filename, default_value)
+        self.flushes = 0
+        self.bytes_written = 0
+
+    async def flush(self):
+        await super().flush()
+        self.flushes += 1
+        self.bytes_written += os.path.getsize(self.filename)
+
+
+class TimingDemoRenderer(OdfeDemoRenderer):
+
+    def __init__(self, enqueued_at: Dict[str, float], **kwargs):
+        super().__init__(**kwargs)
+        self._enqueued_at = enqueued_at
+        self.queue_waits: List[float] = []
+        self.queue_waits_by_demo: Dict[str, float] = {}
+
+    async def render(self, demo_filename: str, demo_data: bytes, round_id: Optional[int]) -> str:
+        wait = time.perf_counter() - self._enqueued_at[demo_filename]
+        self.queue_waits.append(wait)
+        self.queue_waits_by_demo[demo_filename] = wait
+        return await super().render(demo_filename, demo_data, round_id)
+
+
+async def start_demo_server(demo_data: bytes):
+    async def handle(request):
+        return web.Response(body=demo_data)
+
+    app = web.Application()
+    app.router.add_get('/demos/{name}', handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/demos"
+
+
+async def run_benchmark(args, tmpdir: str):
+    for directory in ['config', 'demo', 'video', 'executable']:
+        os.mkdir(path.join(tmpdir, directory))
+    fake_odfe = path.join(tmpdir, 'executable', 'fake-odfe.sh')
+    shutil.copy(path.join(TESTS_DIRECTORY, 'odfe-demo-renderer-test', 'fake-odfe.sh'), fake_odfe)
+    yt_dir = path.join(TESTS_DIRECTORY, 'youtube-uploader-test')
+    os.environ['FAKE_ODFE_LATENCY'] = str(args.render_latency)
+    os.environ['FAKE_ODFE_DEMO_LATENCY'] = str(args.render_demo_latency)
+    os.environ['FAKE_ODFE_FAILURE_PERCENT'] = str(args.render_failure_percent)
+    os.environ['YT_UPLOADER_MOCK_LATENCY'] = str(args.upload_latency)
+    os.environ['YT_UPLOADER_MOCK_FAILURE_PERCENT'] = str(args.upload_failure_percent)
+
+    runner, base_url = await start_demo_server(b'\0' * args.demo_size)
+    enqueued_at: Dict[str, float] = {}
+    renderer = TimingDemoRenderer(
+        enqueued_at,
+        odfe_dir=tmpdir,
+        odfe_executable=fake_odfe,
+        config_dir=path.join(tmpdir, 'config'),
+        demo_dir=path.join(tmpdir, 'demo'),
+        video_dir=path.join(tmpdir, 'video'),
+        defrag_config='// benchmark',
+        max_batch_size=args.batch_size
+    )
+    state = CountingStoredState(path.join(tmpdir, 'local-rendering-queue.json'),
+                                LocalRenderingQueue.get_default_state())
+    queue = LocalRenderingQueue(
+        demo_renderer=renderer,
+        rendered_demo_uploader=YoutubeUploader(
+            youtube_uploader_executable=path.join(yt_dir, 'yt-uploader-mock.sh'),
+            youtube_uploader_params=['0', path.join(yt_dir, 'success-stdout.txt'),
+                                     path.join(yt_dir, 'success-stderr.txt')]
+        ),
+        state=state,
+        delay_before_publishing=datetime.timedelta(0),
+        render_concurrency=args.batch_size
+    )
+    finished = asyncio.Event()
+    results = {'done': 0, 'failed': 0}
+
+    def count(kind):
+        results[kind] += 1
+        if results['done'] + results['failed'] == args.jobs:
+            finished.set()
+
+    async def done_callback(video_url, additional_data):
+        count('done')
+
+    async def fail_callback(id, e, additional_data):
+        count('failed')
+
+    queue.add_done_callback(done_callback)
+    queue.add_fail_callback(fail_callback)
+
+    start = time.perf_counter()
+    run_task = asyncio.get_running_loop().create_task(queue.run())
+    small_channel_urls = []
+    for i in range(args.jobs):
+        url = f"{base_url}/{i}.dm_68"
+        enqueued_at[url] = time.perf_counter()
+        # the first --flood-jobs jobs come from one channel, each of the other ones from its own channel
+        channel = 'benchmark--flood' if i < args.flood_jobs else f"benchmark--channel-{i}"
+        if i >= args.flood_jobs:
+            small_channel_urls.append(url)
+        await queue.upload(url, 28, f"job {i}", "benchmark", [channel, None])
+        if args.arrival_interval > 0:
+            await asyncio.sleep(args.arrival_interval)
+    enqueue_seconds = time.perf_counter() - start
+    enqueue_flushes = state.flushes
+    await finished.wait()
+    elapsed = time.perf_counter() - start
+
+    run_task.cancel()
+    for task in asyncio.all_tasks():
+        if task is not asyncio.current_task():
+            task.cancel()
+    await asyncio.gather(*[t for t in asyncio.all_tasks() if t is not asyncio.current_task()],
+                         return_exceptions=True)
+    await runner.cleanup()
+
+    waits = sorted(renderer.queue_waits)
+    small_channel_waits = sorted(renderer.queue_waits_by_demo[url] for url in small_channel_urls
+                                 if url in renderer.queue_waits_by_demo)
+    return {
+        'seconds': elapsed,
+        'jobs_per_min': args.jobs / elapsed * 60,
+        'jobs_done': results['done'],
+        'jobs_failed': results['failed'],
+        'enqueue_seconds': enqueue_seconds,
+        'queue_wait_p50_s': percentile(waits, 50),
+        'queue_wait_p95_s': percentile(waits, 95),
+        'queue_wait_max_s': waits[-1],
+        'small_channel_wait_p95_s': percentile(small_channel_waits, 95) if len(small_channel_waits) > 0 else None,
+        'state_flushes': state.flushes,
+        'state_flushes_enqueue': enqueue_flushes,
+        'state_bytes_written': state.bytes_written,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load benchmark of the local rendering pipeline')
+    parser.add_argument('--jobs', type=int, default=1000)
+    parser.add_argument('--arrival-interval', type=float, default=0.0,
+                        help='seconds between two submitted jobs; 0 submits all of them at once')
+    parser.add_argument('--flood-jobs', type=int, default=0,
+                        help='jobs from one channel submitted before the others; the others come from small channels')
+    parser.add_argument('--demo-size', type=int, default=32 * 1024, help='bytes')
+    parser.add_argument('--render-latency', type=float, default=0.0, help='seconds per fake oDFe run (startup)')
+    parser.add_argument('--render-demo-latency', type=float, default=0.0, help='seconds per demo in a fake oDFe run')
+    parser.add_argument('--batch-size', type=int, default=1, help='demos per oDFe run')
+    parser.add_argument('--render-failure-percent', type=int, default=0)
+    parser.add_argument('--upload-latency', type=float, default=0.0, help='seconds per fake YouTube upload')
+    parser.add_argument('--upload-failure-percent', type=int, default=0)
+    parser.add_argument('--no-save', action='store_true', help='do not append the result to benchmarks/results')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        metrics = asyncio.run(run_benchmark(args, tmpdir))
+
+    params = {k: v for k, v in vars(args).items() if k != 'no_save'}
+    result = {'commit': None, 'params': params, 'metrics': metrics}
+    if not args.no_save:
+        result = save_result(BENCHMARK_NAME, params, metrics)
+    print_comparison(BENCHMARK_NAME, result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+import datetime
+import json
+import os
+import subprocess
+from os.path import dirname
+from typing import Dict, Any, Optional
+
+RESULTS_DIRECTORY = os.path.join(dirname(__file__), "results")
+
+
+def _git(*args) -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', *args], cwd=dirname(__file__), stderr=subprocess.DEVNULL)\
+            .decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _results_file(name: str) -> str:
+    return os.path.join(RESULTS_DIRECTORY, f"{name}.jsonl")
+
+
+def load_results(name: str):
+    try:
+        with open(_results_file(name)) as f:
+            return [json.loads(line) for line in f if line.strip() != ""]
+    except FileNotFoundError:
+        return []
+
+
+def save_result(name: str, params: Dict[str, Any], metrics: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Appends the result to benchmarks/results/<name>.jsonl, so results from different commits can be compared later.
+    """
+    status = _git('status', '--porcelain', '--untracked-files=no')
+    result = {
+        'commit': _git('rev-parse', 'HEAD'),
+        'dirty': None if status is None else status != "",
+        'time': datetime.datetime.now().isoformat(),
+        'params': params,
+        'metrics': metrics,
+    }
+    os.makedirs(RESULTS_DIRECTORY, exist_ok=True)
+    with open(_results_file(name), "a") as f:
+        f.write(json.dumps(result) + "\n")
+    return result
+
+
+def print_comparison(name: str, result: Dict[str, Any]):
+    """
+    Prints the metrics side by side with the most recent saved result with the same params from another commit.
+    """
+    previous = [r for r in load_results(name)
+                if r['params'] == result['params'] and r['commit'] != result['commit']]
+    baseline = previous[-1] if len(previous) > 0 else None
+    if baseline is not None:
+        print(f"compared to {baseline['commit']} ({baseline['time']}):")
+    for key, value in result['metrics'].items():
+        old_value = baseline['metrics'].get(key) if baseline is not None else None
+        if isinstance(value, (int, float)) and isinstance(old_value, (int, float)) and old_value != 0:
+            print(f"  {key:<28}{value:>14.2f}{old_value:>14.2f}{(value - old_value) / old_value * 100:>+10.1f}%")
+        elif isinstance(value, float):
+            print(f"  {key:<28}{value:>14.2f}")
+        else:
+            print(f"  {key:<28}{str(value):>14}")
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+import argparse
+import time
+
+from sqlalchemy import create_engine
+
+from discord_downloader.db import get_blocking_db_connection_url, create_current_db_engine
+from discord_downloader.demo_index import search_query, parse_time
+
+
+def demo_time(s: str) -> int:
+    time_ms = parse_time(s)
+    if time_ms is None:
+        raise argparse.ArgumentTypeError(f"Invalid time: {s} (expected, e.g., 01.23.456)")
+    return time_ms
+
+
+parser = argparse.ArgumentParser(description='Queries the index of analyzed demos.')
+parser.add_argument('--map', help='map name (case-insensitive)')
+parser.add_argument('--player', help='player name without colors (case-insensitive)')
+parser.add_argument('--physics', help='e.g., CPM or VQ3 (case-insensitive)')
+parser.add_argument('--min-time', type=demo_time, help='e.g., 00.07.440')
+parser.add_argument('--max-time', type=demo_time, help='e.g., 01.23.456')
+parser.add_argument('--limit', type=int, default=None)
+args = parser.parse_args()
+
+create_current_db_engine()  # upgrades the schema if needed
+engine = create_engine(get_blocking_db_connection_url())
+
+query = search_query(map=args.map, player=args.player, physics=args.physics, min_time_ms=args.min_time,
+                     max_time_ms=args.max_time, limit=args.limit)
+start = time.perf_counter()
+with engine.connect() as connection:
+    rows = connection.execute(query).fetchall()
+elapsed = time.perf_counter() - start
+for row in rows:
+    print(f"{row.time}\t{row.player}\t{row.physics}\t{row.map}\t{row.filename}\t{row.message_url or ''}")
+print(f"{len(rows)} demos ({elapsed * 1000:.1f} ms)")
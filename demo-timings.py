@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+import argparse
+import time
+
+from sqlalchemy import create_engine, select
+
+from discord_downloader.db import DemoStageTiming, get_blocking_db_connection_url
+from discord_downloader.tracing import stage_statistics
+
+parser = argparse.ArgumentParser(description='Shows p50/p95 duration of each stage of the demo pipeline.')
+parser.add_argument('--days', type=float, default=None, help='consider only stages started in the last N days')
+args = parser.parse_args()
+
+query = select(DemoStageTiming.stage, DemoStageTiming.started_at, DemoStageTiming.finished_at)\
+    .where(DemoStageTiming.finished_at.is_not(None))
+if args.days is not None:
+    query = query.where(DemoStageTiming.started_at >= time.time() - args.days * 24 * 3600)
+
+with create_engine(get_blocking_db_connection_url()).connect() as connection:
+    rows = connection.execute(query).fetchall()
+
+print(f"{'stage':<16}{'count':>8}{'p50 [s]':>12}{'p95 [s]':>12}")
+for stats in stage_statistics((row.stage, row.finished_at - row.started_at) for row in rows):
+    print(f"{stats.stage:<16}{stats.count:>8}{stats.p50:>12.2f}{stats.p95:>12.2f}")
@@ -11,11 +11,17 @@ class AdditionalData(NamedTuple):
     url: Optional[str]
     has_unknown: bool
     filename: str
+    trace_id: Optional[str] = None
+    content_hash: Optional[str] = None
+    author_id: Optional[int] = None  # the user who has posted the demo
 
     @staticmethod
     def reconstruct(additional_data_raw):
         if isinstance(additional_data_raw, list):
             [in_channel, message_id, *rest] = additional_data_raw
+            trace_id = None
+            content_hash = None
+            author_id = None
             if len(rest) == 0:
                 title = None
                 description = None
@@ -30,13 +36,26 @@ class AdditionalData(NamedTuple):
                     filename = uuid.uuid4().hex
                 else:
                     [has_unknown, filename, *rest3] = rest2
+                    if len(rest3) > 0:
+                        [trace_id, *rest4] = rest3
+                        if len(rest4) > 0:
+                            [content_hash, *rest5] = rest4
+                            if len(rest5) > 0:
+                                [author_id, *rest6] = rest5
             return AdditionalData(in_channel=in_channel, message_id=message_id, title=title, description=description,
                                   rerendering_round=rerendering_round, url=url, has_unknown=has_unknown,
-                                  filename=filename)
+                                  filename=filename, trace_id=trace_id, content_hash=content_hash,
+                                  author_id=author_id)
         else:
             return AdditionalData(in_channel=additional_data_raw, message_id=None, title=None, description=None,
                                   rerendering_round=None, url=None, has_unknown=False, filename=uuid.uuid4().hex)
 
+    @staticmethod
+    def trace_id_of(additional_data_raw) -> Optional[str]:
+        if additional_data_raw is None:
+            return None
+        return AdditionalData.reconstruct(additional_data_raw).trace_id
+
     def serialize(self):
         return [self.in_channel, self.message_id, self.title, self.description, self.rerendering_round, self.url,
-                self.has_unknown, self.filename]
+                self.has_unknown, self.filename, self.trace_id, self.content_hash, self.author_id]
@@ -0,0 +1,40 @@
+import os
+from typing import NamedTuple, Optional, List, Dict, Any
+
+from discord_downloader.demo_uploaders import DEMO_EXT_REGEX
+
+
+class ArchiveRule(NamedTuple):
+    extensions: Optional[List[str]] = None  # None means any extension
+    max_size: Optional[int] = None  # bytes; None means unlimited
+    demo_only: bool = False
+
+    def skip_reason(self, filename: str, size: int) -> Optional[str]:
+        """
+        :return: None if the attachment is to be archived, a human-readable reason otherwise
+        """
+        if self.demo_only and DEMO_EXT_REGEX.match(filename.lower()) is None:
+            return 'not a demo'
+        if self.extensions is not None:
+            ext = os.path.splitext(filename)[1].lower().lstrip('.')
+            if ext not in self._normalized_extensions():
+                return f'extension {ext!r} not allowed'
+        if self.max_size is not None and size > self.max_size:
+            return f'size {size} B exceeds {self.max_size} B'
+        return None
+
+    def _normalized_extensions(self):
+        return [ext.lower().lstrip('.') for ext in self.extensions]
+
+
+class ArchiveRules:
+    """
+    Archive rules per channel name. The rule for None applies to channels without their own rule.
+    """
+
+    def __init__(self, rules: Dict[Optional[str], Dict[str, Any]]):
+        self._rules = {channel: ArchiveRule(**rule) for channel, rule in rules.items()}
+        self._default = self._rules.get(None, ArchiveRule())
+
+    def for_channel(self, channel_name: str) -> ArchiveRule:
+        return self._rules.get(channel_name, self._default)
@@ -0,0 +1,115 @@
+import abc
+import logging
+import os
+import re
+
+import filelock
+from aiohttp import ClientSession
+from discord import Attachment
+
+from discord_downloader.io_executor import DEFAULT_IO_EXECUTOR, fsync_file
+
+CONTENT_RANGE_REGEX = re.compile("^bytes ([0-9]+)-")
+
+
+class IncompleteDownloadException(Exception):
+
+    def __init__(self, attachment: Attachment, size: int):
+        super().__init__(f'Download of {attachment.url} is incomplete: {size} of {attachment.size} bytes')
+
+
+class AttachmentDownloader(abc.ABC):
+
+    @abc.abstractmethod
+    async def download(self, attachment: Attachment) -> str:
+        """
+        Downloads the attachment to a temporary file in the same filesystem as the attachments directory.
+        :return: name of the temporary file; the caller is responsible for moving or removing it
+        """
+        pass
+
+
+class SavingAttachmentDownloader(AttachmentDownloader):
+    """
+    Downloads the attachment via Attachment.save. A download that is interrupted has to start over.
+    """
+
+    def __init__(self, temp_directory: str):
+        self._temp_directory = temp_directory
+
+    async def download(self, attachment: Attachment) -> str:
+        tmp_file = os.path.join(self._temp_directory, f"{attachment.id}-{os.getpid()}")
+        with open(tmp_file, mode="wb") as f:
+            await attachment.save(f)
+            await DEFAULT_IO_EXECUTOR.run(fsync_file, f)
+        return tmp_file
+
+
+class ResumableAttachmentDownloader(AttachmentDownloader):
+    """
+    Keeps partial downloads as <attachment id>.part and resumes them using HTTP Range requests, so a dropped
+    connection or a restart doesn't mean downloading the whole attachment again. The result is checked against
+    Attachment.size.
+    """
+    LOGGER = logging.getLogger('ResumableAttachmentDownloader')
+
+    def __init__(self, temp_directory: str, chunk_size: int = 64 * 1024):
+        self._temp_directory = temp_directory
+        self._chunk_size = chunk_size
+
+    async def download(self, attachment: Attachment) -> str:
+        partial_file = os.path.join(self._temp_directory, f"{attachment.id}.part")
+        lock = filelock.FileLock(f"{partial_file}.lock")
+        try:
+            lock.acquire(timeout=0)
+        except filelock.Timeout:
+            # Another process (e.g., a backfill) downloads the same attachment right now.
+            return await self._download_to(attachment, f"{partial_file}-{os.getpid()}")
+        try:
+            return await self._download_to(attachment, partial_file)
+        finally:
+            lock.release()
+            try:
+                os.remove(f"{partial_file}.lock")
+            except FileNotFoundError:
+                pass
+
+    async def _download_to(self, attachment: Attachment, partial_file: str) -> str:
+        offset = os.path.getsize(partial_file) if os.path.exists(partial_file) else 0
+        if offset > attachment.size:
+            self.LOGGER.warning(f"Partial file {partial_file} is larger than {attachment.url}, starting over")
+            offset = 0
+        if offset < attachment.size or attachment.size == 0:
+            if offset > 0:
+                self.LOGGER.info(f"Resuming download of {attachment.url} from {offset}/{attachment.size} bytes")
+            async with ClientSession() as session:
+                headers = {'Range': f'bytes={offset}-'} if offset > 0 else {}
+                async with session.get(attachment.url, headers=headers) as response:
+                    if response.status == 206 and self._range_start(response) == offset:
+                        mode = "ab"
+                    else:
+                        # The server has ignored the range (or it can't satisfy it), so we have to start over.
+                        if response.status == 416:
+                            return await self._restart(attachment, partial_file)
+                        response.raise_for_status()
+                        mode = "wb"
+                    # the lane of the file keeps the chunks in order
+                    with open(partial_file, mode) as f:
+                        async for chunk in response.content.iter_chunked(self._chunk_size):
+                            await DEFAULT_IO_EXECUTOR.run(f.write, chunk, key=partial_file)
+                        await DEFAULT_IO_EXECUTOR.run(fsync_file, f, key=partial_file)
+        size = os.path.getsize(partial_file)
+        if size != attachment.size:
+            if size > attachment.size:
+                os.remove(partial_file)
+            raise IncompleteDownloadException(attachment, size)
+        return partial_file
+
+    async def _restart(self, attachment: Attachment, partial_file: str) -> str:
+        os.remove(partial_file)
+        return await self._download_to(attachment, partial_file)
+
+    @staticmethod
+    def _range_start(response) -> int:
+        match = CONTENT_RANGE_REGEX.match(response.headers.get('Content-Range', ''))
+        return int(match.group(1)) if match else -1
@@ -1,18 +1,22 @@
 import os
 
 from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 from settings import STATE_DIRECTORY
 import os
+import sqlite3
 from os.path import dirname
+from typing import Optional
 
-import alembic.config
-from alembic import command
-from sqlalchemy import create_engine, Table, Column, INTEGER, VARCHAR
+from sqlalchemy import create_engine, Table, Column, INTEGER, VARCHAR, FLOAT, Index, event
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
 
+# Revision of the newest migration in alembic/versions. It allows us to skip loading Alembic when the DB is up to date.
+SCHEMA_HEAD_REVISION = 'b7e3f1a9c254'
+
 
 class RenderedDemo(Base):
     __table__ = Table(
@@ -21,21 +25,118 @@ class RenderedDemo(Base):
         Column('id', INTEGER(), autoincrement=True, primary_key=True),
         Column('filename', VARCHAR(255), unique=True),
         Column('url', VARCHAR(255)),
+        Column('content_hash', VARCHAR(64), nullable=True, index=True),
+    )
+
+
+class DemoStageTiming(Base):
+    __table__ = Table(
+        'demo_stage_timings',
+        Base.metadata,
+        Column('id', INTEGER(), autoincrement=True, primary_key=True),
+        Column('trace_id', VARCHAR(32), nullable=False, index=True),
+        Column('stage', VARCHAR(32), nullable=False, index=True),
+        Column('started_at', FLOAT(), nullable=False),
+        Column('finished_at', FLOAT(), nullable=True),
+    )
+
+
+class ArchivedUrl(Base):
+    __table__ = Table(
+        'archived_urls',
+        Base.metadata,
+        Column('id', INTEGER(), autoincrement=True, primary_key=True),
+        Column('normalized_url', VARCHAR(2048), nullable=False, unique=True),
+        Column('url', VARCHAR(2048), nullable=False),
+        Column('reversed_domain', VARCHAR(255), nullable=False, index=True),
+        Column('first_message_url', VARCHAR(255), nullable=False),
+        Column('first_seen_at', FLOAT(), nullable=False),
+        Column('last_seen_at', FLOAT(), nullable=False),
+        Column('occurrences', INTEGER(), nullable=False),
+        Column('skip_reason', VARCHAR(255), nullable=True),
+    )
+
+
+class DemoMetadata(Base):
+    __table__ = Table(
+        'demo_metadata',
+        Base.metadata,
+        Column('id', INTEGER(), autoincrement=True, primary_key=True),
+        Column('content_hash', VARCHAR(64), nullable=False, unique=True),
+        Column('filename', VARCHAR(255), nullable=False),
+        Column('message_url', VARCHAR(255), nullable=True),
+        # NOCASE, so case-insensitive lookups can use the indexes
+        Column('player', VARCHAR(255, collation='NOCASE'), nullable=True, index=True),
+        Column('map', VARCHAR(255, collation='NOCASE'), nullable=True),
+        Column('physics', VARCHAR(64, collation='NOCASE'), nullable=True),
+        Column('time', VARCHAR(32), nullable=True),
+        Column('time_ms', INTEGER(), nullable=True),
+        Column('analyzer_version', INTEGER(), nullable=False),
+        Column('analyzed_at', FLOAT(), nullable=False),
+        Index('ix_demo_metadata_map_physics_time_ms', 'map', 'physics', 'time_ms'),
     )
 
 
 def get_async_db_connection_url():
-    return f"sqlite+aiosqlite:///{STATE_DIRECTORY}/db.sqlite"
+    return f"sqlite+aiosqlite:///{get_db_file()}"
 
 
 def get_blocking_db_connection_url():
-    return f"sqlite+pysqlite:///{STATE_DIRECTORY}/db.sqlite"
+    return f"sqlite+pysqlite:///{get_db_file()}"
 
 
-def create_current_db_engine():
-    connection = create_async_engine(get_async_db_connection_url(), echo=False)
+def get_db_file():
+    return f"{STATE_DIRECTORY}/db.sqlite"
+
+
+def get_current_db_revision() -> Optional[str]:
+    """
+    Reads the schema revision directly from the alembic_version table, which is much cheaper than asking Alembic.
+    """
+    if not os.path.exists(get_db_file()):
+        return None
+    connection = sqlite3.connect(get_db_file())
+    try:
+        row = connection.execute("SELECT version_num FROM alembic_version").fetchone()
+        return None if row is None else row[0]
+    except sqlite3.OperationalError:
+        # no alembic_version table yet
+        return None
+    finally:
+        connection.close()
+
+
+def upgrade_db_schema():
+    # Alembic is imported lazily, because it is needed only when there is a pending migration.
+    import alembic.config
+    from alembic import command
     alembic_cfg = alembic.config.Config()
     alembic_cfg.set_main_option('script_location', os.path.join(dirname(__file__), "..", "alembic"))
     # alembic_cfg.attributes['connection'] = connection.sync_engine
     command.upgrade(alembic_cfg, 'head')
+
+
+def _configure_connection(dbapi_connection, connection_record):
+    # WAL lets readers run alongside the writer and, with synchronous=NORMAL, commits don't wait for fsync (only
+    # checkpoints do). A crash can lose the last few commits, but it cannot corrupt the DB.
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+def create_current_db_engine():
+    # The aiosqlite dialect defaults to NullPool, i.e., a new connection (with an empty statement cache) for every
+    # transaction. A pool keeps the connections and their prepared statements.
+    connection = create_async_engine(
+        get_async_db_connection_url(),
+        echo=False,
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=2,
+        max_overflow=8,
+        connect_args={'cached_statements': 256},
+    )
+    event.listen(connection.sync_engine, 'connect', _configure_connection)
+    if get_current_db_revision() != SCHEMA_HEAD_REVISION:
+        upgrade_db_schema()
     return connection
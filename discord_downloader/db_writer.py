@@ -0,0 +1,112 @@
+import asyncio
+import logging
+from typing import List, Tuple, Optional
+
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncConnection
+
+
+class BatchingDbWriter:
+    """
+    Funnels all DB writes of the process through one connection and commits them in groups: statements that arrive
+    within the window (or while the previous group is being committed) share a single transaction. Statements are
+    executed in the order they have been submitted.
+
+    When a group fails, its statements are retried one by one, so a bad statement fails only its own caller.
+    """
+    LOGGER = logging.getLogger('BatchingDbWriter')
+
+    def __init__(self, conn: AsyncEngine, window: float = 0.005, max_batch: int = 1000):
+        self.engine = conn
+        self._window = window
+        self._max_batch = max_batch
+        self._pending: List[Tuple[Optional[object], Optional[asyncio.Future]]] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def execute(self, statement) -> int:
+        """
+        Executes the statement in the next group and waits for the commit.
+        :return: number of affected rows
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue(statement, future)
+        return await future
+
+    def submit(self, statement) -> None:
+        """
+        Like execute, but doesn't wait for the commit. Errors are just logged.
+        """
+        self._enqueue(statement, None)
+
+    async def flush(self) -> None:
+        """
+        Waits until everything submitted so far is committed.
+        """
+        if self._task is not None:
+            await self.execute(None)
+
+    async def close(self) -> None:
+        """
+        Flushes pending writes and disposes the engine. The pooled connections have their own (non-daemon) threads,
+        which would otherwise keep the process alive.
+        """
+        await self.flush()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.engine.dispose()
+
+    def _enqueue(self, statement, future: Optional[asyncio.Future]):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        self._pending.append((statement, future))
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            if self._window > 0 and len(self._pending) < self._max_batch:
+                await asyncio.sleep(self._window)
+            batch = self._pending[:self._max_batch]
+            self._pending = self._pending[self._max_batch:]
+            if len(self._pending) == 0:
+                self._wakeup.clear()
+            results = await self._commit(batch)
+            for (statement, future), result in zip(batch, results):
+                if future is None:
+                    if isinstance(result, Exception):
+                        self.LOGGER.error(f"Cannot execute {statement}: {result}")
+                elif not future.done():
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+
+    async def _commit(self, batch) -> List:
+        statements = [statement for statement, _ in batch]
+        try:
+            return await self._execute_all(statements)
+        except Exception as e:
+            if len(statements) == 1:
+                return [e]
+        results = []
+        for statement in statements:
+            try:
+                [result] = await self._execute_all([statement])
+                results.append(result)
+            except Exception as e:
+                results.append(e)
+        return results
+
+    async def _execute_all(self, statements) -> List[int]:
+        async with self.engine.begin() as connection:
+            connection: AsyncConnection
+            results = []
+            for statement in statements:
+                # None is just a marker for flush
+                results.append(0 if statement is None else (await connection.execute(statement)).rowcount)
+            return results
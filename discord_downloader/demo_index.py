@@ -0,0 +1,117 @@
+import re
+import time
+from typing import Dict, NamedTuple, Optional
+
+from sqlalchemy import select, func
+from sqlalchemy.dialects.sqlite import insert
+
+from discord_downloader.db import DemoMetadata
+from discord_downloader.db_writer import BatchingDbWriter
+
+# Bump when the fields extracted from DemoAnalyzer output change, so the demos analyzed before can be found and
+# re-analyzed.
+ANALYZER_VERSION = 1
+
+TIME_REGEX = re.compile(r'^\d+(?:[.:]\d+)*$')
+
+
+class DemoSummary(NamedTuple):
+    player: Optional[str]
+    map: Optional[str]
+    physics: Optional[str]
+    time: Optional[str]  # as shown by DemoCleaner3, e.g., 01.23.456
+    time_ms: Optional[int]
+
+
+def extract_physics(gameplay: Optional[str]) -> Optional[str]:
+    if gameplay is None:
+        return None
+    match = re.compile('.*\\((.*)\\)$').match(gameplay)
+    if match is None:
+        return gameplay
+    else:
+        return match.group(1)
+
+
+def parse_time(demo_time: Optional[str]) -> Optional[int]:
+    """
+    Milliseconds from DemoCleaner3's time. The last part are milliseconds, the ones before it seconds, minutes and
+    hours (e.g., 01.23.456 or 00.123).
+    """
+    if demo_time is None or TIME_REGEX.match(demo_time.strip()) is None:
+        return None
+    *higher, millis = re.split('[.:]', demo_time.strip())
+    if len(higher) > 3:
+        return None
+    result = int(millis.ljust(3, '0')[:3])
+    for unit, value in zip([1000, 60 * 1000, 60 * 60 * 1000], reversed(higher)):
+        result += int(value) * unit
+    return result
+
+
+def summarize(demo_info: Dict[str, Dict[str, str]]) -> DemoSummary:
+    demo_time = demo_info['record'].get('bestTime')
+    return DemoSummary(
+        player=demo_info['player'].get('uncoloredName') or demo_info['player'].get('df_name'),
+        map=demo_info['client'].get('mapname'),
+        physics=extract_physics(demo_info['game'].get('gameplay')),
+        time=demo_time,
+        time_ms=parse_time(demo_time),
+    )
+
+
+def upsert_statement(content_hash: str, filename: str, summary: DemoSummary, message_url: Optional[str] = None,
+                     analyzer_version: int = ANALYZER_VERSION, analyzed_at: Optional[float] = None):
+    statement = insert(DemoMetadata).values(
+        content_hash=content_hash,
+        filename=filename,
+        message_url=message_url,
+        player=summary.player,
+        map=summary.map,
+        physics=summary.physics,
+        time=summary.time,
+        time_ms=summary.time_ms,
+        analyzer_version=analyzer_version,
+        analyzed_at=time.time() if analyzed_at is None else analyzed_at,
+    )
+    updated_columns = ['filename', 'player', 'map', 'physics', 'time', 'time_ms', 'analyzer_version', 'analyzed_at']
+    return statement.on_conflict_do_update(
+        index_elements=[DemoMetadata.content_hash],
+        set_={
+            **{column: statement.excluded[column] for column in updated_columns},
+            # a re-analysis doesn't know the message; the first known one is kept
+            'message_url': func.coalesce(DemoMetadata.message_url, statement.excluded.message_url),
+        }
+    )
+
+
+def search_query(map: Optional[str] = None, player: Optional[str] = None, physics: Optional[str] = None,
+                 min_time_ms: Optional[int] = None, max_time_ms: Optional[int] = None, limit: Optional[int] = None):
+    """
+    Demos matching all the given conditions, the fastest first. Map, player and physics are compared
+    case-insensitively, like the columns are indexed.
+    """
+    query = select(DemoMetadata)
+    if map is not None:
+        query = query.where(DemoMetadata.map == map)
+    if player is not None:
+        query = query.where(DemoMetadata.player == player)
+    if physics is not None:
+        query = query.where(DemoMetadata.physics == physics)
+    if min_time_ms is not None:
+        query = query.where(DemoMetadata.time_ms >= min_time_ms)
+    if max_time_ms is not None:
+        query = query.where(DemoMetadata.time_ms <= max_time_ms)
+    query = query.order_by(DemoMetadata.time_ms.is_(None), DemoMetadata.time_ms, DemoMetadata.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+class DemoIndex:
+
+    def __init__(self, db_writer: BatchingDbWriter):
+        self._db_writer = db_writer
+
+    async def record(self, content_hash: str, filename: str, summary: DemoSummary, message_url: Optional[str]):
+        await self._db_writer.execute(upsert_statement(content_hash, filename, summary, message_url))
@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import os
+import time
+from tempfile import NamedTemporaryFile
+from typing import NamedTuple, Optional, List, Iterator, Set
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from discord_downloader.db import DemoMetadata
+from discord_downloader.db_writer import BatchingDbWriter
+from discord_downloader.demo_analyzer import DemoAnalyzer
+from discord_downloader.demo_index import ANALYZER_VERSION, summarize, upsert_statement
+from discord_downloader.demo_uploaders import DEMO_EXT_REGEX
+from discord_downloader.io_executor import IoExecutor, DEFAULT_IO_EXECUTOR
+from discord_downloader.movers import file_sha256
+from discord_downloader.pack_store import PackStore, PackEntry
+
+
+class ArchivedDemo(NamedTuple):
+    # For packed demos, where the loose file would be (see PackingMover), so the names match the ones from the bot.
+    filename: str
+    pack_entry: Optional[PackEntry]
+
+
+def find_archived_demos(attachments_directory: str, pack_store: Optional[PackStore] = None) -> List[ArchivedDemo]:
+    demos = {}
+    if pack_store is not None:
+        for entry in pack_store.entries():
+            filename = os.path.join(attachments_directory, entry.name)
+            demos[filename] = ArchivedDemo(filename, entry)
+    for name in os.listdir(attachments_directory):
+        if DEMO_EXT_REGEX.match(name) is not None:
+            filename = os.path.join(attachments_directory, name)
+            # a loose file takes precedence over the packed one
+            demos[filename] = ArchivedDemo(filename, None)
+    return sorted(demos.values())
+
+
+class ReanalysisProgress:
+
+    def __init__(self, total: int):
+        self.total = total
+        self.analyzed = 0
+        self.skipped = 0
+        self.failed = 0
+        self._started_at = time.monotonic()
+
+    @property
+    def done(self) -> int:
+        return self.analyzed + self.skipped + self.failed
+
+    def __str__(self):
+        elapsed = time.monotonic() - self._started_at
+        rate = self.done / elapsed if elapsed > 0 else 0
+        eta = f", ETA {(self.total - self.done) / rate:.0f} s" if rate > 0 and self.done < self.total else ""
+        return f"{self.done}/{self.total} demos (analyzed {self.analyzed}, skipped {self.skipped}, " \
+               f"failed {self.failed}), {rate:.1f}/s{eta}"
+
+
+class DemoReanalyzer:
+    """
+    Runs DemoAnalyzer over archived demos and stores the results in the demo index. Demos whose file name or content
+    hash has already been analyzed by the current ANALYZER_VERSION are skipped; results are committed as they come, so
+    an interrupted run continues where it has stopped.
+    """
+    LOGGER = logging.getLogger('DemoReanalyzer')
+
+    def __init__(self, demo_analyzer: DemoAnalyzer, db_writer: BatchingDbWriter, temp_directory: str,
+                 pack_store: Optional[PackStore] = None, concurrency: Optional[int] = None,
+                 analyzer_version: int = ANALYZER_VERSION, progress_interval: float = 5.0,
+                 io_executor: IoExecutor = DEFAULT_IO_EXECUTOR):
+        self._demo_analyzer = demo_analyzer
+        self._db_writer = db_writer
+        self._temp_directory = temp_directory
+        self._pack_store = pack_store
+        # DemoCleaner3 is CPU-bound, so one analysis per core
+        self._concurrency = concurrency or os.cpu_count() or 1
+        self._analyzer_version = analyzer_version
+        self._progress_interval = progress_interval
+        self._io_executor = io_executor
+        self._analyzed_hashes: Set[str] = set()
+        self._analyzed_filenames: Set[str] = set()
+
+    async def run(self, demos: List[ArchivedDemo], force: bool = False) -> ReanalysisProgress:
+        if not force:
+            await self._load_analyzed()
+        progress = ReanalysisProgress(len(demos))
+        pending = iter(demos)
+        reporter = asyncio.get_running_loop().create_task(self._report(progress))
+        try:
+            await asyncio.gather(*(self._worker(pending, progress) for _ in range(self._concurrency)))
+        finally:
+            reporter.cancel()
+        self.LOGGER.info(f"Done: {progress}")
+        return progress
+
+    async def _load_analyzed(self):
+        async with self._db_writer.engine.connect() as connection:
+            connection: AsyncConnection
+            rows = (await connection.execute(
+                select(DemoMetadata.content_hash, DemoMetadata.filename)
+                .where(DemoMetadata.analyzer_version >= self._analyzer_version)
+            )).fetchall()
+        self._analyzed_hashes = {row.content_hash for row in rows}
+        self._analyzed_filenames = {row.filename for row in rows}
+
+    async def _worker(self, pending: Iterator[ArchivedDemo], progress: ReanalysisProgress):
+        # the workers share the iterator, so at most `concurrency` demos are in progress
+        for demo in pending:
+            try:
+                if await self._reanalyze(demo):
+                    progress.analyzed += 1
+                else:
+                    progress.skipped += 1
+            except Exception:
+                self.LOGGER.warning(f"Cannot analyze {demo.filename}", exc_info=True)
+                progress.failed += 1
+
+    async def _reanalyze(self, demo: ArchivedDemo) -> bool:
+        # Archived files are never rewritten, so a known name doesn't need to be hashed again.
+        if demo.filename in self._analyzed_filenames:
+            return False
+        if demo.pack_entry is not None:
+            content_hash = demo.pack_entry.sha256
+        else:
+            content_hash = await self._io_executor.run(file_sha256, demo.filename)
+        if content_hash in self._analyzed_hashes:
+            return False
+        # claimed before analyzing, so a copy of the same demo isn't analyzed by another worker meanwhile
+        self._analyzed_hashes.add(content_hash)
+        try:
+            if demo.pack_entry is None:
+                demo_info = await self._demo_analyzer.analyze(demo.filename)
+            else:
+                tmp_file = await self._io_executor.run(self._extract, demo.pack_entry)
+                try:
+                    demo_info = await self._demo_analyzer.analyze(tmp_file)
+                finally:
+                    await self._io_executor.run(os.remove, tmp_file)
+            await self._db_writer.execute(upsert_statement(content_hash, demo.filename, summarize(demo_info),
+                                                           analyzer_version=self._analyzer_version))
+        except BaseException:
+            self._analyzed_hashes.discard(content_hash)
+            raise
+        return True
+
+    def _extract(self, entry: PackEntry) -> str:
+        with NamedTemporaryFile(dir=self._temp_directory, suffix=f"-{entry.name}", delete=False) as f:
+            f.write(self._pack_store.read(entry))
+            return f.name
+
+    async def _report(self, progress: ReanalysisProgress):
+        while True:
+            await asyncio.sleep(self._progress_interval)
+            self.LOGGER.info(str(progress))
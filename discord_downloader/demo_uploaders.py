@@ -13,8 +13,10 @@ from os import path
 from tempfile import NamedTemporaryFile
 from typing import NamedTuple, Optional, List
 
+import filelock
 from aiohttp import ClientSession
 
+from discord_downloader.io_executor import DEFAULT_IO_EXECUTOR
 from settings import demo_rendering_local_odfe_discord_config_prefix
 
 
@@ -71,6 +73,15 @@ class DemoRenderer(abc.ABC):
     async def render(self, demo_filename: str, demo_data: bytes, round_id: Optional[int]) -> str:
         pass
 
+    async def start(self):
+        """
+        Called by the rendering queue before the first render.
+        """
+        pass
+
+    async def close(self):
+        pass
+
 
 class YoutubeUploader(RenderedDemoUploader):
     LOGGER = logging.getLogger('YoutubeUploader')
@@ -82,9 +93,7 @@ class YoutubeUploader(RenderedDemoUploader):
     async def upload(self, title: str, description: str, file: str):
         try:
             description_file = None
-            with NamedTemporaryFile(delete=False, ) as tf:
-                tf.write(description.encode("utf-8"))
-                description_file = tf.name
+            description_file = await DEFAULT_IO_EXECUTOR.run(_write_temp_file, description.encode("utf-8"))
             call = [
                 self._youtube_uploader_executable,
                 *self._youtube_uploader_params,
@@ -122,11 +131,17 @@ class YoutubeUploader(RenderedDemoUploader):
         finally:
             try:
                 if description_file is not None:
-                    os.remove(description_file)
+                    await DEFAULT_IO_EXECUTOR.run(os.remove, description_file)
             except FileNotFoundError:
                 pass
 
 
+def _write_temp_file(data: bytes) -> str:
+    with NamedTemporaryFile(delete=False) as tf:
+        tf.write(data)
+        return tf.name
+
+
 class VideoUploadException(Exception):
 
     def __init__(self, message, video_file):
@@ -136,41 +151,196 @@ class VideoUploadException(Exception):
 
 
 DEMO_EXT_REGEX = re.compile(".*\\.(dm_6[0-9])$")
+# names of the temporary files of OdfeDemoRenderer (see _prepare_job) and of the locks held by their owners
+ODFE_DEMO_REGEX = re.compile("^(?P<owner>[0-9a-f]{12})-[0-9.]+-[0-9a-f]{32}\\.dm_6[0-9]$")
+ODFE_CFG_REGEX = re.compile("^file-(?P<owner>[0-9a-f]{12})-[0-9.]+-[0-9a-f]{32}\\.cfg$")
+ODFE_LOCK_REGEX = re.compile("^odfe-(?P<owner>[0-9a-f]{12})\\.lock$")
+
+
+def _remove_if_exists(filename: str):
+    try:
+        os.remove(filename)
+    except FileNotFoundError:
+        pass
+
+
+class _OdfeJob(NamedTuple):
+    demo_filename: str
+    round_id: Optional[int]
+    demo_basename: str
+    video_basename: str
+    cfg_basename: str
+
+
+class _PendingRender(NamedTuple):
+    job: _OdfeJob
+    future: asyncio.Future
 
 
 class OdfeDemoRenderer(DemoRenderer):
+    """
+    Renders demos by oDFe. With max_batch_size > 1, demos that are being rendered at the same time (i.e., the rendering
+    queue has multiple rendering slots) share one oDFe session: each demo gets its own cfg, which plays the demo into
+    its own video and chains the next cfg through nextdemo, so the engine and assets are loaded just once per batch.
+
+    A demo that doesn't produce its video fails alone. When the whole oDFe run fails, the demos of the batch are
+    rendered again one by one, so a demo crashing oDFe doesn't take the others down with it.
+
+    Several renderers (e.g., render workers) can share the directories: the temporary files are named by the renderer
+    that owns them, which holds odfe-<owner>.lock in the demo directory from start to close. start removes just the
+    files of owners that don't hold their locks anymore.
+    """
+    LOGGER = logging.getLogger('OdfeDemoRenderer')
 
     def __init__(self, odfe_dir: str, odfe_executable: str, config_dir: str, demo_dir: str, video_dir: str,
-                 defrag_config: str):
+                 defrag_config: str, max_batch_size: int = 1, batch_window: float = 0.2):
         self._odfe_dir = odfe_dir
         self._odfe_executable = odfe_executable
         self._config_dir = config_dir
         self._demo_dir = demo_dir
         self._video_dir = video_dir
         self._defrag_config = defrag_config
+        self._max_batch_size = max_batch_size
+        self._batch_window = batch_window
+        self._pending: List[_PendingRender] = []
+        self._batcher: Optional[asyncio.Task] = None
+        self._owner = uuid.uuid4().hex[:12]
+        self._lock: Optional[filelock.FileLock] = None
 
     async def render(self, demo_filename: str, demo_data: bytes, round_id: Optional[int]) -> str:
-        id = f"{datetime.datetime.now().timestamp()}-{uuid.uuid4().hex}"
+        job = self._prepare_job(demo_filename, demo_data, round_id)
+        try:
+            if self._max_batch_size <= 1:
+                await self._run_odfe([job])
+                return self._video_of(job)
+            future = asyncio.get_running_loop().create_future()
+            self._pending.append(_PendingRender(job, future))
+            if self._batcher is None or self._batcher.done():
+                self._batcher = asyncio.get_running_loop().create_task(self._run_batches())
+            return await future
+        finally:
+            # not before, a failed batch renders its demos again one by one
+            _remove_if_exists(os.path.join(self._demo_dir, job.demo_basename))
+
+    async def start(self):
+        self._lock = filelock.FileLock(self._lock_file(self._owner))
+        self._lock.acquire(timeout=0)
+        # demos and configs of the renders interrupted by a crash or a restart
+        owners = set()
+        for directory, regex in [(self._demo_dir, ODFE_DEMO_REGEX), (self._config_dir, ODFE_CFG_REGEX),
+                                 (self._demo_dir, ODFE_LOCK_REGEX)]:
+            owners.update(m.group('owner') for m in map(regex.match, os.listdir(directory)) if m is not None)
+        dead_owners = {owner for owner in owners if owner != self._owner and not self._is_alive(owner)}
+        for directory, regex in [(self._demo_dir, ODFE_DEMO_REGEX), (self._config_dir, ODFE_CFG_REGEX)]:
+            orphans = [name for name in os.listdir(directory)
+                       if regex.match(name) is not None and regex.match(name).group('owner') in dead_owners]
+            for name in orphans:
+                _remove_if_exists(os.path.join(directory, name))
+            if len(orphans) > 0:
+                self.LOGGER.info(f"Removed {len(orphans)} orphaned files from {directory}")
+        for owner in dead_owners:
+            _remove_if_exists(self._lock_file(owner))
+
+    async def close(self):
+        if self._batcher is not None:
+            self._batcher.cancel()
+            await asyncio.gather(self._batcher, return_exceptions=True)
+            self._batcher = None
+        if self._lock is not None:
+            self._lock.release()
+            _remove_if_exists(self._lock_file(self._owner))
+            self._lock = None
+
+    def _lock_file(self, owner: str) -> str:
+        return os.path.join(self._demo_dir, f"odfe-{owner}.lock")
+
+    def _is_alive(self, owner: str) -> bool:
+        lock = filelock.FileLock(self._lock_file(owner))
+        try:
+            lock.acquire(timeout=0)
+        except filelock.Timeout:
+            return True
+        lock.release()
+        return False
+
+    def _prepare_job(self, demo_filename: str, demo_data: bytes, round_id: Optional[int]) -> _OdfeJob:
+        id = f"{self._owner}-{datetime.datetime.now().timestamp()}-{uuid.uuid4().hex}"
         demo_ext = DEMO_EXT_REGEX.match(demo_filename).group(1)
-        demo_tmp_basename = f"{id}.{demo_ext}"
-        demo_tmp_file = os.path.join(self._demo_dir, demo_tmp_basename)
-        video_file_basename = f"{id}.mp4"
-        with open(demo_tmp_file, 'wb') as f:
+        job = _OdfeJob(
+            demo_filename=demo_filename,
+            round_id=round_id,
+            demo_basename=f"{id}.{demo_ext}",
+            video_basename=f"{id}.mp4",
+            cfg_basename=f"file-{id}.cfg",
+        )
+        with open(os.path.join(self._demo_dir, job.demo_basename), 'wb') as f:
             f.write(demo_data)
-        cfg_file_content = "".join(map(lambda x: x+"\n", [
-            self._defrag_config if round_id is None else demo_rendering_local_odfe_discord_config_prefix(round_id),
-            f'demo "{demo_tmp_basename}"',
-            f'video-pipe "{video_file_basename}"',
-            'set nextdemo "wait 100; quit"',
-        ]))
-        cfg_bare_file_name = f"file-{id}.cfg"
-        cfg_file_name = os.path.join(self._config_dir, cfg_bare_file_name)
-        with open(cfg_file_name, "w") as f:
-            f.write(cfg_file_content)
+        return job
+
+    async def _run_batches(self):
+        while len(self._pending) > 0:
+            if len(self._pending) < self._max_batch_size:
+                await asyncio.sleep(self._batch_window)  # let the other rendering slots join the batch
+            # Configs of a rerendering round (e.g., cl_aviPipeFormat) would leak into the following demos.
+            round_id = self._pending[0].job.round_id
+            batch = [p for p in self._pending if p.job.round_id == round_id][:self._max_batch_size]
+            self._pending = [p for p in self._pending if not any(p is b for b in batch)]
+            results = await self._render_batch([p.job for p in batch])
+            for pending, result in zip(batch, results):
+                if pending.future.done():
+                    continue  # cancelled
+                if isinstance(result, Exception):
+                    pending.future.set_exception(result)
+                else:
+                    pending.future.set_result(result)
+
+    async def _render_batch(self, jobs: List[_OdfeJob]) -> List:
+        try:
+            await self._run_odfe(jobs)
+        except Exception as e:
+            if len(jobs) == 1:
+                return [e]
+            self.LOGGER.warning(f"oDFe has failed for a batch of {len(jobs)} demos, rendering them one by one: {e}")
+            for job in jobs:
+                _remove_if_exists(os.path.join(self._video_dir, job.video_basename))  # possibly incomplete
+            results = []
+            for job in jobs:
+                results.extend(await self._render_batch([job]))
+            return results
+        results = []
+        for job in jobs:
+            try:
+                results.append(self._video_of(job))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def _video_of(self, job: _OdfeJob) -> str:
+        video_file = os.path.join(self._video_dir, job.video_basename)
+        if path.exists(video_file):
+            return video_file
+        else:
+            raise Exception(f'Demo renderer: Rendering of {job.demo_filename} has failed, {video_file} was not created')
+
+    async def _run_odfe(self, jobs: List[_OdfeJob]):
+        cfg_file_names = []
+        for i, job in enumerate(jobs):
+            next_demo = f'exec {jobs[i + 1].cfg_basename}' if i + 1 < len(jobs) else 'wait 100; quit'
+            cfg_file_content = "".join(map(lambda x: x+"\n", [
+                self._defrag_config if job.round_id is None else
+                demo_rendering_local_odfe_discord_config_prefix(job.round_id),
+                f'demo "{job.demo_basename}"',
+                f'video-pipe "{job.video_basename}"',
+                f'set nextdemo "{next_demo}"',
+            ]))
+            cfg_file_name = os.path.join(self._config_dir, job.cfg_basename)
+            with open(cfg_file_name, "w") as f:
+                f.write(cfg_file_content)
+            cfg_file_names.append(cfg_file_name)
         proc: asyncio.subprocess.Process = await asyncio.create_subprocess_exec(
             path.join(self._odfe_dir, self._odfe_executable),
             "+exec",
-            cfg_bare_file_name,
+            jobs[0].cfg_basename,
             cwd=self._odfe_dir,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE
@@ -188,14 +358,8 @@ class OdfeDemoRenderer(DemoRenderer):
             except ProcessLookupError:
                 pass
             await proc.wait()
-            os.remove(cfg_file_name)
-            # os.remove(demo_tmp_file)
-
-        video_file = os.path.join(self._video_dir, video_file_basename)
-        if path.exists(video_file):
-            return video_file
-        else:
-            raise Exception(f'Demo renderer: Rendering of {demo_filename} has failed, {video_file} was not created')
+            for cfg_file_name in cfg_file_names:
+                os.remove(cfg_file_name)
 
 
 class IgmdbUploader(DemoUploader):
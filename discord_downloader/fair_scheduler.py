@@ -0,0 +1,71 @@
+from typing import Dict, Any, Iterable, Callable, Optional, TypeVar, Tuple
+
+T = TypeVar('T')
+
+DEFAULT_WEIGHT = 1.0
+
+
+class FairScheduler:
+    """
+    Weighted fair queuing (start-time fair queuing) of items from several flows, e.g., demos from several channels.
+    Each flow gets a share of the picks proportional to its weight, so a flow with many waiting items cannot make the
+    other ones wait. A flow that has been idle doesn't get credit for the idle time.
+
+    Every flow has the virtual time when its last item finished (finish tag). A waiting flow can start at
+    max(system virtual time, its finish tag), and the flow that can start first is picked; ties are broken by the
+    order of the items. Picking an item moves the system virtual time to its start and the finish tag of the flow by
+    1 / weight.
+
+    The scheduler keeps the weights and the tags in the given JSON-serializable dict (see default_state), so they
+    survive restarts along with the queue. Weights are keyed by the channel; with per-user flows, each user in a
+    channel gets the weight of the channel.
+    """
+
+    def __init__(self, state: Dict[str, Any]):
+        self._state = state
+
+    @staticmethod
+    def default_state() -> Dict[str, Any]:
+        return {
+            'weights': {},
+            'virtual_time': 0.0,
+            'finish_tags': {},
+        }
+
+    @property
+    def weights(self) -> Dict[str, float]:
+        return self._state['weights']
+
+    def set_weights(self, weights: Dict[str, float]):
+        for channel, weight in weights.items():
+            if weight <= 0:
+                raise ValueError(f"The weight of {channel} must be positive: {weight}")
+        self._state['weights'] = dict(weights)
+
+    def pick(self, items: Iterable[T], flow_of: Callable[[T], Tuple[str, Optional[str]]]) -> Optional[T]:
+        """
+        Picks the next item and charges its flow. Items of each flow are picked in the given order.
+        :param flow_of: returns (channel, user or None) of an item
+        """
+        virtual_time = self._state['virtual_time']
+        finish_tags = self._state['finish_tags']
+        first_items: Dict[str, Tuple[T, str]] = {}  # by the flow, in the order of the items
+        for item in items:
+            channel, user = flow_of(item)
+            flow = channel if user is None else f"{channel}/{user}"
+            if flow not in first_items:
+                first_items[flow] = (item, channel)
+        best = None
+        for flow, (item, channel) in first_items.items():
+            start = max(virtual_time, finish_tags.get(flow, 0.0))
+            if best is None or start < best[0]:
+                best = (start, flow, item, channel)
+        if best is None:
+            return None
+        start, flow, item, channel = best
+        self._state['virtual_time'] = start
+        finish_tags[flow] = start + 1.0 / self.weights.get(channel, DEFAULT_WEIGHT)
+        # A flow whose tag has been reached starts at the virtual time anyway; this keeps the state small.
+        for idle_flow in [f for f, tag in finish_tags.items() if tag <= start and f not in first_items]:
+            del finish_tags[idle_flow]
+        return item
@@ -0,0 +1,156 @@
+"""
+Recording of the Discord traffic that DownloaderClient consumes, so it can be replayed offline
+(benchmarks/gateway_replay.py). The recording is a JSON-lines file; every record has "t" (seconds since the recording
+started) and "kind":
+
+* channels: the bot user and the channels ({"id", "name", "guild_id", "guild", "check_all"})
+* message: a message ({"id", "channel_id", "content", "author", "mentions", "attachments"}), once per message id
+* on_message: {"channel_id", "message_id"} -- the gateway event
+* history: {"channel_id", "after", "before", "message_ids"} -- one history() call
+* attachment: {"id", "data"} -- base64 of the downloaded attachment, once per attachment id
+
+Recordings contain message contents and attachments, so they should be treated like the archive itself.
+"""
+import base64
+import json
+import logging
+import time
+from typing import Dict, Iterable, Set, Iterator, Optional
+
+from discord import Message, Attachment
+
+from discord_downloader.attachment_downloader import AttachmentDownloader
+from discord_downloader.io_executor import IoExecutor, DEFAULT_IO_EXECUTOR
+
+
+def _user(user) -> dict:
+    return {'id': user.id, 'name': user.name}
+
+
+def serialize_message(message: Message) -> dict:
+    return {
+        'id': message.id,
+        'channel_id': message.channel.id,
+        'content': message.content,
+        'author': _user(message.author),
+        'mentions': [_user(user) for user in message.mentions],
+        'attachments': [{'id': a.id, 'filename': a.filename, 'size': a.size, 'url': a.url}
+                        for a in message.attachments],
+    }
+
+
+def read_recording(filename: str) -> Iterator[dict]:
+    with open(filename) as f:
+        for line in f:
+            if line.strip() != "":
+                yield json.loads(line)
+
+
+class GatewayRecorder:
+    LOGGER = logging.getLogger('GatewayRecorder')
+
+    def __init__(self, filename: str, io_executor: IoExecutor = DEFAULT_IO_EXECUTOR):
+        self._filename = filename
+        self._io_executor = io_executor
+        self._started_at = time.monotonic()
+        self._recorded_messages: Set[int] = set()
+        self._recorded_attachments: Set[int] = set()
+        # opened in append mode, so a restarted bot continues the recording; times restart from zero
+        self._file = open(filename, "a")
+        self.LOGGER.info(f"Recording Discord traffic to {filename}")
+
+    def record_channels(self, channels: Dict[str, object], check_all_names: Iterable[str], bot_user):
+        check_all_names = set(check_all_names)
+        self._write('channels', {
+            'bot_user': _user(bot_user),
+            'channels': [{'id': channel.id, 'name': channel.name, 'guild_id': channel.guild.id,
+                          'guild': str(channel.guild), 'check_all': name in check_all_names}
+                         for name, channel in channels.items()],
+        })
+
+    def record_on_message(self, message: Message):
+        self._record_message(message)
+        self._write('on_message', {'channel_id': message.channel.id, 'message_id': message.id})
+
+    def record_history(self, channel, after: Optional[int], before: Optional[int], messages: Iterable[Message]):
+        message_ids = []
+        for message in messages:
+            self._record_message(message)
+            message_ids.append(message.id)
+        self._write('history', {'channel_id': channel.id, 'after': after, 'before': before,
+                                'message_ids': message_ids})
+
+    def record_attachment(self, attachment: Attachment, data: bytes):
+        if attachment.id in self._recorded_attachments:
+            return
+        self._recorded_attachments.add(attachment.id)
+        # encoded in the lane, attachments can be large
+        self._write('attachment', {'id': attachment.id}, data=data)
+
+    def wrap_channel(self, channel) -> 'RecordingChannel':
+        return RecordingChannel(channel, self)
+
+    def close(self):
+        self._io_executor.run_sync(self._file.close, key=self._filename)
+
+    def _record_message(self, message: Message):
+        if message.id in self._recorded_messages:
+            return
+        self._recorded_messages.add(message.id)
+        self._write('message', {'message': serialize_message(message)})
+
+    def _write(self, kind: str, record: dict, data: Optional[bytes] = None):
+        record = {'t': round(time.monotonic() - self._started_at, 6), 'kind': kind, **record}
+        # not awaited; the lane keeps the lines in order
+        self._io_executor.submit(self._write_line, record, data, key=self._filename)
+
+    def _write_line(self, record: dict, data: Optional[bytes]):
+        if data is not None:
+            record['data'] = base64.b64encode(data).decode('ascii')
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+
+
+class RecordingChannel:
+    """
+    Records what history() returns. It is used just for reading the history, so the channel itself stays the key of
+    the channel maps.
+    """
+
+    def __init__(self, channel, recorder: GatewayRecorder):
+        self._channel = channel
+        self._recorder = recorder
+        self.id = channel.id
+
+    def history(self, **kwargs):
+        return self._history(**kwargs)
+
+    async def _history(self, **kwargs):
+        messages = []
+        try:
+            async for message in self._channel.history(**kwargs):
+                messages.append(message)
+                yield message
+        finally:
+            after = kwargs.get('after')
+            before = kwargs.get('before')
+            self._recorder.record_history(self._channel, None if after is None else after.id,
+                                          None if before is None else before.id, messages)
+
+
+class RecordingAttachmentDownloader(AttachmentDownloader):
+
+    def __init__(self, downloader: AttachmentDownloader, recorder: GatewayRecorder):
+        self._downloader = downloader
+        self._recorder = recorder
+
+    async def download(self, attachment: Attachment) -> str:
+        tmp_file = await self._downloader.download(attachment)
+        # read before the caller moves the file
+        self._recorder.record_attachment(attachment, await DEFAULT_IO_EXECUTOR.run(_read_file, tmp_file))
+        return tmp_file
+
+
+def _read_file(filename: str) -> bytes:
+    with open(filename, 'rb') as f:
+        return f.read()
@@ -0,0 +1,153 @@
+import asyncio
+from typing import Any, Awaitable, Callable, List, NamedTuple, AsyncIterator, Optional, Set
+
+_END = object()
+
+
+class PipelineStage(NamedTuple):
+    name: str
+    process: Callable[[Any], Awaitable[Any]]
+    concurrency: int
+    # cleans up a result of this stage that is not passed to the next stage, because the pipeline has stopped
+    discard: Optional[Callable[[Any], Awaitable[None]]] = None
+
+
+class OrderedPipeline:
+    """
+    Runs items through stages connected by bounded queues. Each stage works on up to `concurrency` items at once and
+    keeps taking new items while the next stages are busy, until up to queue_size of its results wait for the next
+    stage (backpressure). The results are passed on in the order of the items, so the sink (e.g., a savepoint) sees
+    the items in the original order, no matter which one finished first.
+
+    When an item fails, the source is not read anymore and run() raises the exception once the pipeline has drained:
+    the items before the failed one go through all the stages and the sink, the work already started on the items
+    after it is finished, but they don't enter any other stage; their results are discarded (see PipelineStage). So a
+    stage with side effects that must not happen to the items after a failed one (as they will be processed again)
+    should have concurrency 1. When the source fails, the items read before are finished first.
+    """
+
+    def __init__(self, stages: List[PipelineStage], queue_size: int):
+        self._stages = stages
+        self._queue_size = queue_size
+
+    async def run(self, items: AsyncIterator[Any], sink: Callable[[Any], Awaitable[None]]):
+        loop = asyncio.get_running_loop()
+        # queues[i] is the input of the i-th stage (and the last one is the input of the sink); it holds futures of
+        # the items, in order
+        queues = [asyncio.Queue(maxsize=self._queue_size)] + \
+                 [asyncio.Queue(maxsize=self._queue_size + stage.concurrency) for stage in self._stages]
+        in_progress: Set[asyncio.Future] = set()
+        errors: List[Exception] = []
+        tasks = [loop.create_task(self._read_source(items, queues[0], errors))]
+        previous_stages = [None] + self._stages
+        for stage, previous_stage, input_queue, output_queue in zip(self._stages, previous_stages, queues, queues[1:]):
+            tasks.append(loop.create_task(self._run_stage(stage, previous_stage, input_queue, output_queue,
+                                                          in_progress, errors)))
+        tasks.append(loop.create_task(self._run_sink(sink, previous_stages[-1], queues[-1], errors)))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # nothing is left, unless cancelled from outside
+            for task in tasks + list(in_progress):
+                task.cancel()
+            await asyncio.gather(*tasks, *in_progress, return_exceptions=True)
+            for stage, queue in zip(self._stages, queues[1:]):
+                while not queue.empty():
+                    await self._discard(queue.get_nowait(), stage)
+        if len(errors) > 0:
+            raise errors[0]
+
+    @staticmethod
+    async def _read_source(items: AsyncIterator[Any], output_queue: asyncio.Queue, errors: List[Exception]):
+        loop = asyncio.get_running_loop()
+        try:
+            async for item in items:
+                if len(errors) > 0:
+                    break
+                future = loop.create_future()
+                future.set_result(item)
+                await output_queue.put(future)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            if hasattr(items, 'aclose'):
+                await items.aclose()  # e.g., stops the prefetching of the history when the pipeline has failed
+        await output_queue.put(_END)
+
+    async def _run_stage(self, stage: PipelineStage, previous_stage: Optional[PipelineStage],
+                         input_queue: asyncio.Queue, output_queue: asyncio.Queue, in_progress: Set[asyncio.Future],
+                         errors: List[Exception]):
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(stage.concurrency)
+        failed = []  # the failed items of this stage; no more items are started after one
+
+        async def process(item):
+            try:
+                return await stage.process(item)
+            except Exception:
+                failed.append(item)
+                raise
+            finally:
+                semaphore.release()
+
+        def track(task: asyncio.Future):
+            if not task.cancelled() and task.exception() is not None and len(errors) == 0:
+                errors.append(task.exception())  # stops the source early; raised in the order of items anyway
+
+        while True:
+            future = await input_queue.get()
+            if future is _END:
+                break
+            try:
+                item = await future
+            except Exception as e:
+                self._record(e, errors)
+                await self._discard_rest(input_queue, previous_stage)
+                break
+            await semaphore.acquire()
+            if len(failed) > 0:
+                semaphore.release()
+                await self._discard(future, previous_stage)
+                await self._discard_rest(input_queue, previous_stage)
+                break
+            task = loop.create_task(process(item))
+            in_progress.add(task)
+            task.add_done_callback(in_progress.discard)
+            task.add_done_callback(track)
+            await output_queue.put(task)
+        await output_queue.put(_END)
+
+    async def _run_sink(self, sink: Callable[[Any], Awaitable[None]], previous_stage: Optional[PipelineStage],
+                        input_queue: asyncio.Queue, errors: List[Exception]):
+        while True:
+            future = await input_queue.get()
+            if future is _END:
+                return
+            try:
+                await sink(await future)
+            except Exception as e:
+                self._record(e, errors)
+                await self._discard_rest(input_queue, previous_stage)
+                return
+
+    @staticmethod
+    def _record(e: Exception, errors: List[Exception]):
+        # The first failure in the order of the items is raised; a later item can fail first.
+        if e in errors:
+            errors.remove(e)
+        errors.insert(0, e)
+
+    async def _discard_rest(self, input_queue: asyncio.Queue, previous_stage: Optional[PipelineStage]):
+        while True:
+            future = await input_queue.get()
+            if future is _END:
+                return
+            await asyncio.wait([future])  # the work already started is finished
+            await self._discard(future, previous_stage)
+
+    @staticmethod
+    async def _discard(future, stage: Optional[PipelineStage]):
+        if future is _END or not future.done() or future.cancelled() or future.exception() is not None:
+            return  # a failed item is cleaned up by its stage
+        if stage is not None and stage.discard is not None:
+            await stage.discard(future.result())
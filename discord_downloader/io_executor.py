@@ -0,0 +1,73 @@
+import asyncio
+import concurrent.futures
+import functools
+import os
+import threading
+from typing import Callable, TypeVar, Optional, Hashable, List, IO
+
+T = TypeVar('T')
+
+
+class IoExecutor:
+    """
+    Runs blocking file operations (writes, fsync, renames) in threads, so they don't stall the event loop.
+
+    Operations with the same key run one after another in the order they have been submitted, even when the caller
+    doesn't wait for them (e.g., it has been cancelled); this is what keeps writes of a state file ordered. Keys are
+    spread over a fixed number of single-threaded lanes. Operations without a key run in a shared pool.
+    """
+
+    def __init__(self, lanes: int = 4, max_workers: int = 4):
+        self._lane_count = lanes
+        self._max_workers = max_workers
+        self._lanes: Optional[List[concurrent.futures.ThreadPoolExecutor]] = None
+        self._pool: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._init_lock = threading.Lock()
+
+    async def run(self, fn: Callable[..., T], *args, key: Optional[Hashable] = None) -> T:
+        return await asyncio.wrap_future(self.submit(fn, *args, key=key))
+
+    def run_sync(self, fn: Callable[..., T], *args, key: Optional[Hashable] = None) -> T:
+        """
+        Like run, but blocks the caller. Meant for shutdown, when the operation still has to be ordered after the
+        pending ones with the same key.
+        """
+        return self.submit(fn, *args, key=key).result()
+
+    def submit(self, fn: Callable[..., T], *args, key: Optional[Hashable] = None) -> concurrent.futures.Future:
+        self._ensure_started()
+        executor = self._pool if key is None else self._lanes[hash(key) % self._lane_count]
+        return executor.submit(functools.partial(fn, *args))
+
+    def shutdown(self):
+        with self._init_lock:
+            if self._pool is not None:
+                for executor in [*self._lanes, self._pool]:
+                    executor.shutdown(wait=True)
+                self._lanes = None
+                self._pool = None
+
+    def _ensure_started(self):
+        if self._pool is None:
+            with self._init_lock:
+                if self._pool is None:
+                    self._lanes = [concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix=f'io-lane-{i}')
+                                   for i in range(self._lane_count)]
+                    self._pool = concurrent.futures.ThreadPoolExecutor(self._max_workers, thread_name_prefix='io')
+
+
+# shared by the whole process unless a component is given its own
+DEFAULT_IO_EXECUTOR = IoExecutor()
+
+
+def fsync_file(f: IO):
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def write_file_atomically(filename: str, content: str):
+    tmp_filename = f"{filename}.tmp"
+    with open(tmp_filename, "w") as f:
+        f.write(content)
+        fsync_file(f)
+    os.replace(tmp_filename, filename)
@@ -2,8 +2,10 @@ from abc import abstractmethod, ABC
 from typing import Awaitable, Any, Union
 from typing import List, Callable
 
+from discord_downloader.additional_data import AdditionalData
 from discord_downloader.demo_uploaders import DemoUploader, QueueFullException
 from discord_downloader.persistent_state import StoredState
+from discord_downloader.tracing import StageTracer, NopStageTracer, STAGE_ENQUEUE, STAGE_RENDER, STAGE_ANNOUNCE
 
 
 class RenderingQueue(ABC):
@@ -50,11 +52,25 @@ class PollingRenderingQueue(RenderingQueue):
         pass
 
 
+class NopRenderingQueue(PollingRenderingQueue):
+
+    async def upload(self, url: str, resolution: int, title: str, description: str, additional_data=None) -> None:
+        pass
+
+    async def check_for_done(self, done_callback: Callable[[str, Any], Awaitable[None]],
+                             failed_callback: Callable[[int, Exception, Any], Awaitable[None]]):
+        pass
+
+    async def retry_uploads(self):
+        pass
+
+
 class LocallyQueuedUploader(PollingRenderingQueue):
 
-    def __init__(self, uploader: DemoUploader, state: StoredState):
+    def __init__(self, uploader: DemoUploader, state: StoredState, tracer: StageTracer = NopStageTracer()):
         self._uploader = uploader
         self._state = state
+        self._tracer = tracer
 
     async def upload(self, url: str, resolution: int, title: str, description: str, additional_data = None) -> None:
         try:
@@ -62,14 +78,14 @@ class LocallyQueuedUploader(PollingRenderingQueue):
                 raise QueueFullException()
             await self._bare_upload(url=url, resolution=resolution, title=title, description=description,
                                     additional_data=additional_data)
-            self._state.flush()
+            await self._state.flush()
         except QueueFullException:
             self._queue_full = True
-            self._local_queue_add(url, resolution, title, description, additional_data)
+            await self._local_queue_add(url, resolution, title, description, additional_data)
 
-    def _local_queue_add(self, url: str, resolution: int, title: str, description: str, additional_data):
+    async def _local_queue_add(self, url: str, resolution: int, title: str, description: str, additional_data):
         self._local_queue.append([url, resolution, title, description, additional_data])
-        self._state.flush()
+        await self._state.flush()
 
     async def check_for_done(self, done_callback: Callable[[str, Any], Awaitable[None]],
                              failed_callback: Callable[[int, Exception, Any], Awaitable[None]]):
@@ -79,16 +95,19 @@ class LocallyQueuedUploader(PollingRenderingQueue):
             else:
                 id = item
                 additional_data = None
+            trace_id = AdditionalData.trace_id_of(additional_data)
             try:
                 status = await self._uploader.check_status(id)
                 if status is not None:
-                    await done_callback(status, additional_data)
+                    await self._tracer.finish(trace_id, STAGE_RENDER)
+                    async with self._tracer.stage(trace_id, STAGE_ANNOUNCE):
+                        await done_callback(status, additional_data)
                     self._uploaded_queue.remove(item)
-                    self._state.flush()
+                    await self._state.flush()
             except Exception as e:
                 await failed_callback(id, e, additional_data)
                 self._uploaded_queue.remove(item)
-                self._state.flush()
+                await self._state.flush()
 
     async def retry_uploads(self):
         self._queue_full = False
@@ -106,7 +125,7 @@ class LocallyQueuedUploader(PollingRenderingQueue):
                 await self._bare_upload(url=url, resolution=resolution, title=title, description=description,
                                         additional_data=additional_data)
                 self._local_queue.pop(0)
-                self._state.flush()
+                await self._state.flush()
         except QueueFullException:
             pass
 
@@ -133,3 +152,6 @@ class LocallyQueuedUploader(PollingRenderingQueue):
     async def _bare_upload(self, url, resolution, title, description, additional_data):
         res = await self._uploader.upload(url=url, resolution=resolution, title=title, description=description)
         self._uploaded_queue.append([res.render_id, additional_data])
+        trace_id = AdditionalData.trace_id_of(additional_data)
+        await self._tracer.finish(trace_id, STAGE_ENQUEUE)
+        await self._tracer.start(trace_id, STAGE_RENDER)
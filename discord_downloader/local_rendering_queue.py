@@ -4,14 +4,17 @@ import logging
 import traceback
 from asyncio import Event, FIRST_EXCEPTION
 from datetime import timedelta
-from typing import List, Callable, Any, Awaitable
+from typing import List, Callable, Any, Awaitable, Optional, Dict, Tuple
 
 from aiohttp import ClientSession
 
 from discord_downloader.additional_data import AdditionalData
 from discord_downloader.demo_uploaders import DemoRenderer, RenderedDemoUploader, VideoUploadException
+from discord_downloader.fair_scheduler import FairScheduler
 from discord_downloader.local_queue import AutonomousRenderingQueue
 from discord_downloader.persistent_state import StoredState
+from discord_downloader.tracing import StageTracer, NopStageTracer, STAGE_ENQUEUE, STAGE_RENDER, STAGE_UPLOAD, \
+    STAGE_PUBLISH_DELAY, STAGE_ANNOUNCE
 
 
 async def wait_until(instant: datetime.datetime):
@@ -21,15 +24,40 @@ async def wait_until(instant: datetime.datetime):
         await asyncio.sleep(min(diff.total_seconds(), MAX_SLEEP))
 
 
+def _remove_identical(items: List, item):
+    # list.remove compares by equality, but the same demo can be in the queue twice
+    for i, x in enumerate(items):
+        if x is item:
+            del items[i]
+            return
+    raise ValueError(f"{item} not found")
+
+
 class LocalRenderingQueue(AutonomousRenderingQueue):
     LOGGER = logging.getLogger('LocalRenderingQueue')
 
     def __init__(self, demo_renderer: DemoRenderer, rendered_demo_uploader: RenderedDemoUploader, state: StoredState,
-                 delay_before_publishing: timedelta):
+                 delay_before_publishing: timedelta, tracer: StageTracer = NopStageTracer(), render_concurrency: int = 1,
+                 channel_weights: Optional[Dict[str, float]] = None, fair_per_user: bool = False):
+        """
+        :param channel_weights: replaces the channel weights stored in the state; None keeps them
+        :param fair_per_user: the users in a channel get their fair shares, too
+        """
         self._demo_renderer = demo_renderer
+        self._render_concurrency = render_concurrency
+        # items of the rendering queue that are being rendered right now (compared by identity)
+        self._rendering_in_progress: List[List] = []
+        # videos of the errors whose fail callbacks are running (e.g., the bot posts them to Discord)
+        self._reported_videos: List[str] = []
         self._rendered_demo_uploader = rendered_demo_uploader
         self._delay_before_publishing = delay_before_publishing
         self._state = state
+        # the state of older versions has no 'fair_queue'
+        self._scheduler = FairScheduler(state.value.setdefault('fair_queue', FairScheduler.default_state()))
+        if channel_weights is not None:
+            self._scheduler.set_weights(channel_weights)
+        self._fair_per_user = fair_per_user
+        self._tracer = tracer
         self._done_callbacks: List[Callable[[str, Any], Awaitable[None]]] = []
         self._fail_callbacks: List[Callable[[int, Exception, Any], Awaitable[None]]] = []
         self._rendering_queue_event = Event()
@@ -48,6 +76,13 @@ class LocalRenderingQueue(AutonomousRenderingQueue):
     def _waiting_queue(self) -> List[List]:
         return self._state.value['waiting_queue']
 
+    def videos_in_use(self) -> List[str]:
+        """
+        Rendered videos that are still needed: the ones waiting for the upload and the ones passed to the fail
+        callbacks (VideoUploadException) until the callbacks are done.
+        """
+        return [item[1] for item in self._upload_queue] + self._reported_videos
+
     def add_done_callback(self, done_callback: Callable[[str, Any], Awaitable[None]]):
         self._done_callbacks.append(done_callback)
 
@@ -56,39 +91,71 @@ class LocalRenderingQueue(AutonomousRenderingQueue):
 
     async def upload(self, url: str, resolution: int, title: str, description: str, additional_data=None) -> None:
         self._rendering_queue.append([url, title, description, additional_data])
-        self._state.flush()
+        await self._state.flush()
         self._rendering_queue_event.set()
 
     async def run(self):
-        coros = [self._run_rendering(), self._run_uploads(), self._run_publishing()]
-        loop = asyncio.get_running_loop()
-        tasks = list(map(lambda c: loop.create_task(c), coros))
-        await asyncio.wait(tasks, return_when=FIRST_EXCEPTION)
-        for task in tasks:
-            task.cancel()
-            await task
+        await self._demo_renderer.start()
+        try:
+            coros = [self._run_rendering(), self._run_uploads(), self._run_publishing()]
+            loop = asyncio.get_running_loop()
+            tasks = list(map(lambda c: loop.create_task(c), coros))
+            await asyncio.wait(tasks, return_when=FIRST_EXCEPTION)
+            for task in tasks:
+                task.cancel()
+                await task
+        finally:
+            await self._demo_renderer.close()
 
     async def _run_rendering(self):
+        # Items stay in the rendering queue until they are rendered, so they are rendered again after a restart.
+        await asyncio.gather(*(self._run_rendering_slot() for _ in range(self._render_concurrency)))
+
+    def _next_rendering_item(self) -> Optional[List]:
+        waiting = (item for item in self._rendering_queue
+                   if not any(item is in_progress for in_progress in self._rendering_in_progress))
+        return self._scheduler.pick(waiting, self._flow_of)
+
+    def _flow_of(self, item: List) -> Tuple[str, Optional[str]]:
+        additional_data = AdditionalData.reconstruct(item[3])
+        user = additional_data.author_id if self._fair_per_user else None
+        return str(additional_data.in_channel), None if user is None else str(user)
+
+    async def _run_rendering_slot(self):
         while True:
-            while len(self._rendering_queue) == 0:
+            item = self._next_rendering_item()
+            while item is None:
                 await self._rendering_queue_event.wait()  # prevents busy loop
                 self._rendering_queue_event.clear()
-            [url, title, description, additional_data] = self._rendering_queue[0]
-            round_id = AdditionalData.reconstruct(additional_data).rerendering_round
-            async with ClientSession() as session:
-                try:
+                item = self._next_rendering_item()
+            self._rendering_in_progress.append(item)
+            try:
+                await self._render_item(item)
+            finally:
+                _remove_identical(self._rendering_in_progress, item)
+
+    async def _render_item(self, item: List):
+        [url, title, description, additional_data] = item
+        round_id = AdditionalData.reconstruct(additional_data).rerendering_round
+        trace_id = AdditionalData.trace_id_of(additional_data)
+        if round_id is None:
+            # the enqueueing of re-render rounds is not traced; the stage finished with the first round
+            await self._tracer.finish(trace_id, STAGE_ENQUEUE)
+        async with ClientSession() as session:
+            try:
+                async with self._tracer.stage(trace_id, STAGE_RENDER):
                     resp = await session.get(url)
                     video_file = await self._demo_renderer.render(url, await resp.read(), round_id)
-                    if round_id is None:
-                        self._upload_queue.append([url, video_file, title, description, additional_data])
-                    else:
-                        exc = VideoUploadException('this video was requested to skip the usual upload', video_file)
-                        await self._report_error(url, exc, additional_data)
-                except Exception as e:
-                    await self._report_error(url, e, additional_data)
-                self._rendering_queue.pop(0)
-                self._state.flush()
-                self._upload_queue_event.set()
+                if round_id is None:
+                    self._upload_queue.append([url, video_file, title, description, additional_data])
+                else:
+                    exc = VideoUploadException('this video was requested to skip the usual upload', video_file)
+                    await self._report_error(url, exc, additional_data)
+            except Exception as e:
+                await self._report_error(url, e, additional_data)
+            _remove_identical(self._rendering_queue, item)
+            await self._state.flush()
+            self._upload_queue_event.set()
 
     async def _run_uploads(self):
         while True:
@@ -96,16 +163,19 @@ class LocalRenderingQueue(AutonomousRenderingQueue):
                 await self._upload_queue_event.wait()  # prevents busy loop
                 self._upload_queue_event.clear()
             [demo_url, video_file, title, description, additional_data] = self._upload_queue[0]
+            trace_id = AdditionalData.trace_id_of(additional_data)
             try:
-                video_url = await self._rendered_demo_uploader.upload(title, description, video_file)
+                async with self._tracer.stage(trace_id, STAGE_UPLOAD):
+                    video_url = await self._rendered_demo_uploader.upload(title, description, video_file)
                 datetime_ready = (datetime.datetime.now() + self._delay_before_publishing).timestamp()
                 print(f"datetime_ready: {datetime_ready}")
                 self._waiting_queue.append([datetime_ready, video_url, additional_data, demo_url])
+                await self._tracer.start(trace_id, STAGE_PUBLISH_DELAY)
             except Exception as e:
                 await self._report_error(demo_url, e, additional_data)
 
             self._upload_queue.pop(0)
-            self._state.flush()
+            await self._state.flush()
             self._waiting_queue_event.set()
 
     async def _run_publishing(self):
@@ -116,21 +186,31 @@ class LocalRenderingQueue(AutonomousRenderingQueue):
             [datetime_ready, video_url, additional_data, demo_url] = self._waiting_queue[0]
             print(f"[{datetime.datetime.now()}] waiting {datetime_ready} / {datetime.datetime.fromtimestamp(datetime_ready)}")
             await wait_until(datetime.datetime.fromtimestamp(datetime_ready))
-            for done_callback in self._done_callbacks:
-                try:
-                    await done_callback(video_url, additional_data)
-                except Exception as e:
-                    await self._report_error(demo_url, e, additional_data)
+            trace_id = AdditionalData.trace_id_of(additional_data)
+            await self._tracer.finish(trace_id, STAGE_PUBLISH_DELAY)
+            async with self._tracer.stage(trace_id, STAGE_ANNOUNCE):
+                for done_callback in self._done_callbacks:
+                    try:
+                        await done_callback(video_url, additional_data)
+                    except Exception as e:
+                        await self._report_error(demo_url, e, additional_data)
             self._waiting_queue.pop(0)
-            self._state.flush()
+            await self._state.flush()
 
     async def _report_error(self, id: int, e: Exception, additional_data: Any):
-        for fail_callback in self._fail_callbacks:
-            try:
-                await fail_callback(id, e, additional_data)
-            except BaseException as e:
-                self.LOGGER.exception(f"LocalRenderingQueue: Exception in fail callback {fail_callback}")
-                raise
+        video_file = e.video_file if isinstance(e, VideoUploadException) else None
+        if video_file is not None:
+            self._reported_videos.append(video_file)
+        try:
+            for fail_callback in self._fail_callbacks:
+                try:
+                    await fail_callback(id, e, additional_data)
+                except BaseException as e:
+                    self.LOGGER.exception(f"LocalRenderingQueue: Exception in fail callback {fail_callback}")
+                    raise
+        finally:
+            if video_file is not None:
+                self._reported_videos.remove(video_file)
 
     @classmethod
     def get_default_state(cls):
@@ -138,4 +218,5 @@ class LocalRenderingQueue(AutonomousRenderingQueue):
             'rendering_queue': [],
             'upload_queue': [],
             'waiting_queue': [],
+            'fair_queue': FairScheduler.default_state(),
         }
@@ -0,0 +1,56 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from datetime import timedelta
+from typing import Optional
+
+
+class LoopBlockDetector:
+    """
+    Logs whenever the event loop doesn't get to run for longer than the threshold, e.g., because of a blocking call.
+
+    A coroutine on the loop ticks periodically; a watchdog thread notices when the ticks stop and takes the stack of
+    the loop's thread, so the log shows what was blocking it, not just how long.
+    """
+    LOGGER = logging.getLogger('LoopBlockDetector')
+
+    def __init__(self, threshold: timedelta, check_interval: Optional[float] = None):
+        self._threshold = threshold.total_seconds()
+        self._check_interval = self._threshold / 2 if check_interval is None else check_interval
+        self._last_tick = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._blocking_stack: Optional[str] = None
+        self._stopped = threading.Event()
+
+    async def run(self):
+        self._loop_thread_id = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._stopped.clear()
+        watchdog = threading.Thread(target=self._watch, name='loop-block-detector', daemon=True)
+        watchdog.start()
+        try:
+            while True:
+                before = time.monotonic()
+                self._last_tick = before
+                await asyncio.sleep(self._check_interval)
+                blocked_for = time.monotonic() - before - self._check_interval
+                if blocked_for > self._threshold:
+                    stack = self._blocking_stack or "(not captured)\n"
+                    self.LOGGER.warning(f"Event loop was blocked for {blocked_for * 1000:.0f} ms, "
+                                        f"it was at:\n{stack}")
+                self._blocking_stack = None
+        finally:
+            self._stopped.set()
+
+    def _watch(self):
+        captured_tick = None
+        while not self._stopped.wait(self._check_interval):
+            last_tick = self._last_tick
+            if time.monotonic() - last_tick > self._check_interval + self._threshold and last_tick != captured_tick:
+                frame = sys._current_frames().get(self._loop_thread_id)
+                if frame is not None:
+                    self._blocking_stack = "".join(traceback.format_stack(frame))
+                captured_tick = last_tick
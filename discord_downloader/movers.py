@@ -1,8 +1,19 @@
+import abc
 import filecmp
+import hashlib
 import itertools
 import os
 import re
-from typing import Optional, Tuple
+from contextlib import contextmanager
+from typing import Optional, Tuple, ContextManager
+
+
+def file_sha256(file: str) -> str:
+    h = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
 
 
 class RenamingMover:
@@ -36,7 +47,30 @@ class RenamingMover:
         return f"{dest_prefix}.{i}{dest_suffix}"
 
 
-class DeduplicatingRenamingMover:
+class DeduplicatingMover(abc.ABC):
+
+    @abc.abstractmethod
+    def move(self, src: str, dest: str) -> Tuple[str, bool]:
+        """
+        :param src:
+        :param dest:
+        :return: The adjusted filename + Whether the file was not actually created (i.e., not a duplicate).
+        """
+        pass
+
+    def local_file(self, stored_file: str) -> ContextManager[str]:
+        """
+        Provides a file in the filesystem for the stored file returned by move (e.g., for the demo analyzer).
+        """
+        return _existing_file(stored_file)
+
+
+@contextmanager
+def _existing_file(file: str):
+    yield file
+
+
+class DeduplicatingRenamingMover(DeduplicatingMover):
 
     SPLIT = re.compile("""^(.*)(\\.[^/.\\\\]*)$""")
 
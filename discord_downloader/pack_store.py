@@ -0,0 +1,177 @@
+import filecmp
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from tempfile import NamedTemporaryFile
+from typing import Tuple, Optional, Iterator, NamedTuple
+
+import filelock
+
+from discord_downloader.demo_uploaders import DEMO_EXT_REGEX
+from discord_downloader.movers import DeduplicatingMover, DeduplicatingRenamingMover, file_sha256
+
+PACK_FILE_PREFIX = "pack-"
+PACK_FILE_SUFFIX = ".zpk"
+
+
+class PackEntry(NamedTuple):
+    name: str
+    pack: int
+    offset: int
+    length: int
+    size: int
+    sha256: str
+
+
+class PackStore:
+    """
+    Append-only pack files with zstd-compressed entries and an SQLite index of offsets. Entries are never rewritten,
+    so a crash can leave at most some unreferenced bytes at the end of a pack.
+    """
+    def __init__(self, directory: str, max_pack_size: int = 256 * 1024 * 1024, compression_level: int = 10):
+        try:
+            import zstandard
+        except ImportError as e:
+            raise Exception("Pack storage needs the zstandard package (pip install zstandard)") from e
+        self._zstandard = zstandard
+        self._directory = directory
+        self._max_pack_size = max_pack_size
+        self._compression_level = compression_level
+        os.makedirs(directory, exist_ok=True)
+        # Both the bot and a backfill can append at the same time.
+        self._lock = filelock.FileLock(os.path.join(directory, "append.lock"))
+        # Moves run on the I/O executor, while lookups can come from the event loop.
+        self._index = sqlite3.connect(os.path.join(directory, "index.sqlite"), check_same_thread=False)
+        self._index_lock = threading.Lock()
+        self._index.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                name TEXT PRIMARY KEY,
+                pack INTEGER NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                sha256 TEXT NOT NULL
+            )
+        """)
+        self._index.commit()
+
+    def get(self, name: str) -> Optional[PackEntry]:
+        with self._index_lock:
+            row = self._index.execute(
+                "SELECT name, pack, offset, length, size, sha256 FROM entries WHERE name = ?", (name,)
+            ).fetchone()
+        return None if row is None else PackEntry(*row)
+
+    def entries(self) -> Iterator[PackEntry]:
+        with self._index_lock:
+            rows = self._index.execute(
+                "SELECT name, pack, offset, length, size, sha256 FROM entries ORDER BY name"
+            ).fetchall()
+        for row in rows:
+            yield PackEntry(*row)
+
+    def add(self, name: str, src: str, sha256: str) -> PackEntry:
+        entry, added = self.add_if_absent(name, src, sha256)
+        if not added:
+            raise ValueError(f"{name} is already in the pack store")
+        return entry
+
+    def add_if_absent(self, name: str, src: str, sha256: str) -> Tuple[PackEntry, bool]:
+        """
+        :return: the new entry and True, or the entry that already has the name and False
+        """
+        with open(src, 'rb') as f:
+            data = f.read()
+        compressed = self._zstandard.ZstdCompressor(level=self._compression_level).compress(data)
+        with self._lock:
+            # checked under the lock, as another process can have added the name since any previous check
+            existing = self.get(name)
+            if existing is not None:
+                return existing, False
+            pack = self._current_pack(len(compressed))
+            with open(self._pack_file(pack), 'ab') as f:
+                offset = f.tell()
+                f.write(compressed)
+                f.flush()
+                os.fsync(f.fileno())
+            entry = PackEntry(name=name, pack=pack, offset=offset, length=len(compressed), size=len(data),
+                              sha256=sha256)
+            with self._index_lock:
+                self._index.execute("INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?)", entry)
+                self._index.commit()
+        return entry, True
+
+    def read(self, entry: PackEntry) -> bytes:
+        with open(self._pack_file(entry.pack), 'rb') as f:
+            f.seek(entry.offset)
+            compressed = f.read(entry.length)
+        return self._zstandard.ZstdDecompressor().decompress(compressed, max_output_size=entry.size)
+
+    def close(self):
+        self._index.close()
+
+    def _current_pack(self, additional_size: int) -> int:
+        packs = [int(f[len(PACK_FILE_PREFIX):-len(PACK_FILE_SUFFIX)]) for f in os.listdir(self._directory)
+                 if f.startswith(PACK_FILE_PREFIX) and f.endswith(PACK_FILE_SUFFIX)]
+        if len(packs) == 0:
+            return 1
+        last = max(packs)
+        if os.path.getsize(self._pack_file(last)) + additional_size > self._max_pack_size:
+            return last + 1
+        return last
+
+    def _pack_file(self, pack: int) -> str:
+        return os.path.join(self._directory, f"{PACK_FILE_PREFIX}{pack:06d}{PACK_FILE_SUFFIX}")
+
+
+class PackingMover(DeduplicatingMover):
+    """
+    Stores small demos in a PackStore and everything else as loose files. The returned paths of packed files point to
+    where the loose file would be, so names are shared between loose and packed files, and a loose file always takes
+    precedence (e.g., after it has been exported).
+    """
+
+    def __init__(self, pack_store: PackStore, temp_directory: str, max_file_size: int):
+        self._pack_store = pack_store
+        self._temp_directory = temp_directory
+        self._max_file_size = max_file_size
+        self._loose_mover = DeduplicatingRenamingMover()
+
+    def move(self, src: str, dest: str) -> Tuple[str, bool]:
+        if not self._should_pack(src, dest):
+            return self._loose_mover.move(src, dest)
+        sha256 = file_sha256(src)
+        for real_dest in DeduplicatingRenamingMover._moving_params(dest):
+            name = os.path.basename(real_dest)
+            if os.path.exists(real_dest):
+                if filecmp.cmp(src, real_dest):
+                    os.unlink(src)
+                    return real_dest, False
+                continue
+            entry = self._pack_store.get(name)  # spares the compression of a known name
+            is_new = False
+            if entry is None:
+                entry, is_new = self._pack_store.add_if_absent(name, src, sha256)
+            if is_new or (entry.sha256 == sha256 and entry.size == os.path.getsize(src)):
+                os.unlink(src)
+                return real_dest, is_new
+
+        raise AssertionError("Unreachable: _moving_params is infinite")
+
+    @contextmanager
+    def local_file(self, stored_file: str):
+        entry = None if os.path.exists(stored_file) else self._pack_store.get(os.path.basename(stored_file))
+        if entry is None:
+            yield stored_file
+            return
+        with NamedTemporaryFile(dir=self._temp_directory, suffix=f"-{entry.name}", delete=False) as f:
+            f.write(self._pack_store.read(entry))
+            tmp_file = f.name
+        try:
+            yield tmp_file
+        finally:
+            os.remove(tmp_file)
+
+    def _should_pack(self, src: str, dest: str) -> bool:
+        return DEMO_EXT_REGEX.match(dest) is not None and os.path.getsize(src) <= self._max_file_size
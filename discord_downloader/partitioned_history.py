@@ -0,0 +1,101 @@
+import asyncio
+import datetime
+from collections import deque
+from typing import List, Tuple, Optional, AsyncIterator, Deque
+
+import discord
+from discord import Message
+from discord.abc import Messageable
+
+HISTORY_PAGE_SIZE = 100  # messages in a response of the history endpoint
+
+_END = object()
+
+
+def snowflake_windows(after_id: int, before_id: Optional[int], window: datetime.timedelta,
+                      now: Optional[datetime.datetime] = None) -> List[Tuple[int, Optional[int]]]:
+    """
+    Splits the range of message ids (after_id, before_id) into consecutive time windows. Each window is a pair of
+    exclusive bounds, as accepted by Messageable.history(after=..., before=...). The windows don't overlap and don't
+    leave any gap. When before_id is None, the last window is open-ended.
+    """
+    start = discord.utils.snowflake_time(after_id)
+    end = discord.utils.snowflake_time(before_id) if before_id is not None else \
+        (now or datetime.datetime.utcnow())
+    windows = []
+    window_after = after_id
+    window_end = start + window
+    while window_end < end:
+        window_before = discord.utils.time_snowflake(window_end)
+        if window_before > window_after + 1:
+            windows.append((window_after, window_before))
+            window_after = window_before - 1
+        window_end = window_end + window
+    windows.append((window_after, before_id))
+    return windows
+
+
+class PartitionedHistory:
+    """
+    Reads history of a channel as a sequence of time windows. Up to `parallelism` windows are fetched concurrently,
+    but they are returned strictly in order, so a consumer can treat them as one sequential stream. Each window fetches
+    up to prefetch_pages pages ahead of its consumer, so the memory doesn't grow with the size of the windows.
+    """
+
+    def __init__(self, channel: Messageable, after_id: int, before_id: Optional[int], window: datetime.timedelta,
+                 parallelism: int, prefetch_pages: int = 2):
+        self._channel = channel
+        self._windows = snowflake_windows(after_id, before_id, window)
+        self._parallelism = parallelism
+        self._prefetch_pages = prefetch_pages
+
+    async def windows(self) -> AsyncIterator[Tuple[Optional[int], AsyncIterator[Message]]]:
+        """
+        Yields (last id covered by the window, messages of the window in ascending order). The last id is None for
+        the open-ended window. The messages of a window are read as they arrive; they must be read before the next
+        window.
+        """
+        loop = asyncio.get_running_loop()
+        pending_windows = deque(self._windows)
+        tasks: Deque[Tuple[Optional[int], asyncio.Task, asyncio.Queue]] = deque()
+        try:
+            while len(pending_windows) > 0 or len(tasks) > 0:
+                while len(pending_windows) > 0 and len(tasks) < self._parallelism:
+                    after_id, before_id = pending_windows.popleft()
+                    last_id = None if before_id is None else before_id - 1
+                    queue = asyncio.Queue(maxsize=self._prefetch_pages * HISTORY_PAGE_SIZE)
+                    tasks.append((last_id, loop.create_task(self._fetch(after_id, before_id, queue)), queue))
+                last_id, task, queue = tasks.popleft()
+                try:
+                    yield last_id, self._read(queue)
+                finally:
+                    task.cancel()  # done unless the consumer has stopped reading the window
+                    await asyncio.gather(task, return_exceptions=True)
+        finally:
+            for _, task, _ in tasks:
+                task.cancel()
+            await asyncio.gather(*[task for _, task, _ in tasks], return_exceptions=True)
+
+    async def _fetch(self, after_id: int, before_id: Optional[int], queue: asyncio.Queue):
+        try:
+            async for m in self._channel.history(
+                limit=None,
+                oldest_first=True,
+                after=discord.Object(after_id),
+                before=None if before_id is None else discord.Object(before_id)
+            ):
+                await queue.put(m)
+        except Exception as e:
+            await queue.put(e)  # raised to the consumer
+            return
+        await queue.put(_END)
+
+    @staticmethod
+    async def _read(queue: asyncio.Queue) -> AsyncIterator[Message]:
+        while True:
+            item = await queue.get()
+            if item is _END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
@@ -1,36 +1,40 @@
 import datetime
 import json
-import os
 
+from discord_downloader.io_executor import IoExecutor, DEFAULT_IO_EXECUTOR, write_file_atomically
 from discord_downloader.util import noop
 
 
 class StoredState:
+    """
+    JSON state in a file. Writes are done by the IoExecutor, keyed by the file name, so they are applied in order.
+    """
 
-    def __init__(self, filename, default_value):
+    def __init__(self, filename, default_value, io_executor: IoExecutor = DEFAULT_IO_EXECUTOR):
         self.filename = filename
+        self._io_executor = io_executor
         try:
             with open(filename) as f:
                 self.value = json.load(f)
         except FileNotFoundError:
             self.value = default_value
 
-    def flush(self):
-        tmp_filename = f"{self.filename}.tmp"
-        with open(tmp_filename, "w") as f:
-            json.dump(self.value, f)
-            f.flush()
-            os.fsync(f.fileno())
-        os.replace(tmp_filename, self.filename)
+    async def flush(self):
+        # serialized right now, as the value can change while the file is being written
+        await self._io_executor.run(write_file_atomically, self.filename, json.dumps(self.value), key=self.filename)
 
     def close(self):
-        self.flush()
+        """
+        Blocks until the state is written; for the shutdown of the process, coroutines await flush.
+        """
+        self._io_executor.run_sync(write_file_atomically, self.filename, json.dumps(self.value), key=self.filename)
 
 
 class Savepoint:
 
-    def __init__(self, filename):
+    def __init__(self, filename, io_executor: IoExecutor = DEFAULT_IO_EXECUTOR):
         self.filename = filename
+        self._io_executor = io_executor
         try:
             with open(filename) as f:
                 s = f.read().strip()
@@ -42,22 +46,20 @@ class Savepoint:
     def get(self):
         return self.value
 
-    def set(self, new_value: int, before_sync=noop, after_sync=noop):
+    async def set(self, new_value: int, before_sync=noop, after_sync=noop):
         self.value = new_value
         now = datetime.datetime.now()
         if (now-self.last_synced) > datetime.timedelta(seconds=1):
             before_sync()
-            self.flush()
             self.last_synced = now
+            await self.flush()
             after_sync()
 
-    def flush(self):
-        tmp_filename = f"{self.filename}.tmp"
-        with open(tmp_filename, "w") as f:
-            f.write(str(self.value))
-            f.flush()
-            os.fsync(f.fileno())
-        os.replace(tmp_filename, self.filename)
+    async def flush(self):
+        await self._io_executor.run(write_file_atomically, self.filename, str(self.value), key=self.filename)
 
     def close(self):
-        self.flush()
+        """
+        Blocks until the savepoint is written; for the shutdown of the process, coroutines await flush.
+        """
+        self._io_executor.run_sync(write_file_atomically, self.filename, str(self.value), key=self.filename)
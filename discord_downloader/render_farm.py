@@ -0,0 +1,313 @@
+"""
+Rendering on other machines. The bot runs RenderFarmCoordinator as its DemoRenderer, which serves render jobs over
+HTTP; render-worker.py processes lease the jobs, render them with their local oDFe and upload the videos back.
+
+Protocol (all requests need the "Authorization: Bearer <token>" header):
+
+* POST /jobs/lease?wait=<seconds> -- {"worker_id": ...}; long-polls for a job, returns 204 when there is none, or
+  {"job_id", "lease_id", "demo_filename", "round_id", "lease_seconds"}
+* GET /jobs/<job_id>/demo -- the demo
+* POST /jobs/<job_id>/heartbeat -- extends the lease
+* PUT /jobs/<job_id>/video -- the rendered video as the request body; finishes the job
+* POST /jobs/<job_id>/fail -- {"error": ...}; the job is retried on another lease (up to max_attempts)
+
+Requests about a job need the "X-Lease-Id" header, and they fail with 409 Conflict when the lease has expired. An
+expired job is leased again, so a worker that has died or got disconnected is replaced by another one.
+"""
+import asyncio
+import datetime
+import hmac
+import logging
+import os
+import uuid
+from asyncio import FIRST_COMPLETED
+from typing import Optional, Dict, List
+
+from aiohttp import web, ClientSession, ClientError, ClientTimeout
+
+from discord_downloader.demo_uploaders import DemoRenderer
+from discord_downloader.io_executor import DEFAULT_IO_EXECUTOR
+
+MAX_LEASE_WAIT = 30.0
+
+
+class RenderFarmException(Exception):
+    pass
+
+
+class LeaseLostException(Exception):
+    pass
+
+
+class RenderJob:
+
+    def __init__(self, demo_filename: str, demo_data: bytes, round_id: Optional[int], future: asyncio.Future):
+        self.id = uuid.uuid4().hex
+        self.demo_filename = demo_filename
+        self.demo_data = demo_data
+        self.round_id = round_id
+        self.future = future
+        self.attempts = 0
+        self.errors: List[str] = []
+        self.worker_id: Optional[str] = None
+        self.lease_id: Optional[str] = None
+        self.lease_expires_at: Optional[float] = None
+
+
+class RenderFarmCoordinator(DemoRenderer):
+    LOGGER = logging.getLogger('RenderFarmCoordinator')
+
+    def __init__(self, host: str, port: int, token: str, video_dir: str, lease_duration: datetime.timedelta,
+                 max_attempts: int = 3):
+        self._host = host
+        self.port = port
+        self._token = token
+        self._video_dir = video_dir
+        self._lease_duration = lease_duration.total_seconds()
+        self._max_attempts = max_attempts
+        self._jobs: Dict[str, RenderJob] = {}
+        self._pending: List[RenderJob] = []
+        self._job_available = asyncio.Event()
+        self._runner: Optional[web.AppRunner] = None
+        self._reaper: Optional[asyncio.Task] = None
+
+    async def start(self):
+        app = web.Application(middlewares=[self._check_token])
+        app.router.add_post('/jobs/lease', self._handle_lease)
+        app.router.add_get('/jobs/{job_id}/demo', self._handle_demo)
+        app.router.add_post('/jobs/{job_id}/heartbeat', self._handle_heartbeat)
+        app.router.add_put('/jobs/{job_id}/video', self._handle_video)
+        app.router.add_post('/jobs/{job_id}/fail', self._handle_fail)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self._host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        self._reaper = asyncio.get_running_loop().create_task(self._reap_expired_leases())
+        self.LOGGER.info(f"Listening on {self._host}:{self.port}")
+
+    async def close(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def render(self, demo_filename: str, demo_data: bytes, round_id: Optional[int]) -> str:
+        job = RenderJob(demo_filename, demo_data, round_id, asyncio.get_running_loop().create_future())
+        self._jobs[job.id] = job
+        self._enqueue(job)
+        try:
+            return await job.future
+        finally:
+            del self._jobs[job.id]
+            if job in self._pending:
+                self._pending.remove(job)
+
+    def _enqueue(self, job: RenderJob):
+        job.worker_id = job.lease_id = job.lease_expires_at = None
+        self._pending.append(job)
+        self._job_available.set()
+
+    def _lease_is_valid(self, job: RenderJob, lease_id: Optional[str]) -> bool:
+        return lease_id is not None and job.lease_id == lease_id and \
+               job.lease_expires_at > asyncio.get_running_loop().time()
+
+    def _retry_or_fail(self, job: RenderJob, reason: str):
+        job.errors.append(f"{job.worker_id}: {reason}")
+        if job.attempts >= self._max_attempts:
+            self.LOGGER.warning(f"Giving up job {job.id} ({job.demo_filename}) after {job.attempts} attempts")
+            job.worker_id = job.lease_id = job.lease_expires_at = None
+            if not job.future.done():
+                job.future.set_exception(RenderFarmException(
+                    f"Rendering of {job.demo_filename} has failed {job.attempts} times: {job.errors}"
+                ))
+        else:
+            self.LOGGER.info(f"Job {job.id} ({job.demo_filename}) goes back to the queue: {reason}")
+            self._enqueue(job)
+
+    async def _reap_expired_leases(self):
+        while True:
+            await asyncio.sleep(min(1.0, self._lease_duration / 4))
+            now = asyncio.get_running_loop().time()
+            for job in list(self._jobs.values()):
+                if job.lease_expires_at is not None and job.lease_expires_at <= now:
+                    self._retry_or_fail(job, 'lease expired')
+
+    @web.middleware
+    async def _check_token(self, request: web.Request, handler):
+        expected = f"Bearer {self._token}"
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), expected):
+            raise web.HTTPUnauthorized()
+        return await handler(request)
+
+    def _job_for_lease(self, request: web.Request) -> RenderJob:
+        job = self._jobs.get(request.match_info['job_id'])
+        if job is None or not self._lease_is_valid(job, request.headers.get('X-Lease-Id')):
+            raise web.HTTPConflict(text='lease is not valid')
+        return job
+
+    async def _handle_lease(self, request: web.Request):
+        worker_id = (await request.json())['worker_id']
+        wait = min(float(request.query.get('wait', 0)), MAX_LEASE_WAIT)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + wait
+        while len(self._pending) == 0:
+            self._job_available.clear()
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return web.Response(status=204)
+            try:
+                await asyncio.wait_for(self._job_available.wait(), remaining)
+            except asyncio.TimeoutError:
+                return web.Response(status=204)
+        job = self._pending.pop(0)
+        job.attempts += 1
+        job.worker_id = worker_id
+        job.lease_id = uuid.uuid4().hex
+        job.lease_expires_at = loop.time() + self._lease_duration
+        self.LOGGER.info(f"Job {job.id} ({job.demo_filename}) leased by {worker_id}, attempt {job.attempts}")
+        return web.json_response({
+            'job_id': job.id,
+            'lease_id': job.lease_id,
+            'demo_filename': job.demo_filename,
+            'round_id': job.round_id,
+            'lease_seconds': self._lease_duration,
+        })
+
+    async def _handle_demo(self, request: web.Request):
+        job = self._job_for_lease(request)
+        return web.Response(body=job.demo_data, content_type='application/octet-stream')
+
+    async def _handle_heartbeat(self, request: web.Request):
+        job = self._job_for_lease(request)
+        job.lease_expires_at = asyncio.get_running_loop().time() + self._lease_duration
+        return web.json_response({'lease_seconds': self._lease_duration})
+
+    async def _handle_video(self, request: web.Request):
+        job = self._job_for_lease(request)
+        lease_id = job.lease_id
+        video_file = os.path.join(self._video_dir, f"{job.id}.mp4")
+        tmp_file = f"{video_file}.part"
+        # the lane of the file keeps the chunks in order
+        with open(tmp_file, 'wb') as f:
+            async for chunk in request.content.iter_chunked(64 * 1024):
+                await DEFAULT_IO_EXECUTOR.run(f.write, chunk, key=tmp_file)
+        if job.lease_id != lease_id or job.future.done():
+            # the lease has expired during the upload
+            await DEFAULT_IO_EXECUTOR.run(os.remove, tmp_file, key=tmp_file)
+            raise web.HTTPConflict(text='lease is not valid')
+        await DEFAULT_IO_EXECUTOR.run(os.replace, tmp_file, video_file, key=tmp_file)
+        self.LOGGER.info(f"Job {job.id} ({job.demo_filename}) rendered by {job.worker_id}")
+        job.lease_id = job.lease_expires_at = None
+        job.future.set_result(video_file)
+        return web.json_response({})
+
+    async def _handle_fail(self, request: web.Request):
+        job = self._job_for_lease(request)
+        error = (await request.json()).get('error')
+        self._retry_or_fail(job, f"rendering failed: {error}")
+        return web.json_response({})
+
+
+class RenderWorker:
+    """
+    Leases jobs from a RenderFarmCoordinator and renders them one at a time with the given (local) renderer. The lease
+    is kept alive by heartbeats; when it is lost, the rendering is cancelled, because the job has been given to
+    another worker.
+    """
+    LOGGER = logging.getLogger('RenderWorker')
+
+    def __init__(self, coordinator_url: str, token: str, demo_renderer: DemoRenderer, worker_id: str,
+                 lease_wait: float = 20.0, retry_interval: float = 5.0):
+        self._coordinator_url = coordinator_url.rstrip('/')
+        self._token = token
+        self._demo_renderer = demo_renderer
+        self._worker_id = worker_id
+        self._lease_wait = lease_wait
+        self._retry_interval = retry_interval
+
+    async def run(self):
+        await self._demo_renderer.start()
+        try:
+            headers = {'Authorization': f"Bearer {self._token}"}
+            async with ClientSession(headers=headers, timeout=ClientTimeout(total=None, sock_connect=30)) as session:
+                while True:
+                    try:
+                        job = await self._lease(session)
+                    except (ClientError, asyncio.TimeoutError) as e:
+                        self.LOGGER.warning(f"Cannot lease a job from {self._coordinator_url}: {e}")
+                        await asyncio.sleep(self._retry_interval)
+                        continue
+                    if job is not None:
+                        try:
+                            await self._process(session, job)
+                        except (ClientError, asyncio.TimeoutError, LeaseLostException) as e:
+                            self.LOGGER.warning(f"Job {job['job_id']} abandoned: {e!r}")
+        finally:
+            await self._demo_renderer.close()
+
+    async def _lease(self, session: ClientSession) -> Optional[dict]:
+        async with session.post(f"{self._coordinator_url}/jobs/lease", params={'wait': str(self._lease_wait)},
+                                json={'worker_id': self._worker_id}) as response:
+            response.raise_for_status()
+            if response.status == 204:
+                return None
+            return await response.json()
+
+    def _job_url(self, job: dict, action: str) -> str:
+        return f"{self._coordinator_url}/jobs/{job['job_id']}/{action}"
+
+    async def _process(self, session: ClientSession, job: dict):
+        self.LOGGER.info(f"Rendering job {job['job_id']} ({job['demo_filename']})")
+        lease_headers = {'X-Lease-Id': job['lease_id']}
+        async with session.get(self._job_url(job, 'demo'), headers=lease_headers) as response:
+            self._check_lease(response)
+            demo_data = await response.read()
+        loop = asyncio.get_running_loop()
+        # The heartbeat runs until the video is uploaded, which can take a while, too.
+        heartbeat = loop.create_task(self._keep_lease(session, job))
+        try:
+            render = loop.create_task(self._demo_renderer.render(job['demo_filename'], demo_data, job['round_id']))
+            await asyncio.wait([render, heartbeat], return_when=FIRST_COMPLETED)
+            if not render.done():
+                render.cancel()
+                await asyncio.gather(render, return_exceptions=True)
+                heartbeat.result()  # raises LeaseLostException
+            try:
+                video_file = render.result()
+            except Exception as e:
+                self.LOGGER.exception(f"Rendering of job {job['job_id']} has failed")
+                async with session.post(self._job_url(job, 'fail'), headers=lease_headers,
+                                        json={'error': repr(e)}) as response:
+                    self._check_lease(response)
+                return
+            try:
+                with open(video_file, 'rb') as f:
+                    async with session.put(self._job_url(job, 'video'), headers=lease_headers, data=f) as response:
+                        self._check_lease(response)
+                self.LOGGER.info(f"Job {job['job_id']} done")
+            finally:
+                os.remove(video_file)
+        finally:
+            heartbeat.cancel()
+            await asyncio.gather(heartbeat, return_exceptions=True)
+
+    async def _keep_lease(self, session: ClientSession, job: dict):
+        interval = job['lease_seconds'] / 3
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                async with session.post(self._job_url(job, 'heartbeat'),
+                                        headers={'X-Lease-Id': job['lease_id']}) as response:
+                    self._check_lease(response)
+            except (ClientError, asyncio.TimeoutError) as e:
+                # The coordinator may be restarting; the lease is lost only when it says so.
+                self.LOGGER.warning(f"Heartbeat of job {job['job_id']} has failed: {e}")
+
+    @staticmethod
+    def _check_lease(response):
+        if response.status == 409:
+            raise LeaseLostException()
+        response.raise_for_status()
@@ -0,0 +1,77 @@
+import asyncio
+import logging
+from typing import Dict, Optional, Callable
+
+from sqlalchemy import select, update, bindparam
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from discord_downloader.db import RenderedDemo
+from discord_downloader.db_writer import BatchingDbWriter
+from discord_downloader.io_executor import IoExecutor, DEFAULT_IO_EXECUTOR
+
+
+class RenderedDemoCache:
+    """
+    Warm in-memory copy of rendered_demos, so duplicate checks don't need a DB transaction. Demos are identified by
+    SHA-256 of their content. Legacy rows without a hash (rendered before hashes were recorded) are looked up by the
+    name of the archived file until their hash is known.
+    """
+    LOGGER = logging.getLogger('RenderedDemoCache')
+
+    def __init__(self, db_writer: BatchingDbWriter, io_executor: IoExecutor = DEFAULT_IO_EXECUTOR):
+        self._db_writer = db_writer
+        self._io_executor = io_executor
+        self._by_hash: Dict[str, str] = {}
+        self._legacy_by_filename: Dict[str, str] = {}
+
+    async def load(self, legacy_hasher: Callable[[str], Optional[str]] = lambda filename: None):
+        """
+        Loads all the rendered demos. For legacy rows, legacy_hasher gets the name of the archived file and returns
+        its hash (or None when the file is not available); it runs in the IO executor, outside of any transaction.
+        Found hashes are stored, so it is done just once.
+        """
+        async with self._db_writer.engine.begin() as connection:
+            connection: AsyncConnection
+            rows = (await connection.execute(select(RenderedDemo))).fetchall()
+        legacy_rows = [row for row in rows if row.content_hash is None]
+        legacy_hashes = await asyncio.gather(*(self._io_executor.run(legacy_hasher, row.filename)
+                                               for row in legacy_rows))
+        found_hashes = {row.id: content_hash for row, content_hash in zip(legacy_rows, legacy_hashes)
+                        if content_hash is not None}
+        by_hash = {}
+        legacy_by_filename = {}
+        for row in rows:
+            content_hash = found_hashes.get(row.id, row.content_hash)
+            if content_hash is None:
+                legacy_by_filename[row.filename] = row.url
+            else:
+                by_hash.setdefault(content_hash, row.url)
+        self._by_hash = by_hash
+        self._legacy_by_filename = legacy_by_filename
+        if len(found_hashes) > 0:
+            # even for renders of a demo that is already known, so that they are not hashed on the next start
+            async with self._db_writer.engine.begin() as connection:
+                await connection.execute(
+                    update(RenderedDemo).where(RenderedDemo.id == bindparam('row_id'))
+                    .values(content_hash=bindparam('found_hash')),
+                    [{'row_id': row_id, 'found_hash': content_hash} for row_id, content_hash in found_hashes.items()]
+                )
+        self.LOGGER.info(f"Loaded {len(rows)} rendered demos, hashed {len(found_hashes)} legacy ones, "
+                         f"{len(legacy_by_filename)} remain without hash")
+
+    def get(self, content_hash: Optional[str], legacy_filename: Optional[str] = None) -> Optional[str]:
+        url = None if content_hash is None else self._by_hash.get(content_hash)
+        if url is None and legacy_filename is not None:
+            url = self._legacy_by_filename.get(legacy_filename)
+        return url
+
+    async def record(self, url: str, filename: str, content_hash: Optional[str]):
+        if content_hash is None:
+            self._legacy_by_filename.setdefault(filename, url)
+        else:
+            self._by_hash.setdefault(content_hash, url)
+        # The video can be posted to multiple channels and re-rendered demos can be recorded again.
+        await self._db_writer.execute(
+            insert(RenderedDemo).values(url=url, filename=filename, content_hash=content_hash).on_conflict_do_nothing()
+        )
@@ -0,0 +1,129 @@
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+from typing import Callable, Optional, Iterable, Dict, Set
+
+from discord_downloader.demo_uploaders import DemoRenderer
+from discord_downloader.io_executor import IoExecutor, DEFAULT_IO_EXECUTOR
+
+VIDEO_SUFFIX = '.mp4'
+PART_SUFFIX = '.part'
+
+
+def video_basename(demo_data: bytes, render_config: str) -> str:
+    demo_hash = hashlib.sha256(demo_data).hexdigest()
+    config_hash = hashlib.sha256(render_config.encode('utf-8')).hexdigest()
+    return f"{demo_hash}-{config_hash[:16]}{VIDEO_SUFFIX}"
+
+
+class RenderedVideoCache(DemoRenderer):
+    """
+    Keeps the rendered videos, so a demo rendered again with the same config (e.g., another request to render it to
+    Discord) reuses the video. Videos are keyed by SHA-256 of the demo and of the render config (render_config gets the
+    rerendering round). When the cache exceeds max_size bytes, the least recently used videos are removed; the last use
+    is the mtime of the file, so it survives restarts.
+
+    The returned videos stay in the cache, so the consumer must not remove them. Videos listed by in_use (e.g., the
+    ones waiting for an upload) are never evicted.
+    """
+    LOGGER = logging.getLogger('RenderedVideoCache')
+
+    def __init__(self, demo_renderer: DemoRenderer, cache_dir: str, max_size: int,
+                 render_config: Callable[[Optional[int]], str], in_use: Callable[[], Iterable[str]] = lambda: [],
+                 io_executor: IoExecutor = DEFAULT_IO_EXECUTOR):
+        self._demo_renderer = demo_renderer
+        self._cache_dir = cache_dir
+        self._max_size = max_size
+        self._render_config = render_config
+        self._in_use = in_use
+        self._io_executor = io_executor
+        # renders in progress by the video file, so concurrent requests for the same video render it just once
+        self._rendering: Dict[str, asyncio.Future] = {}
+
+    async def start(self):
+        await self._io_executor.run(self._remove_partial_files, key=self._cache_dir)
+        await self._evict()
+        await self._demo_renderer.start()
+
+    async def close(self):
+        await self._demo_renderer.close()
+
+    async def render(self, demo_filename: str, demo_data: bytes, round_id: Optional[int]) -> str:
+        basename = await self._io_executor.run(video_basename, demo_data, self._render_config(round_id))
+        video_file = os.path.join(self._cache_dir, basename)
+        # the same lane as the eviction, so a video cannot be removed between the check and its use
+        if video_file not in self._rendering and \
+                await self._io_executor.run(_touch, video_file, key=self._cache_dir):
+            self.LOGGER.info(f"Reusing the rendered video of {demo_filename}: {video_file}")
+            return video_file
+        rendering = self._rendering.get(video_file)  # possibly started while checking the file
+        if rendering is not None:
+            return await asyncio.shield(rendering)
+        rendering = asyncio.get_running_loop().create_future()
+        rendering.add_done_callback(lambda f: f.cancelled() or f.exception())  # waiters are optional
+        self._rendering[video_file] = rendering
+        try:
+            rendered_file = await self._demo_renderer.render(demo_filename, demo_data, round_id)
+            await self._io_executor.run(_move, rendered_file, video_file, key=self._cache_dir)
+            rendering.set_result(video_file)
+        except asyncio.CancelledError:
+            rendering.cancel()
+            raise
+        except BaseException as e:
+            rendering.set_exception(e)
+            raise
+        finally:
+            del self._rendering[video_file]
+        await self._evict(keep=video_file)
+        return video_file
+
+    async def _evict(self, keep: Optional[str] = None):
+        protected = {os.path.abspath(f) for f in self._in_use() if f is not None}
+        if keep is not None:
+            protected.add(os.path.abspath(keep))
+        await self._io_executor.run(self._evict_sync, protected, key=self._cache_dir)
+
+    def _evict_sync(self, protected: Set[str]):
+        videos = []
+        for entry in os.scandir(self._cache_dir):
+            if entry.name.endswith(VIDEO_SUFFIX) and entry.is_file():
+                stat = entry.stat()
+                videos.append((stat.st_mtime, stat.st_size, entry.path))
+        total_size = sum(size for _, size, _ in videos)
+        evicted = 0
+        for _, size, video_file in sorted(videos):
+            if total_size <= self._max_size:
+                break
+            if os.path.abspath(video_file) in protected:
+                continue
+            os.remove(video_file)
+            total_size -= size
+            evicted += 1
+        if evicted > 0:
+            self.LOGGER.info(f"Evicted {evicted} videos, the cache has {total_size} bytes")
+        if total_size > self._max_size:
+            self.LOGGER.warning(f"The cache has {total_size} bytes, more than {self._max_size}, because of the videos "
+                                f"in use")
+
+    def _remove_partial_files(self):
+        os.makedirs(self._cache_dir, exist_ok=True)
+        for entry in os.scandir(self._cache_dir):
+            if entry.name.endswith(PART_SUFFIX):
+                os.remove(entry.path)
+
+
+def _touch(video_file: str) -> bool:
+    try:
+        os.utime(video_file)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def _move(src: str, dest: str):
+    # The video directory may be on another filesystem; a partial copy is never taken for a cached video.
+    tmp_file = dest + PART_SUFFIX
+    shutil.move(src, tmp_file)
+    os.replace(tmp_file, dest)
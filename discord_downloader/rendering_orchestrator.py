@@ -0,0 +1,304 @@
+"""
+Running the rendering queue in a separate process (render-orchestrator.py), so the bot and the rendering pipeline can
+be restarted independently and rendering doesn't compete with the Discord gateway for the event loop.
+
+The bot and the orchestrator talk over a local TCP connection, one JSON object per line:
+
+* bot: {"type": "hello", "token": ...}; orchestrator: {"type": "welcome", "instance": ...}
+* bot: {"type": "upload", "request_id": ..., "url", "resolution", "title", "description", "additional_data"};
+  orchestrator: {"type": "upload_ack", "request_id": ...}
+* orchestrator: {"type": "done", "seq": ..., "video_url", "additional_data"} or
+  {"type": "failed", "seq": ..., "id", "error", "additional_data"}; bot: {"type": "event_ack", "seq": ...}
+
+Both sides persist what the other one hasn't acknowledged yet and send it again after reconnecting. Uploads are
+deduplicated by request_id and events by seq, so the callbacks of the bot are called once for each event, like with
+the in-process queue.
+"""
+import asyncio
+import json
+import logging
+import uuid
+from typing import List, Callable, Any, Awaitable, Optional
+
+from discord_downloader.demo_uploaders import VideoUploadException
+from discord_downloader.local_queue import AutonomousRenderingQueue
+from discord_downloader.persistent_state import StoredState
+
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+MAX_REMEMBERED_REQUEST_IDS = 1000
+
+
+class RemoteRenderingException(Exception):
+    pass
+
+
+def serialize_exception(e: Exception) -> dict:
+    if isinstance(e, VideoUploadException):
+        return {'type': 'VideoUploadException', 'message': e.message, 'video_file': e.video_file}
+    return {'type': type(e).__name__, 'message': str(e)}
+
+
+def deserialize_exception(data: dict) -> Exception:
+    if data['type'] == 'VideoUploadException':
+        return VideoUploadException(data['message'], data['video_file'])
+    return RemoteRenderingException(f"{data['type']}: {data['message']}")
+
+
+def encode_message(message: dict) -> bytes:
+    return json.dumps(message, default=str).encode('utf-8') + b'\n'
+
+
+class RenderingOrchestrator:
+    LOGGER = logging.getLogger('RenderingOrchestrator')
+
+    def __init__(self, queue: AutonomousRenderingQueue, state: StoredState, port: int, token: str,
+                 host: str = '127.0.0.1'):
+        self._queue = queue
+        self._state = state
+        self._host = host
+        self.port = port
+        self._token = token
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._listening = asyncio.Event()
+        queue.add_done_callback(self._on_done)
+        queue.add_fail_callback(self._on_failed)
+
+    @classmethod
+    def get_default_state(cls):
+        return {
+            'instance': uuid.uuid4().hex,
+            'next_seq': 1,
+            'events': [],
+            'request_ids': [],
+        }
+
+    async def run(self):
+        self._server = await asyncio.start_server(self._handle_connection, self._host, self.port,
+                                                  limit=MAX_MESSAGE_SIZE)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._listening.set()
+        self.LOGGER.info(f"Listening on {self._host}:{self.port}")
+        try:
+            await asyncio.gather(self._queue.run(), self._server.serve_forever())
+        finally:
+            self._server.close()
+
+    async def wait_until_listening(self):
+        await self._listening.wait()
+
+    def videos_in_use(self) -> List[str]:
+        """
+        Videos of the failed events (VideoUploadException) that the bot hasn't handled yet.
+        """
+        return [event['error']['video_file'] for event in self._state.value['events']
+                if event['type'] == 'failed' and event['error']['type'] == 'VideoUploadException']
+
+    async def _on_done(self, video_url: str, additional_data: Any):
+        await self._add_event({'type': 'done', 'video_url': video_url, 'additional_data': additional_data})
+
+    async def _on_failed(self, id: Any, e: Exception, additional_data: Any):
+        await self._add_event({'type': 'failed', 'id': id, 'error': serialize_exception(e),
+                               'additional_data': additional_data})
+
+    async def _add_event(self, event: dict):
+        event['seq'] = self._state.value['next_seq']
+        self._state.value['next_seq'] += 1
+        self._state.value['events'].append(event)
+        await self._state.flush()
+        await self._send(self._writer, event)
+
+    async def _send(self, writer: Optional[asyncio.StreamWriter], message: dict):
+        if writer is None:
+            return  # will be sent when the bot connects
+        try:
+            writer.write(encode_message(message))
+            await writer.drain()
+        except ConnectionError as e:
+            self.LOGGER.warning(f"Cannot send to the bot: {e}")
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            hello = json.loads(await reader.readline() or b'{}')
+            if hello.get('type') != 'hello' or hello.get('token') != self._token:
+                self.LOGGER.warning(f"Rejecting connection from {writer.get_extra_info('peername')}")
+                return
+            if self._writer is not None:
+                self.LOGGER.info("The bot has reconnected, dropping the old connection")
+                self._writer.close()
+                self._writer = None
+            await self._send(writer, {'type': 'welcome', 'instance': self._state.value['instance']})
+            # The events must arrive in order (the bot ignores the ones older than the last one), so the connection is
+            # published only after the replay, including the events added in the meantime.
+            replayed_seq = 0
+            while True:
+                pending = [e for e in self._state.value['events'] if e['seq'] > replayed_seq]
+                if len(pending) == 0:
+                    break
+                for event in pending:
+                    await self._send(writer, event)
+                    replayed_seq = event['seq']
+            self._writer = writer
+            while True:
+                line = await reader.readline()
+                if line == b'':
+                    break
+                await self._handle_message(writer, json.loads(line))
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+            self.LOGGER.warning(f"Connection to the bot has failed: {e}")
+        finally:
+            if self._writer is writer:
+                self._writer = None
+            writer.close()
+
+    async def _handle_message(self, writer: asyncio.StreamWriter, message: dict):
+        if message['type'] == 'upload':
+            request_id = message['request_id']
+            if request_id not in self._state.value['request_ids']:
+                await self._queue.upload(
+                    url=message['url'],
+                    resolution=message['resolution'],
+                    title=message['title'],
+                    description=message['description'],
+                    additional_data=message['additional_data']
+                )
+                request_ids: List[str] = self._state.value['request_ids']
+                request_ids.append(request_id)
+                del request_ids[:-MAX_REMEMBERED_REQUEST_IDS]
+                await self._state.flush()
+            await self._send(writer, {'type': 'upload_ack', 'request_id': request_id})
+        elif message['type'] == 'event_ack':
+            # events are handled in order, so the ack covers all the previous events, too
+            self._state.value['events'] = [e for e in self._state.value['events'] if e['seq'] > message['seq']]
+            await self._state.flush()
+        else:
+            self.LOGGER.warning(f"Unexpected message: {message}")
+
+
+class RemoteRenderingQueue(AutonomousRenderingQueue):
+    """
+    The bot's side of RenderingOrchestrator. Uploads are persisted and sent whenever the orchestrator is reachable;
+    events are passed to the callbacks one at a time.
+    """
+    LOGGER = logging.getLogger('RemoteRenderingQueue')
+
+    def __init__(self, port: int, token: str, state: StoredState, host: str = '127.0.0.1',
+                 reconnect_interval: float = 5.0):
+        self._host = host
+        self._port = port
+        self._token = token
+        self._state = state
+        self._reconnect_interval = reconnect_interval
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._done_callbacks: List[Callable[[str, Any], Awaitable[None]]] = []
+        self._fail_callbacks: List[Callable[[int, Exception, Any], Awaitable[None]]] = []
+
+    @classmethod
+    def get_default_state(cls):
+        return {
+            'pending_uploads': [],
+            'instance': None,
+            'last_seq': 0,
+        }
+
+    def add_done_callback(self, done_callback: Callable[[str, Any], Awaitable[None]]):
+        self._done_callbacks.append(done_callback)
+
+    def add_fail_callback(self, failed_callback: Callable[[int, Exception, Any], Awaitable[None]]):
+        self._fail_callbacks.append(failed_callback)
+
+    async def upload(self, url: str, resolution: int, title: str, description: str, additional_data=None) -> None:
+        request = {'type': 'upload', 'request_id': uuid.uuid4().hex, 'url': url, 'resolution': resolution,
+                   'title': title, 'description': description, 'additional_data': additional_data}
+        self._state.value['pending_uploads'].append(request)
+        await self._state.flush()
+        await self._send(request)
+
+    async def _send(self, message: dict):
+        writer = self._writer
+        if writer is None:
+            return  # will be sent after connecting
+        try:
+            writer.write(encode_message(message))
+            await writer.drain()
+        except ConnectionError as e:
+            self.LOGGER.warning(f"Cannot send to the orchestrator: {e}")
+
+    async def run(self):
+        # The callbacks can take a while and they can even call upload, so they must not block reading. They also
+        # survive a reconnect; an event that is received again is just acknowledged.
+        events: asyncio.Queue = asyncio.Queue()
+        handler = asyncio.get_running_loop().create_task(self._handle_events(events))
+        try:
+            while True:
+                try:
+                    await self._run_connection(events)
+                    self.LOGGER.warning("The orchestrator has closed the connection")
+                except (ConnectionError, OSError, asyncio.IncompleteReadError, ValueError) as e:
+                    self.LOGGER.warning(f"Connection to the orchestrator at {self._host}:{self._port} has failed: {e}")
+                await asyncio.sleep(self._reconnect_interval)
+        finally:
+            handler.cancel()
+            await asyncio.gather(handler, return_exceptions=True)
+
+    async def _run_connection(self, events: asyncio.Queue):
+        reader, writer = await asyncio.open_connection(self._host, self._port, limit=MAX_MESSAGE_SIZE)
+        try:
+            writer.write(encode_message({'type': 'hello', 'token': self._token}))
+            await writer.drain()
+            welcome = json.loads(await reader.readline() or b'{}')
+            if welcome.get('type') != 'welcome':
+                raise ConnectionError(f"Unexpected welcome: {welcome}")
+            if welcome['instance'] != self._state.value['instance']:
+                # a new orchestrator (e.g., its state has been deleted), so its events are numbered from scratch
+                self._state.value['instance'] = welcome['instance']
+                self._state.value['last_seq'] = 0
+                await self._state.flush()
+            self._writer = writer
+            self.LOGGER.info("Connected to the orchestrator")
+            for request in list(self._state.value['pending_uploads']):
+                await self._send(request)
+            while True:
+                line = await reader.readline()
+                if line == b'':
+                    return
+                message = json.loads(line)
+                if message['type'] == 'upload_ack':
+                    self._state.value['pending_uploads'] = [
+                        r for r in self._state.value['pending_uploads'] if r['request_id'] != message['request_id']
+                    ]
+                    await self._state.flush()
+                else:
+                    events.put_nowait(message)
+        finally:
+            self._writer = None
+            writer.close()
+
+    async def _handle_events(self, events: asyncio.Queue):
+        while True:
+            event = await events.get()
+            if event['seq'] > self._state.value['last_seq']:
+                await self._handle_event(event)
+                self._state.value['last_seq'] = event['seq']
+                await self._state.flush()
+            await self._send({'type': 'event_ack', 'seq': event['seq']})
+
+    async def _handle_event(self, event: dict):
+        if event['type'] == 'done':
+            for done_callback in self._done_callbacks:
+                try:
+                    await done_callback(event['video_url'], event['additional_data'])
+                except Exception as e:
+                    # like LocalRenderingQueue
+                    await self._report_error(event['video_url'], e, event['additional_data'])
+        elif event['type'] == 'failed':
+            await self._report_error(event['id'], deserialize_exception(event['error']), event['additional_data'])
+        else:
+            self.LOGGER.warning(f"Unexpected event: {event}")
+
+    async def _report_error(self, id: Any, e: Exception, additional_data: Any):
+        for fail_callback in self._fail_callbacks:
+            try:
+                await fail_callback(id, e, additional_data)
+            except Exception:
+                self.LOGGER.exception(f"Exception in fail callback {fail_callback}")
@@ -0,0 +1,310 @@
+"""
+Opt-in profiling of the running process. Sending SIGUSR1 or creating the trigger file of the process in the state
+directory (profile-<role>.trigger, see profile_trigger_file; it can contain the duration in seconds) starts a profiling
+window:
+
+* CPU: a thread samples the stacks of all the threads. Samples of the event loop's thread are attributed to pipeline
+  stages by PROFILE_STAGE_RULES, samples of other threads to the thread.
+* memory: tracemalloc snapshots at the start and at the end of the window are compared.
+
+At the end, profile-<role>-<timestamp>.txt (summary) and profile-<role>-<timestamp>.folded (collapsed stacks, e.g., for
+flamegraph.pl or speedscope) are written to the state directory.
+"""
+import asyncio
+import datetime
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import List, Tuple, Optional, Dict
+
+from discord_downloader.io_executor import IoExecutor, DEFAULT_IO_EXECUTOR
+
+PROFILE_TRIGGER_FILE = 'profile.trigger'  # of a profiler without a role
+
+PROFILE_STAGE_INGEST = 'ingest'
+PROFILE_STAGE_ANALYZE = 'analyze'
+PROFILE_STAGE_RENDERING = 'rendering'
+PROFILE_STAGE_CALLBACKS = 'callbacks'
+PROFILE_STAGE_DB = 'db'
+PROFILE_STAGE_OTHER = 'other'
+PROFILE_STAGE_IDLE = 'idle'
+
+# (stage, file name, function name or None for the whole file). A sample belongs to the first rule that matches any
+# frame of its stack, so the more specific stages go first: e.g., the callbacks are called by the rendering queue, and
+# ingest awaits the DB writer.
+PROFILE_STAGE_RULES: List[Tuple[str, str, Optional[str]]] = [
+    (PROFILE_STAGE_CALLBACKS, 'download.py', '_after_upload'),
+    (PROFILE_STAGE_CALLBACKS, 'download.py', '_after_error'),
+    (PROFILE_STAGE_ANALYZE, 'download.py', '_post_to_igmdb'),
+    (PROFILE_STAGE_ANALYZE, 'download.py', '_analyze_demo'),
+    (PROFILE_STAGE_ANALYZE, 'demo_analyzer.py', None),
+    (PROFILE_STAGE_RENDERING, 'local_queue.py', None),
+    (PROFILE_STAGE_RENDERING, 'local_rendering_queue.py', None),
+    (PROFILE_STAGE_RENDERING, 'rendering_orchestrator.py', None),
+    (PROFILE_STAGE_RENDERING, 'render_farm.py', None),
+    (PROFILE_STAGE_RENDERING, 'demo_uploaders.py', None),
+    (PROFILE_STAGE_INGEST, 'download.py', '_archive_history'),
+    (PROFILE_STAGE_INGEST, 'download.py', '_archive_message'),
+    (PROFILE_STAGE_INGEST, 'download.py', '_download_attachments'),
+    (PROFILE_STAGE_INGEST, 'download.py', '_store_attachments'),
+    (PROFILE_STAGE_INGEST, 'download.py', '_analyze_demos'),
+    (PROFILE_STAGE_INGEST, 'download.py', '_submit_demos'),
+    (PROFILE_STAGE_INGEST, 'ingest_pipeline.py', None),
+    (PROFILE_STAGE_INGEST, 'partitioned_history.py', None),
+    (PROFILE_STAGE_INGEST, 'attachment_downloader.py', None),
+    (PROFILE_STAGE_INGEST, 'movers.py', None),
+    (PROFILE_STAGE_INGEST, 'pack_store.py', None),
+    (PROFILE_STAGE_INGEST, 'url_archive.py', None),
+    (PROFILE_STAGE_INGEST, 'rendered_demo_cache.py', None),
+    (PROFILE_STAGE_DB, 'db_writer.py', None),
+]
+
+# innermost frames of a thread that waits for something
+IDLE_FRAMES = {('selectors.py', 'select'), ('threading.py', 'wait'), ('queue.py', 'get'), ('thread.py', '_worker'),
+               ('loop_monitor.py', '_watch')}
+
+Frame = Tuple[str, str]  # (file name, function name)
+
+
+def classify_stack(stack: List[Frame], rules: List[Tuple[str, str, Optional[str]]] = PROFILE_STAGE_RULES) -> str:
+    """
+    :param stack: frames from the innermost one
+    """
+    if len(stack) > 0 and stack[0] in IDLE_FRAMES:
+        return PROFILE_STAGE_IDLE
+    for stage, filename, function in rules:
+        for frame_filename, frame_function in stack:
+            if frame_filename == filename and (function is None or function == frame_function):
+                return stage
+    return PROFILE_STAGE_OTHER
+
+
+def _stack_of(frame) -> List[Frame]:
+    stack = []
+    while frame is not None:
+        stack.append((os.path.basename(frame.f_code.co_filename), frame.f_code.co_name))
+        frame = frame.f_back
+    return stack
+
+
+class StackSampler:
+    """
+    Samples the stacks of all the threads.
+
+    Where possible (POSIX, the loop runs in the main thread), sampling is driven by ITIMER_PROF, i.e., by CPU time, and
+    the handler sees the frame that is running right now. Otherwise, a background thread samples every interval of
+    wall-clock time; it can only take a sample when it gets the GIL, so code that releases the GIL often (e.g., a loop
+    that polls its selector) gets more samples than it deserves.
+    """
+
+    def __init__(self, loop_thread_id: int, interval: float, rules: List[Tuple[str, str, Optional[str]]]):
+        self._loop_thread_id = loop_thread_id
+        self._interval = interval
+        self._rules = rules
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._previous_handler = None
+        self.cpu_time = hasattr(signal, 'setitimer') and loop_thread_id == threading.main_thread().ident
+        self.samples = 0
+        self.stage_samples: Counter = Counter()
+        self.self_samples: Counter = Counter()  # (stage, frame)
+        self.cumulative_samples: Counter = Counter()  # (stage, frame)
+        self.folded: Counter = Counter()
+
+    def start(self):
+        if self.cpu_time:
+            self._previous_handler = signal.signal(signal.SIGPROF, self._on_timer)
+            signal.setitimer(signal.ITIMER_PROF, self._interval, self._interval)
+        else:
+            self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self.cpu_time:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            signal.signal(signal.SIGPROF, self._previous_handler)
+        else:
+            self._stopped.set()
+            self._thread.join()
+
+    def _on_timer(self, signum, frame):
+        self._sample(threading.get_ident(), frame)
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            self._sample(threading.get_ident(), None)
+
+    def _sample(self, own_id: int, own_frame):
+        thread_names = {t.ident: t.name for t in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                frame = own_frame  # the handler's frame is the interrupted one, the sampler thread is not interesting
+            if frame is not None:
+                self._add(thread_id, _stack_of(frame), thread_names.get(thread_id, str(thread_id)))
+        self.samples += 1
+
+    def _add(self, thread_id: int, stack: List[Frame], thread_name: str):
+        if thread_id == self._loop_thread_id:
+            stage = classify_stack(stack, self._rules)
+        else:
+            stage = f"thread:{thread_name}"
+            if len(stack) > 0 and stack[0] in IDLE_FRAMES:
+                return  # idle threads would just bury the interesting samples
+        self.stage_samples[stage] += 1
+        if len(stack) > 0:
+            self.self_samples[(stage, stack[0])] += 1
+        for frame in set(stack):
+            self.cumulative_samples[(stage, frame)] += 1
+        self.folded[";".join([stage, *(f"{f}:{fn}" for f, fn in reversed(stack))])] += 1
+
+
+def profile_trigger_file(role: Optional[str]) -> str:
+    """
+    The processes sharing the state directory (the bot, the backfill, the render orchestrator) have their own trigger
+    files, so that a trigger profiles the process it was meant for.
+    """
+    return PROFILE_TRIGGER_FILE if role is None else f"profile-{role}.trigger"
+
+
+class RuntimeProfiler:
+    LOGGER = logging.getLogger('RuntimeProfiler')
+
+    def __init__(self, state_directory: str, duration: datetime.timedelta, sample_interval: float = 0.01,
+                 trigger_poll_interval: float = 5.0, rules: List[Tuple[str, str, Optional[str]]] = PROFILE_STAGE_RULES,
+                 io_executor: IoExecutor = DEFAULT_IO_EXECUTOR, role: Optional[str] = None):
+        self._state_directory = state_directory
+        self._role = role
+        self._trigger_file = profile_trigger_file(role)
+        self._duration = duration
+        self._sample_interval = sample_interval
+        self._trigger_poll_interval = trigger_poll_interval
+        self._rules = rules
+        self._io_executor = io_executor
+        self._requested: Optional[asyncio.Queue] = None
+        self._running = False
+
+    def trigger(self, duration: Optional[datetime.timedelta] = None):
+        if self._running:
+            self.LOGGER.info("Profiling is already running")
+            return
+        self._requested.put_nowait(self._duration if duration is None else duration)
+
+    async def run(self):
+        """
+        Waits for the triggers and profiles when asked to.
+        """
+        self._requested = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        signal_installed = False
+        if hasattr(signal, 'SIGUSR1'):
+            try:
+                loop.add_signal_handler(signal.SIGUSR1, self.trigger)
+                signal_installed = True
+            except (NotImplementedError, RuntimeError) as e:
+                self.LOGGER.info(f"Cannot handle SIGUSR1, only {self._trigger_file} will work: {e}")
+        trigger_file_watcher = loop.create_task(self._watch_trigger_file())
+        try:
+            while True:
+                duration = await self._requested.get()
+                await self.profile(duration)
+        finally:
+            trigger_file_watcher.cancel()
+            if signal_installed:
+                loop.remove_signal_handler(signal.SIGUSR1)
+
+    async def profile(self, duration: datetime.timedelta) -> str:
+        """
+        Profiles the process for the duration.
+        :return: file name of the summary
+        """
+        self._running = True
+        try:
+            self.LOGGER.info(f"Profiling for {duration.total_seconds():.0f} s…")
+            started_tracing = not tracemalloc.is_tracing()
+            if started_tracing:
+                tracemalloc.start(10)
+            try:
+                memory_before = await self._io_executor.run(tracemalloc.take_snapshot)
+                sampler = StackSampler(threading.get_ident(), self._sample_interval, self._rules)
+                started_at = time.perf_counter()
+                sampler.start()
+                try:
+                    await asyncio.sleep(duration.total_seconds())
+                finally:
+                    sampler.stop()
+                elapsed = time.perf_counter() - started_at
+                memory_after = await self._io_executor.run(tracemalloc.take_snapshot)
+                traced_current, traced_peak = tracemalloc.get_traced_memory()
+            finally:
+                if started_tracing:
+                    tracemalloc.stop()
+            prefix = "profile" if self._role is None else f"profile-{self._role}"
+            basename = os.path.join(self._state_directory,
+                                    f"{prefix}-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}")
+            summary = self._summary(sampler, elapsed, memory_before, memory_after, traced_current, traced_peak)
+            folded = "".join(f"{stack} {count}\n" for stack, count in sampler.folded.most_common())
+            await self._io_executor.run(_write, f"{basename}.txt", summary)
+            await self._io_executor.run(_write, f"{basename}.folded", folded)
+            self.LOGGER.info(f"Profile written to {basename}.txt")
+            return f"{basename}.txt"
+        finally:
+            self._running = False
+
+    async def _watch_trigger_file(self):
+        trigger_file = os.path.join(self._state_directory, self._trigger_file)
+        while True:
+            await asyncio.sleep(self._trigger_poll_interval)
+            if not os.path.exists(trigger_file):
+                continue
+            try:
+                with open(trigger_file) as f:
+                    content = f.read().strip()
+                os.remove(trigger_file)
+                self.trigger(datetime.timedelta(seconds=float(content)) if content != "" else None)
+            except (OSError, ValueError) as e:
+                self.LOGGER.warning(f"Bad {trigger_file}: {e}")
+
+    def _summary(self, sampler: StackSampler, elapsed: float, memory_before: tracemalloc.Snapshot,
+                 memory_after: tracemalloc.Snapshot, traced_current: int, traced_peak: int) -> str:
+        clock = "CPU time" if sampler.cpu_time else "wall-clock time"
+        lines = [f"Profile of {elapsed:.1f} s, {sampler.samples} samples every {self._sample_interval * 1000:.0f} ms "
+                 f"of {clock}", "", "CPU samples by stage:"]
+        for stage, count in sampler.stage_samples.most_common():
+            lines.append(f"  {stage:<32}{count:>8}{count / max(sampler.samples, 1) * 100:>8.1f} %")
+        for stage, _ in sampler.stage_samples.most_common():
+            if stage == PROFILE_STAGE_IDLE:
+                continue
+            lines += ["", f"[{stage}] self:"]
+            lines += _top_frames(sampler.self_samples, stage)
+            lines += [f"[{stage}] cumulative:"]
+            lines += _top_frames(sampler.cumulative_samples, stage)
+
+        lines += ["", f"Memory traced by tracemalloc: {traced_current / 1024:.0f} KiB, "
+                      f"peak {traced_peak / 1024:.0f} KiB",
+                  "", "Memory growth by stage (by file):"]
+        by_stage: Dict[str, int] = Counter()
+        for diff in memory_after.compare_to(memory_before, 'filename'):
+            filename = os.path.basename(diff.traceback[0].filename)
+            by_stage[classify_stack([(filename, '')], [r for r in self._rules if r[2] is None])] += diff.size_diff
+        for stage, size_diff in sorted(by_stage.items(), key=lambda x: -abs(x[1])):
+            lines.append(f"  {stage:<32}{size_diff / 1024:>+12.1f} KiB")
+        lines += ["", "Top memory growth:"]
+        for diff in memory_after.compare_to(memory_before, 'lineno')[:25]:
+            lines.append(f"  {diff}")
+        return "\n".join(lines) + "\n"
+
+
+def _top_frames(samples: Counter, stage: str, limit: int = 15) -> List[str]:
+    frames = [((filename, function), count) for (s, (filename, function)), count in samples.items() if s == stage]
+    frames.sort(key=lambda x: -x[1])
+    return [f"  {count:>8}  {filename}:{function}" for (filename, function), count in frames[:limit]]
+
+
+def _write(filename: str, content: str):
+    with open(filename, "w") as f:
+        f.write(content)
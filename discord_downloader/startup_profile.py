@@ -0,0 +1,34 @@
+import logging
+import time
+from typing import List, Tuple, Optional
+
+
+class StartupProfiler:
+    """
+    Measures how long each startup phase took. A phase lasts from the previous checkpoint (or from started_at) to the
+    checkpoint named after the phase.
+    """
+    LOGGER = logging.getLogger('StartupProfiler')
+
+    def __init__(self, enabled: bool, started_at: Optional[float] = None):
+        self._enabled = enabled
+        self._started_at = time.perf_counter() if started_at is None else started_at
+        self._last = self._started_at
+        self._phases: List[Tuple[str, float]] = []
+
+    def checkpoint(self, phase: str):
+        now = time.perf_counter()
+        self._phases.append((phase, now - self._last))
+        self._last = now
+
+    @property
+    def phases(self) -> List[Tuple[str, float]]:
+        return list(self._phases)
+
+    def report(self):
+        if not self._enabled:
+            return
+        total = self._last - self._started_at
+        self.LOGGER.info(f"Startup profile ({total * 1000:.1f} ms before client.start):")
+        for phase, duration in self._phases:
+            self.LOGGER.info(f"  {phase:<24}{duration * 1000:>10.1f} ms")
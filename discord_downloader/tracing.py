@@ -0,0 +1,119 @@
+import abc
+import logging
+import math
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Optional, List, Iterable, Tuple, NamedTuple, Dict
+
+from sqlalchemy import insert, select, update
+
+from discord_downloader.db import DemoStageTiming
+from discord_downloader.db_writer import BatchingDbWriter
+
+STAGE_ARCHIVE = 'archive'
+STAGE_ANALYZE = 'analyze'
+STAGE_ENQUEUE = 'enqueue'
+STAGE_RENDER = 'render'
+STAGE_UPLOAD = 'upload'
+STAGE_PUBLISH_DELAY = 'publish_delay'
+STAGE_ANNOUNCE = 'announce'
+
+STAGES = [STAGE_ARCHIVE, STAGE_ANALYZE, STAGE_ENQUEUE, STAGE_RENDER, STAGE_UPLOAD, STAGE_PUBLISH_DELAY,
+          STAGE_ANNOUNCE]
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex
+
+
+class StageTracer(abc.ABC):
+
+    @abc.abstractmethod
+    async def start(self, trace_id: Optional[str], stage: str) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def finish(self, trace_id: Optional[str], stage: str) -> None:
+        pass
+
+    @asynccontextmanager
+    async def stage(self, trace_id: Optional[str], stage: str):
+        await self.start(trace_id, stage)
+        try:
+            yield
+        finally:
+            await self.finish(trace_id, stage)
+
+
+class NopStageTracer(StageTracer):
+
+    async def start(self, trace_id: Optional[str], stage: str) -> None:
+        pass
+
+    async def finish(self, trace_id: Optional[str], stage: str) -> None:
+        pass
+
+
+class DbStageTracer(StageTracer):
+    """
+    Records start and end of each stage to the demo_stage_timings table. A stage can start in one process and finish
+    in another one (e.g., the bot restarts while a demo waits for publishing), so the start and the end are stored
+    separately. Tracing must never break (or slow down) the pipeline, so the writes are not awaited and DB errors are
+    just logged by the writer.
+    """
+    LOGGER = logging.getLogger('DbStageTracer')
+
+    def __init__(self, db_writer: BatchingDbWriter):
+        self._db_writer = db_writer
+
+    async def start(self, trace_id: Optional[str], stage: str) -> None:
+        if trace_id is None:
+            return
+        self._db_writer.submit(insert(DemoStageTiming).values(
+            trace_id=trace_id, stage=stage, started_at=time.time()
+        ))
+
+    async def finish(self, trace_id: Optional[str], stage: str) -> None:
+        if trace_id is None:
+            return
+        # The writer executes statements in order, so the matching start is already there.
+        latest_unfinished = select(DemoStageTiming.id)\
+            .where(DemoStageTiming.trace_id == trace_id)\
+            .where(DemoStageTiming.stage == stage)\
+            .where(DemoStageTiming.finished_at.is_(None))\
+            .order_by(DemoStageTiming.id.desc())\
+            .limit(1)\
+            .scalar_subquery()
+        self._db_writer.submit(
+            update(DemoStageTiming).where(DemoStageTiming.id == latest_unfinished).values(finished_at=time.time())
+        )
+
+
+class StageStatistics(NamedTuple):
+    stage: str
+    count: int
+    p50: float
+    p95: float
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """
+    Nearest-rank percentile of an already sorted non-empty list.
+    """
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def stage_statistics(durations: Iterable[Tuple[str, float]]) -> List[StageStatistics]:
+    by_stage: Dict[str, List[float]] = {}
+    for stage, duration in durations:
+        by_stage.setdefault(stage, []).append(duration)
+    known_stages = [stage for stage in STAGES if stage in by_stage]
+    other_stages = sorted(by_stage.keys() - set(STAGES))
+    res = []
+    for stage in known_stages + other_stages:
+        values = sorted(by_stage[stage])
+        res.append(StageStatistics(stage=stage, count=len(values), p50=percentile(values, 50),
+                                   p95=percentile(values, 95)))
+    return res
@@ -0,0 +1,113 @@
+import asyncio
+import time
+import urllib.parse
+from typing import List, Optional
+
+from sqlalchemy import select, or_
+from sqlalchemy.dialects.sqlite import insert
+
+from discord_downloader.db import ArchivedUrl
+from discord_downloader.db_writer import BatchingDbWriter
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+TRAILING_PUNCTUATION = ',.;:!?\'"'
+
+
+def normalize_url(url: str) -> str:
+    """
+    Normalizes the URL for deduplication: lowercase scheme and host, no default port, no trailing punctuation that is
+    likely to belong to the sentence rather than to the URL. A malformed URL (e.g., a bad port) is kept as it is.
+    """
+    url = url.rstrip(TRAILING_PUNCTUATION)
+    while url.endswith(')') and url.count('(') < url.count(')'):
+        url = url[:-1].rstrip(TRAILING_PUNCTUATION)
+    try:
+        parts = urllib.parse.urlsplit(url)
+        scheme = parts.scheme.lower()
+        netloc = (parts.hostname or '').lower()
+        port = parts.port
+    except ValueError:
+        return url
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        netloc = f"{netloc}:{port}"
+    path = parts.path or '/'
+    return urllib.parse.urlunsplit((scheme, netloc, path, parts.query, parts.fragment))
+
+
+def reverse_domain(domain: str) -> str:
+    """
+    www.example.com -> com.example.www, so subdomains of a domain share a prefix and can be looked up by an index.
+    """
+    return ".".join(reversed(domain.lower().strip('.').split('.')))
+
+
+def domain_of(normalized_url: str) -> str:
+    try:
+        return urllib.parse.urlsplit(normalized_url).hostname or ''
+    except ValueError:  # a malformed URL kept by normalize_url
+        return ''
+
+
+def upsert_statement(url: str, message_url: str, skip_reason: Optional[str] = None, seen_at: Optional[float] = None):
+    seen_at = time.time() if seen_at is None else seen_at
+    normalized_url = normalize_url(url)
+    statement = insert(ArchivedUrl).values(
+        normalized_url=normalized_url,
+        url=url,
+        reversed_domain=reverse_domain(domain_of(normalized_url)),
+        first_message_url=message_url,
+        first_seen_at=seen_at,
+        last_seen_at=seen_at,
+        occurrences=1,
+        skip_reason=skip_reason,
+    )
+    return statement.on_conflict_do_update(
+        index_elements=[ArchivedUrl.normalized_url],
+        set_={
+            'last_seen_at': statement.excluded.last_seen_at,
+            'occurrences': ArchivedUrl.occurrences + 1,
+        }
+    )
+
+
+def prefix_query(prefix: str):
+    # a prefix may end in the middle of the host, so it is only lowercased up to the path
+    scheme_end = prefix.find('://')
+    path_start = -1 if scheme_end < 0 else prefix.find('/', scheme_end + 3)
+    if path_start < 0:
+        normalized_prefix = prefix.lower()
+    else:
+        normalized_prefix = prefix[:path_start].lower() + prefix[path_start:]
+    # a range query instead of LIKE, so the unique index on normalized_url is used
+    return select(ArchivedUrl)\
+        .where(ArchivedUrl.normalized_url >= normalized_prefix)\
+        .where(ArchivedUrl.normalized_url < normalized_prefix + '￿')\
+        .order_by(ArchivedUrl.normalized_url)
+
+
+def domain_query(domain: str, include_subdomains: bool = True):
+    reversed_domain = reverse_domain(domain)
+    condition = ArchivedUrl.reversed_domain == reversed_domain
+    if include_subdomains:
+        condition = or_(condition, (ArchivedUrl.reversed_domain >= reversed_domain + '.') &
+                        (ArchivedUrl.reversed_domain < reversed_domain + '/'))  # '/' follows '.' in ASCII
+    return select(ArchivedUrl).where(condition).order_by(ArchivedUrl.first_seen_at)
+
+
+def export_line(archived_url: ArchivedUrl) -> str:
+    """
+    The format of the former URLS_FILE.
+    """
+    suffix = "" if archived_url.skip_reason is None else f" [skipped: {archived_url.skip_reason}]"
+    return f"{archived_url.url} ({archived_url.first_message_url}){suffix}\n"
+
+
+class UrlArchive:
+
+    def __init__(self, db_writer: BatchingDbWriter):
+        self._db_writer = db_writer
+
+    async def record(self, urls: List[str], message_url: str, skip_reason: Optional[str] = None):
+        # Awaited, so the URLs are committed before the savepoint moves past the message.
+        await asyncio.gather(*(self._db_writer.execute(upsert_statement(url, message_url, skip_reason))
+                               for url in urls))
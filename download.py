@@ -1,4 +1,8 @@
 #!/usr/bin/env python3
+import time
+
+STARTUP_STARTED_AT = time.perf_counter()
+
 import asyncio
 import logging
 import os
@@ -9,28 +13,36 @@ import urllib
 import urllib.parse
 from asyncio import ALL_COMPLETED
 from logging import FileHandler
-from typing import Optional, List, Dict, Tuple, Union
+from typing import Optional, List, Dict, Tuple, Union, NamedTuple, Callable, Iterable, TYPE_CHECKING
 
 import discord
 import filelock
 from discord import Message, Attachment, File
 from discord.abc import Messageable
-from discord.iterators import HistoryIterator
 from pathvalidate import sanitize_filename
-from sqlalchemy import insert, select
-from sqlalchemy.ext.asyncio import AsyncEngine, AsyncConnection
 
 from discord_downloader.additional_data import AdditionalData
-from discord_downloader.db import create_current_db_engine, RenderedDemo
+from discord_downloader.archive_rules import ArchiveRules, ArchiveRule
+from discord_downloader.attachment_downloader import AttachmentDownloader, ResumableAttachmentDownloader
+from discord_downloader.db import create_current_db_engine
+from discord_downloader.db_writer import BatchingDbWriter
 from discord_downloader.demo_analyzer import DemoAnalyzer
+from discord_downloader.demo_index import DemoIndex, DemoSummary, summarize
 from discord_downloader.demo_uploaders import FakeUploader, IgmdbUploader, OdfeDemoRenderer, \
     YoutubeUploader, VideoUploadException
+from discord_downloader.ingest_pipeline import OrderedPipeline, PipelineStage
+from discord_downloader.io_executor import DEFAULT_IO_EXECUTOR
 from discord_downloader.local_queue import LocallyQueuedUploader, AutonomousRenderingQueue, PollingRenderingQueue, \
     RenderingQueue
 from discord_downloader.local_rendering_queue import LocalRenderingQueue
-from discord_downloader.movers import DeduplicatingRenamingMover
+from discord_downloader.movers import DeduplicatingRenamingMover, DeduplicatingMover, file_sha256
+from discord_downloader.partitioned_history import PartitionedHistory
 from discord_downloader.persistent_state import StoredState, Savepoint
-from settings import DISCORD_TOKEN, CHANNELS, STATE_DIRECTORY, ATTACHMENTS_DIRECTORY, URLS_FILE, TEMP_DIRECTORY, \
+from discord_downloader.rendered_demo_cache import RenderedDemoCache
+from discord_downloader.startup_profile import StartupProfiler
+from discord_downloader.tracing import StageTracer, DbStageTracer, new_trace_id, STAGE_ARCHIVE, STAGE_ANALYZE, \
+    STAGE_ENQUEUE
+from settings import DISCORD_TOKEN, CHANNELS, STATE_DIRECTORY, ATTACHMENTS_DIRECTORY, TEMP_DIRECTORY, \
     RENDERING_OUTPUT_CHANNEL, IGMDB_TOKEN, RENDERING_DONE_MESSAGE_PREFIX, RENDERING_DONE_MESSAGE_SUFFIX, \
     IGMDB_POLLING_INTERVAL, DEMOCLEANER_EXE, DEMO_RENDERING_PROVIDER, DEMO_RENDERING_LOCAL_PUBLISHING_DELAY, \
     DEMO_RENDERING_LOCAL_ODFE_DIR, DEMO_RENDERING_LOCAL_ODFE_EXECUTABLE, DEMO_RENDERING_LOCAL_ODFE_CONFIG, \
@@ -38,25 +50,89 @@ from settings import DISCORD_TOKEN, CHANNELS, STATE_DIRECTORY, ATTACHMENTS_DIREC
     DEMO_RENDERING_LOCAL_YOUTUBE_EXECUTABLE, DEMO_RENDERING_LOCAL_YOUTUBE_PARAMS, DISCORD_MAX_VIDEO_SIZE, \
     REACTIONS_WIP, REACTIONS_REJECTED, REACTIONS_DONE, REACTIONS_FAILED, \
     DEMO_RENDERING_LOCAL_YOUTUBE_DESCRIPTION_SUFFIX, DEMO_RENDERING_MISSING_DETAILS_REPORT_USER_ID, \
-    already_rendered_message, RENDERING_DONE_MESSAGE_DISCORD
+    already_rendered_message, RENDERING_DONE_MESSAGE_DISCORD, HISTORY_SCAN_WINDOW, HISTORY_SCAN_PARALLELISM, \
+    ARCHIVE_RULES, ATTACHMENT_PACKS_DIRECTORY, ATTACHMENT_PACKS_MAX_FILE_SIZE, DB_WRITE_BATCH_WINDOW, \
+    RENDER_FARM_LISTEN_HOST, RENDER_FARM_LISTEN_PORT, RENDER_FARM_TOKEN, RENDER_FARM_MAX_CONCURRENT_JOBS, \
+    RENDER_FARM_LEASE, DEMO_RENDERING_ORCHESTRATOR_PORT, DEMO_RENDERING_ORCHESTRATOR_TOKEN, \
+    DEMO_RENDERING_LOCAL_ODFE_BATCH_SIZE, EVENT_LOOP_BLOCK_THRESHOLD, PROFILING_DURATION, PROFILING_SAMPLE_INTERVAL, \
+    GATEWAY_RECORDING_FILE, DEMO_RENDERING_VIDEO_CACHE_DIR, DEMO_RENDERING_VIDEO_CACHE_MAX_SIZE, \
+    demo_rendering_local_odfe_discord_config_prefix, MENTION_GAP_CHECK_LIMIT, INGEST_DOWNLOAD_CONCURRENCY, \
+    INGEST_ANALYZE_CONCURRENCY, INGEST_QUEUE_SIZE, DEMO_RENDERING_CHANNEL_WEIGHTS, DEMO_RENDERING_FAIR_PER_USER
+
+# The optional subsystems are imported by the factories that create them, so they don't slow down the startup when
+# they are disabled.
+if TYPE_CHECKING:
+    from discord_downloader.gateway_recorder import GatewayRecorder
+
+
+# Messages older than this are not archived by the bot.
+DEFAULT_HISTORY_START = 891111111283456789
+
+
+def has_messages_after(channel: Messageable, message_id: int) -> bool:
+    """
+    Tells from the last_message_id the gateway keeps for the channel, so channels without news don't cost a REST call.
+    Channels that don't have it are assumed to have news.
+    """
+    last_message_id = getattr(channel, 'last_message_id', message_id + 1)
+    # None when nothing has ever been posted
+    return last_message_id is not None and last_message_id > message_id
 
 
 def extract_urls(msg):
     return re.findall(r'(https?://[^\s]+)', msg)
 
 
+class _IngestedAttachment(NamedTuple):
+    attachment: Attachment
+    file: str  # the downloaded temporary file, the archived file after _store_attachments
+    is_demo: bool
+    trace_id: Optional[str]
+    content_hash: Optional[str]
+    is_new: Optional[bool] = None
+    render_url: Optional[str] = None  # of a demo that has been rendered already
+    analysis: Union['_DemoAnalysis', Exception, None] = None
+
+
+class _DemoAnalysis(NamedTuple):
+    summary: DemoSummary
+    additional_data: AdditionalData
+
+
+class _IngestItem(NamedTuple):
+    """
+    A position in the channel history going through the ingest pipeline; the savepoint is set to savepoint_id when
+    all the previous items are done. The message is None when there is nothing to archive.
+    """
+    savepoint_id: int
+    message: Optional[Message]
+    attachments: List[_IngestedAttachment] = []
+
+
 class DownloaderClient(discord.Client):
     _expected_thread = None
     _output_channels: Dict[Optional[str], List[Messageable]]
     _dirty = False
 
-    def __init__(self, uploader: RenderingQueue, demo_analyzer: DemoAnalyzer, loop, conn: AsyncEngine):
+    def __init__(self, uploader: RenderingQueue, demo_analyzer: DemoAnalyzer, loop, db_writer: BatchingDbWriter,
+                 tracer: StageTracer, attachment_downloader: AttachmentDownloader,
+                 recorder: Optional['GatewayRecorder'] = None):
         super(DownloaderClient, self).__init__(loop=loop)
+        self._recorder = recorder
         self._uploader = uploader
+        self._attachment_downloader = attachment_downloader
+        self._archive_rules = ArchiveRules(ARCHIVE_RULES)
+        self._mover = create_mover()
+        from discord_downloader.url_archive import UrlArchive
+        self._url_archive = UrlArchive(db_writer)
+        self._demo_index = DemoIndex(db_writer)
+        self._rendered_demos = RenderedDemoCache(db_writer)
+        # the cache is kept up to date by record, so it is loaded once, not on every reconnect (on_ready)
+        self._rendered_demos_loaded = False
         self.ret = 0
-        self._conn = conn
+        self._tracer = tracer
         self._loop = loop
-        self._lock = asyncio.Lock(loop=loop)
+        self._lock = asyncio.Lock()
         self._check_thread()
         self._prepared = False
         self._demo_analyzer = demo_analyzer
@@ -72,6 +148,8 @@ class DownloaderClient(discord.Client):
                 self._check_thread()
                 await self._init_channels()
                 self._check_thread()
+                await self._load_rendered_demos()
+                self._check_thread()
                 await self._check_uploads()
                 self._check_thread()
                 await self._download_news()
@@ -111,6 +189,8 @@ class DownloaderClient(discord.Client):
         if os.environ.get('SIMULATE_EXCEPTION') == '1':
             raise Exception('Simulantenbande!')
         self._check_thread()
+        if self._recorder is not None:
+            self._recorder.record_on_message(message)
         if not self._prepared:
             self._dirty = True
         else:
@@ -120,8 +200,11 @@ class DownloaderClient(discord.Client):
                 return
             self._logger.info(f"new message in channel: {channel_name} ({message.channel})")
             check_all_messages = channel_name in CHANNELS
-            self._logger.info("Checking single channel…")
-            await self._download_channel(channel_name, message.channel, check_all_messages)
+            if not check_all_messages and MENTION_GAP_CHECK_LIMIT is not None:
+                await self._archive_mention_event(channel_name, message)
+            else:
+                self._logger.info("Checking single channel…")
+                await self._download_channel(channel_name, message.channel, check_all_messages)
             self._check_thread()
             self._logger.info("on_message: done")
 
@@ -192,7 +275,10 @@ class DownloaderClient(discord.Client):
                 rerendering_round=next_round,
                 url=additional_data.url,
                 has_unknown=additional_data.has_unknown,
-                filename=additional_data.filename
+                filename=additional_data.filename,
+                trace_id=additional_data.trace_id,
+                content_hash=additional_data.content_hash,
+                author_id=additional_data.author_id
             )
             await self._uploader.upload(
                 url=additional_data.url,
@@ -281,6 +367,8 @@ class DownloaderClient(discord.Client):
         self._check_thread()
         self._channels = await self._get_channels()
         self._reverse_channels = {v: k for k, v in self._channels.items()}
+        if self._recorder is not None:
+            self._recorder.record_channels(self._channels, CHANNELS.keys(), self.user)
         self._check_thread()
         missing = CHANNELS.keys() - self._channels.keys()
         if len(missing) > 0:
@@ -307,12 +395,15 @@ class DownloaderClient(discord.Client):
         async with self._lock:
             self._logger.info("Checking individual channels")
             channel: Messageable
+            skipped = 0
             for name, channel in self._channels.items():
                 check_all_mesages = name in CHANNELS
-                self._logger.info(f"## {name} (check all: {check_all_mesages})")
-                await self._download_channel_without_lock(name, channel, check_all_mesages)
+                self._logger.debug(f"## {name} (check all: {check_all_mesages})")
+                if not await self._download_channel_without_lock(name, channel, check_all_mesages):
+                    skipped += 1
                 self._check_thread()
-            self._logger.info("_download_news: Everything done")
+            self._logger.info(f"_download_news: Everything done, {skipped} of {len(self._channels)} channels have "
+                              f"been skipped as unchanged")
 
     async def _get_channels(self):
         channels = {}
@@ -330,122 +421,294 @@ class DownloaderClient(discord.Client):
             await self._download_channel_without_lock(name, channel, check_all_messages)
             self._check_thread()
 
-    async def _download_channel_without_lock(self, name: str, channel: Messageable, check_all_messages: bool):
+    async def _download_channel_without_lock(self, name: str, channel: Messageable, check_all_messages: bool) -> bool:
+        """
+        :return: False when the channel has been skipped, because it has no messages after the savepoint
+        """
         self._check_thread()
         savepoint = Savepoint(os.path.join(STATE_DIRECTORY, urllib.parse.quote(name) + ".txt"))
-        mover = DeduplicatingRenamingMover()
+        if not has_messages_after(channel, savepoint.get() or DEFAULT_HISTORY_START):
+            # nothing to write, so the savepoint is not closed
+            return False
+        if check_all_messages or MENTION_GAP_CHECK_LIMIT is None:
+            await self._archive_history(name, channel, check_all_messages, savepoint)
+        else:
+            await self._check_mentions_gap(name, channel, savepoint)
+        return True
+
+    async def _check_mentions_gap(self, name: str, channel: Messageable, savepoint: Savepoint):
+        """
+        Catch-up of a channel that is not in CHANNELS. Its mentions are archived from the gateway events, so after a
+        restart or a reconnect, just the newest MENTION_GAP_CHECK_LIMIT messages after the savepoint are checked,
+        instead of the whole history. When there are more of them, the history after the savepoint is scanned for
+        mentions. The savepoint is closed at the end.
+        """
+        last_processed_message_id = savepoint.get() or DEFAULT_HISTORY_START
+        history_channel = channel if self._recorder is None else self._recorder.wrap_channel(channel)
+        messages = []
+        try:
+            # one more than the limit tells whether there are more new messages than the limit
+            async for message in history_channel.history(limit=MENTION_GAP_CHECK_LIMIT + 1):  # the newest first
+                if message.id <= last_processed_message_id:
+                    break
+                if len(messages) == MENTION_GAP_CHECK_LIMIT:
+                    self._logger.info(f"More than {MENTION_GAP_CHECK_LIMIT} new messages in {name}, scanning all "
+                                      f"of them for mentions")
+                    await self._archive_history(name, channel, False, savepoint)
+                    return
+                messages.append(message)
+            archive_rule = self._archive_rules.for_channel(name)
+            for message in reversed(messages):
+                if self.user in message.mentions:
+                    await self._archive_message(name, message, archive_rule, enqueue_renders=True)
+                await savepoint.set(message.id)  # mark as done
+        except discord.errors.Forbidden:
+            self._logger.warning(f"No access to channel {channel}")
+        await savepoint.flush()
+
+    async def _archive_mention_event(self, name: str, message: Message):
+        """
+        Handles a new message in a channel that is not in CHANNELS without reading the history.
+        """
+        async with self._lock:
+            self._check_thread()
+            savepoint = Savepoint(os.path.join(STATE_DIRECTORY, urllib.parse.quote(name) + ".txt"))
+            if message.id <= (savepoint.get() or DEFAULT_HISTORY_START):
+                return  # already seen by the gap check
+            if self.user in message.mentions:
+                await self._archive_message(name, message, self._archive_rules.for_channel(name),
+                                            enqueue_renders=True)
+            await savepoint.set(message.id)
+            await savepoint.flush()
+            self._check_thread()
+
+    async def _archive_history(self, name: str, channel: Messageable, check_all_messages: bool, savepoint: Savepoint,
+                               start_after: int = DEFAULT_HISTORY_START, before: Optional[int] = None,
+                               enqueue_renders: bool = True):
+        """
+        Archives messages after the savepoint (or after start_after when the savepoint is empty) and before the given
+        message id. The savepoint is closed at the end.
+        """
+        archive_rule = self._archive_rules.for_channel(name)
         last_processed_message_id = savepoint.get()  # messages have increasing ids; we can use it to mark what messages we have seen
         self._logger.info(f"channel: {type(channel)} {channel}")
-        history: HistoryIterator = channel.history(
-            limit=None,
-            oldest_first=True,
-            after=discord.Object(891111111283456789) if last_processed_message_id is None else discord.Object(last_processed_message_id)
+        history = PartitionedHistory(
+            channel if self._recorder is None else self._recorder.wrap_channel(channel),
+            after_id=start_after if last_processed_message_id is None else last_processed_message_id,
+            before_id=before,
+            window=HISTORY_SCAN_WINDOW,
+            parallelism=HISTORY_SCAN_PARALLELISM
         )
-        with open(URLS_FILE, "a") as urls_file:
-            def before_sync():
-                self._logger.info("Syncing… ")
-                urls_file.flush()
-                os.fsync(urls_file.fileno())
-
-            def after_sync():
-                self._logger.info("Sync done")
-
-            async def archive_message(message: Message):
-                self._logger.info(f"#{message.id} {message.created_at}: {message.content}")
-                urls = extract_urls(message.content)
-                if len(urls) > 0:
-                    for url in urls:
-                        urls_file.write(f"{url} ({message.jump_url})\n")
-
-                attachment: Attachment
-                for i, attachment in enumerate(message.attachments):
-                    tmp_file = os.path.join(TEMP_DIRECTORY, f"{message.id}-{attachment.id}-{i}-{os.getpid()}")
-                    sanitized_attachment_filename = sanitize_filename(attachment.filename, replacement_text='-')
-                    out_file = os.path.join(
-                        ATTACHMENTS_DIRECTORY,
-                        sanitized_attachment_filename
-                    )
-                    with open(tmp_file, mode="wb") as f:
-                        await attachment.save(f)
-                        self._check_thread()
-                        f.flush()
-                        os.fsync(f.fileno())
-                    new_attachment_filename, is_new = mover.move(tmp_file, out_file)
-
-                    if self._is_dm6x_filename(attachment):
-                        if is_new:
-                            await self._add_reactions(message, REACTIONS_WIP)
-                            await self._post_to_igmdb(attachment, new_attachment_filename, name, message)
-                            self._check_thread()
-                        else:
-                            render_url = await self._get_rendered_video_url(sanitized_attachment_filename)
-                            if render_url is not None:
-                                await self._add_reactions(message, REACTIONS_REJECTED)
-                                await message.reply(already_rendered_message(render_url))
-                            else:
-                                # We have already rendered it, but we don't have the YT URL
-                                await self._add_reactions(message, REACTIONS_WIP)
-                                await self._post_to_igmdb(attachment, new_attachment_filename, name, message)
-                                self._check_thread()
-
-                    self._logger.info(f"* {attachment} (new: {new_attachment_filename})")
+        pipeline = OrderedPipeline([
+            PipelineStage('download', lambda item: self._download_attachments(item, archive_rule),
+                          INGEST_DOWNLOAD_CONCURRENCY, discard=self._discard_downloads),
+            # one at a time, so the archived files get their names in the order of the messages
+            PipelineStage('store', self._store_attachments, 1),
+            PipelineStage('analyze', lambda item: self._analyze_demos(name, item, enqueue_renders),
+                          INGEST_ANALYZE_CONCURRENCY),
+            # one at a time, so a message after a failed one is not replied to nor enqueued before the failure stops
+            # the pipeline (and then once more when the history is read again from the savepoint)
+            PipelineStage('submit', lambda item: self._submit_demos(item, enqueue_renders), 1),
+        ], queue_size=INGEST_QUEUE_SIZE)
+
+        async def items():
+            async for window_last_id, messages in history.windows():
+                async for m in messages:
+                    yield _IngestItem(m.id, m if check_all_messages or self.user in m.mentions else None)
+                if window_last_id is not None:
+                    # all the previous windows are done, so we can skip the rest of this (possibly empty) window
+                    yield _IngestItem(window_last_id, None)
+
+        async def commit(item: _IngestItem):
+            await savepoint.set(item.savepoint_id)  # mark as done, all the previous items are done, too
 
+        try:
+            await pipeline.run(items(), commit)
+        except discord.errors.Forbidden:
+            self._logger.warning(f"No access to channel {channel}")
+        await savepoint.flush()
+
+    async def _archive_message(self, name: str, message: Message, archive_rule: ArchiveRule, enqueue_renders: bool):
+        item = await self._download_attachments(_IngestItem(message.id, message), archive_rule)
+        item = await self._store_attachments(item)
+        item = await self._analyze_demos(name, item, enqueue_renders)
+        await self._submit_demos(item, enqueue_renders)
+
+    async def _download_attachments(self, item: _IngestItem, archive_rule: ArchiveRule) -> _IngestItem:
+        """
+        The first ingest stage: records the URLs and downloads the attachments to temporary files.
+        """
+        message = item.message
+        if message is None:
+            return item
+        self._logger.info(f"#{message.id} {message.created_at}: {message.content}")
+        urls = extract_urls(message.content)
+        await self._url_archive.record(urls, message.jump_url)
+
+        downloaded = []
+        attachment: Attachment
+        try:
+            for attachment in message.attachments:
+                skip_reason = archive_rule.skip_reason(attachment.filename, attachment.size)
+                if skip_reason is not None:
+                    # keep the URL, so the attachment can be fetched later if needed
+                    self._logger.info(f"* {attachment} skipped: {skip_reason}")
+                    await self._url_archive.record([attachment.url], message.jump_url, skip_reason=skip_reason)
+                    continue
+                is_demo = self._is_dm6x_filename(attachment)
+                trace_id = new_trace_id() if is_demo else None
+                await self._tracer.start(trace_id, STAGE_ARCHIVE)  # finished by _store_attachments
+                try:
+                    tmp_file = await self._attachment_downloader.download(attachment)
+                    self._check_thread()
+                    content_hash = await DEFAULT_IO_EXECUTOR.run(file_sha256, tmp_file) if is_demo else None
+                except BaseException:
+                    await self._tracer.finish(trace_id, STAGE_ARCHIVE)
+                    raise
+                downloaded.append(_IngestedAttachment(attachment, tmp_file, is_demo, trace_id, content_hash))
+        except BaseException:
+            await self._discard_downloads(item._replace(attachments=downloaded))
+            raise
+        return item._replace(attachments=downloaded)
+
+    async def _discard_downloads(self, item: _IngestItem):
+        """
+        Removes the temporary files of a downloaded item that is not going to be stored.
+        """
+        for ingested in item.attachments:
+            await DEFAULT_IO_EXECUTOR.run(_remove_if_exists, ingested.file)
+            await self._tracer.finish(ingested.trace_id, STAGE_ARCHIVE)
+
+    async def _store_attachments(self, item: _IngestItem) -> _IngestItem:
+        """
+        The second ingest stage: moves the downloaded attachments to ATTACHMENTS_DIRECTORY (or deduplicates them).
+        """
+        mover = self._mover
+        stored = []
+        for ingested in item.attachments:
+            sanitized_attachment_filename = sanitize_filename(ingested.attachment.filename, replacement_text='-')
+            out_file = os.path.join(
+                ATTACHMENTS_DIRECTORY,
+                sanitized_attachment_filename
+            )
             try:
-                async for m in history:
-                    if check_all_messages or self.user in m.mentions:
-                        await archive_message(m)
-                    savepoint.set(m.id, before_sync=before_sync, after_sync=after_sync)  # mark as done
-            except discord.errors.Forbidden:
-                self._logger.warning(f"No access to channel {channel}")
-        savepoint.close()
+                # one mover at a time, as it looks for a free name before renaming
+                new_attachment_filename, is_new = await DEFAULT_IO_EXECUTOR.run(mover.move, ingested.file, out_file,
+                                                                                key=mover)
+            finally:
+                await self._tracer.finish(ingested.trace_id, STAGE_ARCHIVE)
+            self._check_thread()
+            self._logger.info(f"* {ingested.attachment} (new: {new_attachment_filename})")
+            stored.append(ingested._replace(file=new_attachment_filename, is_new=is_new))
+        return item._replace(attachments=stored)
+
+    async def _analyze_demos(self, name: str, item: _IngestItem, enqueue_renders: bool) -> _IngestItem:
+        """
+        The third ingest stage: analyzes the archived demos that have not been rendered yet. It has no visible effects,
+        the results (including the errors) are reported by _submit_demos.
+        """
+        if not enqueue_renders:
+            return item
+        analyzed = []
+        for ingested in item.attachments:
+            if ingested.is_demo:
+                # A new file can still be a renamed demo we have already rendered.
+                render_url = self._rendered_demos.get(
+                    ingested.content_hash,
+                    legacy_filename=None if ingested.is_new else os.path.basename(ingested.file)
+                )
+                if render_url is not None:
+                    ingested = ingested._replace(render_url=render_url)
+                else:
+                    try:
+                        analysis = await self._analyze_demo(ingested, name, item.message)
+                    except Exception as e:
+                        self._check_thread()
+                        analysis = e
+                    ingested = ingested._replace(analysis=analysis)
+            analyzed.append(ingested)
+        return item._replace(attachments=analyzed)
+
+    async def _submit_demos(self, item: _IngestItem, enqueue_renders: bool) -> _IngestItem:
+        """
+        The last ingest stage: reacts to the demos and enqueues them for rendering.
+        """
+        message = item.message
+        if not enqueue_renders:
+            return item
+        for ingested in item.attachments:
+            if not ingested.is_demo:
+                continue
+            if ingested.render_url is not None:
+                await self._add_reactions(message, REACTIONS_REJECTED)
+                await message.reply(already_rendered_message(ingested.render_url))
+            else:
+                await self._add_reactions(message, REACTIONS_WIP)
+                await self._post_to_igmdb(ingested, message)
+                self._check_thread()
+        return item
 
     def _is_dm6x_filename(self, filename) -> bool:
         return re.compile(".*\\.dm_6[0-9]$").match(filename.filename) is not None
 
-    async def _post_to_igmdb(self, attachment: Attachment, local_filename: str, channel_name: str, message: Message):
+    async def _analyze_demo(self, ingested: _IngestedAttachment, channel_name: str, message: Message) -> _DemoAnalysis:
         self._check_thread()
         has_unknown = False
-        try:
-            demo_info = await self._demo_analyzer.analyze(local_filename)
-            self._check_thread()
+        async with self._tracer.stage(ingested.trace_id, STAGE_ANALYZE):
+            with self._mover.local_file(ingested.file) as analyzed_file:
+                demo_info = await self._demo_analyzer.analyze(analyzed_file)
+        self._check_thread()
 
-            def unknown_if_none(inp: Optional[str]):
-                if inp is None:
-                    nonlocal has_unknown
-                    has_unknown = True
-                    return '<unknown>'
-                else:
-                    return inp
-
-            nick = unknown_if_none(demo_info['player'].get('uncoloredName') or demo_info['player'].get('df_name'))
-            mapname = unknown_if_none(demo_info['client'].get('mapname'))
-            physics = unknown_if_none(self._extract_physics(demo_info['game'].get('gameplay')))
-            time = unknown_if_none(demo_info['record'].get('bestTime'))
-            title = f"DeFRaG: {nick} {time} {physics} {mapname}".replace('<', '_').replace('>', '_')
-            description_orig = f"Nickname: {nick}\nTime: {time}\nPhysics: {physics}\nMap: {mapname}\n" \
-                               f"{DEMO_RENDERING_LOCAL_YOUTUBE_DESCRIPTION_SUFFIX}"
-            description = description_orig.replace('<', '_').replace('>', '_')
-            additional_data = AdditionalData(
-                in_channel=channel_name,
-                message_id=message.id,
-                title=title,
-                description=description,
-                rerendering_round=None,
-                url=attachment.url,
-                has_unknown=has_unknown,
-                filename=os.path.basename(local_filename)
-            )
-        except Exception as e:
-            self._check_thread()
-            await self._after_error(attachment.id, e, None, filename=attachment.filename)
+        def unknown_if_none(inp: Optional[str]):
+            if inp is None:
+                nonlocal has_unknown
+                has_unknown = True
+                return '<unknown>'
+            else:
+                return inp
+
+        summary = summarize(demo_info)
+        nick = unknown_if_none(summary.player)
+        mapname = unknown_if_none(summary.map)
+        physics = unknown_if_none(summary.physics)
+        time = unknown_if_none(summary.time)
+        title = f"DeFRaG: {nick} {time} {physics} {mapname}".replace('<', '_').replace('>', '_')
+        description_orig = f"Nickname: {nick}\nTime: {time}\nPhysics: {physics}\nMap: {mapname}\n" \
+                           f"{DEMO_RENDERING_LOCAL_YOUTUBE_DESCRIPTION_SUFFIX}"
+        description = description_orig.replace('<', '_').replace('>', '_')
+        additional_data = AdditionalData(
+            in_channel=channel_name,
+            message_id=message.id,
+            title=title,
+            description=description,
+            rerendering_round=None,
+            url=ingested.attachment.url,
+            has_unknown=has_unknown,
+            filename=os.path.basename(ingested.file),
+            trace_id=ingested.trace_id,
+            content_hash=ingested.content_hash,
+            author_id=message.author.id
+        )
+        return _DemoAnalysis(summary, additional_data)
+
+    async def _post_to_igmdb(self, ingested: _IngestedAttachment, message: Message):
+        self._check_thread()
+        attachment = ingested.attachment
+        if isinstance(ingested.analysis, Exception):
+            await self._after_error(attachment.id, ingested.analysis, None, filename=attachment.filename)
             return
+        summary, additional_data = ingested.analysis
+
+        if ingested.content_hash is not None:
+            await self._demo_index.record(ingested.content_hash, ingested.file, summary, message.jump_url)
 
         try:
+            await self._tracer.start(ingested.trace_id, STAGE_ENQUEUE)
             await self._uploader.upload(
                 url=attachment.url,
                 resolution=28,
-                title=title,
-                description=description,
+                title=additional_data.title,
+                description=additional_data.description,
                 additional_data=additional_data.serialize()
             )
         except Exception as e:
@@ -464,14 +727,6 @@ class DownloaderClient(discord.Client):
             if self._loop != asyncio.get_running_loop():
                 raise Exception(f"Bad event loop: {self._loop} != {asyncio.get_running_loop()}")
 
-    def _extract_physics(self, gameplay):
-        if gameplay is None:
-            return None
-        match = re.compile('.*\\((.*)\\)$').match(gameplay)
-        if match is None:
-            return gameplay
-        else:
-            return match.group(1)
 
     async def _remove_reactions(self, message: Message):
         my_reactions = filter(lambda m: m.me, message.reactions)
@@ -498,22 +753,33 @@ class DownloaderClient(discord.Client):
         await self._add_reactions(message, reactions)
 
     async def _record_uploaded_video(self, url: str, additional_data: AdditionalData):
-        async with self._conn.begin() as connection:
-            connection: AsyncConnection
-            await connection.execute(insert(RenderedDemo).values(url=url, filename=additional_data.filename))
-
-    async def _get_rendered_video_url(self, filename):
-        async with self._conn.begin() as conn:
-            conn: AsyncConnection
-            res = await conn.execute(select(RenderedDemo).where(RenderedDemo.filename == filename))
-            all = res.fetchall()
-            if len(all) == 0:
-                return None
-            if len(all) == 1:
-                [record] = all
-                record: RenderedDemo
-                return record.url
-            raise Exception(f"WTF: {all} {filename}")
+        await self._rendered_demos.record(url, additional_data.filename, additional_data.content_hash)
+
+    async def _load_rendered_demos(self):
+        if self._rendered_demos_loaded:
+            return
+        def legacy_hasher(filename: str) -> Optional[str]:
+            stored_file = os.path.join(ATTACHMENTS_DIRECTORY, filename)
+            with self._mover.local_file(stored_file) as local_file:
+                return file_sha256(local_file) if os.path.exists(local_file) else None
+
+        await self._rendered_demos.load(legacy_hasher)
+        self._rendered_demos_loaded = True
+
+
+def _remove_if_exists(filename: str):
+    try:
+        os.remove(filename)
+    except FileNotFoundError:
+        pass
+
+
+def create_mover() -> DeduplicatingMover:
+    if ATTACHMENT_PACKS_DIRECTORY is None:
+        return DeduplicatingRenamingMover()
+    else:
+        from discord_downloader.pack_store import PackStore, PackingMover
+        return PackingMover(PackStore(ATTACHMENT_PACKS_DIRECTORY), TEMP_DIRECTORY, ATTACHMENT_PACKS_MAX_FILE_SIZE)
 
 
 def create_igmdb_uploader():
@@ -524,59 +790,157 @@ def create_igmdb_uploader():
             return IgmdbUploader(IGMDB_TOKEN)
 
 
-def create_uploader() -> Tuple[StoredState, RenderingQueue]:
+def create_uploader(tracer: StageTracer) -> Tuple[StoredState, RenderingQueue]:
     if DEMO_RENDERING_PROVIDER == 'igmdb':
         up = create_igmdb_uploader()
         upload_queue_json_file = os.path.join(STATE_DIRECTORY, "igmdb-upload-queue.json")
         igmdb_state = StoredState(upload_queue_json_file, LocallyQueuedUploader.get_default_state())
-        return igmdb_state, (LocallyQueuedUploader(up, igmdb_state) if up is not None else None)
-    elif DEMO_RENDERING_PROVIDER == 'local-rendering':
-        upload_queue_json_file = os.path.join(STATE_DIRECTORY, "local-rendering-queue.json")
-        local_queue_state = StoredState(upload_queue_json_file, LocalRenderingQueue.get_default_state())
-        queue = LocalRenderingQueue(
-            demo_renderer=OdfeDemoRenderer(
-                odfe_dir=DEMO_RENDERING_LOCAL_ODFE_DIR,
-                odfe_executable=DEMO_RENDERING_LOCAL_ODFE_EXECUTABLE,
-                config_dir=DEMO_RENDERING_LOCAL_ODFE_CONFIG,
-                demo_dir=DEMO_RENDERING_LOCAL_ODFE_DEMO,
-                video_dir=DEMO_RENDERING_LOCAL_ODFE_VIDEO,
-                defrag_config=DEMO_RENDERING_LOCAL_ODFE_CONFIG_PREFIX
-            ),
-            rendered_demo_uploader=YoutubeUploader(
-                youtube_uploader_executable=DEMO_RENDERING_LOCAL_YOUTUBE_EXECUTABLE,
-                youtube_uploader_params=DEMO_RENDERING_LOCAL_YOUTUBE_PARAMS
-            ),
-            state=local_queue_state,
-            delay_before_publishing=DEMO_RENDERING_LOCAL_PUBLISHING_DELAY
-        )
-        return local_queue_state, queue
+        return igmdb_state, (LocallyQueuedUploader(up, igmdb_state, tracer) if up is not None else None)
+    elif DEMO_RENDERING_PROVIDER in ['local-rendering', 'render-farm']:
+        if DEMO_RENDERING_ORCHESTRATOR_PORT is not None:
+            # the queue itself runs in render-orchestrator.py
+            from discord_downloader.rendering_orchestrator import RemoteRenderingQueue
+            remote_queue_json_file = os.path.join(STATE_DIRECTORY, "remote-rendering-queue.json")
+            remote_queue_state = StoredState(remote_queue_json_file, RemoteRenderingQueue.get_default_state())
+            return remote_queue_state, RemoteRenderingQueue(
+                port=DEMO_RENDERING_ORCHESTRATOR_PORT,
+                token=DEMO_RENDERING_ORCHESTRATOR_TOKEN,
+                state=remote_queue_state
+            )
+        return create_local_rendering_queue(tracer)
     elif DEMO_RENDERING_PROVIDER is not None:
         raise Exception(f"Unexpected DEMO_RENDERING_PROVIDER: {DEMO_RENDERING_PROVIDER}")
 
 
+def create_local_rendering_queue(tracer: StageTracer, videos_in_use: Callable[[], Iterable[str]] = lambda: []) \
+        -> Tuple[StoredState, LocalRenderingQueue]:
+    """
+    :param videos_in_use: rendered videos needed by the consumer of the queue (e.g., the orchestrator's events waiting
+    for the bot), which must not be evicted from the video cache
+    """
+    upload_queue_json_file = os.path.join(STATE_DIRECTORY, "local-rendering-queue.json")
+    local_queue_state = StoredState(upload_queue_json_file, LocalRenderingQueue.get_default_state())
+    if DEMO_RENDERING_PROVIDER == 'local-rendering':
+        demo_renderer = OdfeDemoRenderer(
+            odfe_dir=DEMO_RENDERING_LOCAL_ODFE_DIR,
+            odfe_executable=DEMO_RENDERING_LOCAL_ODFE_EXECUTABLE,
+            config_dir=DEMO_RENDERING_LOCAL_ODFE_CONFIG,
+            demo_dir=DEMO_RENDERING_LOCAL_ODFE_DEMO,
+            video_dir=DEMO_RENDERING_LOCAL_ODFE_VIDEO,
+            defrag_config=DEMO_RENDERING_LOCAL_ODFE_CONFIG_PREFIX,
+            max_batch_size=DEMO_RENDERING_LOCAL_ODFE_BATCH_SIZE
+        )
+        # each rendering slot contributes one demo to the batch
+        render_concurrency = DEMO_RENDERING_LOCAL_ODFE_BATCH_SIZE
+    else:
+        from discord_downloader.render_farm import RenderFarmCoordinator
+        demo_renderer = RenderFarmCoordinator(
+            host=RENDER_FARM_LISTEN_HOST,
+            port=RENDER_FARM_LISTEN_PORT,
+            token=RENDER_FARM_TOKEN,
+            video_dir=DEMO_RENDERING_LOCAL_ODFE_VIDEO,
+            lease_duration=RENDER_FARM_LEASE
+        )
+        render_concurrency = RENDER_FARM_MAX_CONCURRENT_JOBS
+    if DEMO_RENDERING_VIDEO_CACHE_DIR is not None:
+        from discord_downloader.rendered_video_cache import RenderedVideoCache
+        demo_renderer = RenderedVideoCache(
+            demo_renderer=demo_renderer,
+            cache_dir=DEMO_RENDERING_VIDEO_CACHE_DIR,
+            max_size=DEMO_RENDERING_VIDEO_CACHE_MAX_SIZE,
+            render_config=odfe_render_config,
+            # e.g., waiting for the upload to YouTube or for the bot to post them to Discord
+            in_use=lambda: [*queue.videos_in_use(), *videos_in_use()]
+        )
+    queue = LocalRenderingQueue(
+        demo_renderer=demo_renderer,
+        rendered_demo_uploader=YoutubeUploader(
+            youtube_uploader_executable=DEMO_RENDERING_LOCAL_YOUTUBE_EXECUTABLE,
+            youtube_uploader_params=DEMO_RENDERING_LOCAL_YOUTUBE_PARAMS
+        ),
+        state=local_queue_state,
+        delay_before_publishing=DEMO_RENDERING_LOCAL_PUBLISHING_DELAY,
+        tracer=tracer,
+        render_concurrency=render_concurrency,
+        channel_weights=DEMO_RENDERING_CHANNEL_WEIGHTS,
+        fair_per_user=DEMO_RENDERING_FAIR_PER_USER
+    )
+    return local_queue_state, queue
+
+
+def odfe_render_config(round_id: Optional[int]) -> str:
+    return DEMO_RENDERING_LOCAL_ODFE_CONFIG_PREFIX if round_id is None else \
+        demo_rendering_local_odfe_discord_config_prefix(round_id)
+
+
+def configure_logging():
+    file_handler = FileHandler(filename=os.path.join(STATE_DIRECTORY, "errors.log"))
+    file_handler.setLevel(logging.WARNING)
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        handlers=[file_handler, logging.StreamHandler()]
+    )
+
+
+def monitor_event_loop(role: str) -> List[asyncio.Task]:
+    """
+    Starts the loop block detector and the profiling triggers. The caller cancels the tasks at the end.
+    :param role: of the process, e.g., 'bot'; names its profile trigger file and reports in STATE_DIRECTORY
+    """
+    from discord_downloader.runtime_profiler import RuntimeProfiler
+    loop = asyncio.get_running_loop()
+    profiler = RuntimeProfiler(STATE_DIRECTORY, PROFILING_DURATION, sample_interval=PROFILING_SAMPLE_INTERVAL,
+                               role=role)
+    tasks = [loop.create_task(profiler.run())]
+    if EVENT_LOOP_BLOCK_THRESHOLD is not None:
+        from discord_downloader.loop_monitor import LoopBlockDetector
+        tasks.append(loop.create_task(LoopBlockDetector(EVENT_LOOP_BLOCK_THRESHOLD).run()))
+    return tasks
+
+
 async def main():
+    # STARTUP_PROFILE=1 logs how long each phase before client.start took
+    profiler = StartupProfiler(enabled=os.environ.get('STARTUP_PROFILE') == '1', started_at=STARTUP_STARTED_AT)
+    profiler.checkpoint('imports')
     try:
-        conn = create_current_db_engine()
+        db_writer = BatchingDbWriter(create_current_db_engine(), window=DB_WRITE_BATCH_WINDOW)
+        profiler.checkpoint('db')
         with filelock.FileLock(os.path.join(STATE_DIRECTORY, "run.lock")).acquire(timeout=10):
-            file_handler = FileHandler(filename=os.path.join(STATE_DIRECTORY, "errors.log"))
-            file_handler.setLevel(logging.WARNING)
-            logging.basicConfig(
-                level=logging.INFO,
-                format="%(asctime)s [%(levelname)s] %(message)s",
-                handlers=[file_handler, logging.StreamHandler()]
-            )
+            profiler.checkpoint('lock')
+            configure_logging()
+            profiler.checkpoint('logging')
+            monitors = monitor_event_loop('bot')
             logging.getLogger().info("Connecting…")
-            state, uploader = create_uploader()
+            tracer = DbStageTracer(db_writer)
+            state, uploader = create_uploader(tracer)
+            profiler.checkpoint('uploader')
+            attachment_downloader = ResumableAttachmentDownloader(TEMP_DIRECTORY)
+            recorder = None
+            if GATEWAY_RECORDING_FILE is not None:
+                from discord_downloader.gateway_recorder import GatewayRecorder, RecordingAttachmentDownloader
+                recorder = GatewayRecorder(GATEWAY_RECORDING_FILE)
+                attachment_downloader = RecordingAttachmentDownloader(attachment_downloader, recorder)
             client = DownloaderClient(
                 uploader=uploader,
                 demo_analyzer=DemoAnalyzer(DEMOCLEANER_EXE),
                 loop=loop,
-                conn=conn
+                db_writer=db_writer,
+                tracer=tracer,
+                attachment_downloader=attachment_downloader,
+                recorder=recorder
             )
+            profiler.checkpoint('client')
+            profiler.report()
             try:
                 await client.start(DISCORD_TOKEN)
             finally:
                 await client.close()
+                await db_writer.close()
+                for monitor in monitors:
+                    monitor.cancel()
+                if recorder is not None:
+                    recorder.close()
             state.close()
             sys.exit(client.ret)
     except filelock.Timeout:
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+import argparse
+import os
+
+from discord_downloader.pack_store import PackStore
+from settings import ATTACHMENT_PACKS_DIRECTORY, ATTACHMENTS_DIRECTORY
+
+parser = argparse.ArgumentParser(description='Restores loose files from the attachment pack files.')
+parser.add_argument('--packs', default=ATTACHMENT_PACKS_DIRECTORY, help='directory with pack files')
+parser.add_argument('--output', default=ATTACHMENTS_DIRECTORY, help='where to write the loose files')
+parser.add_argument('--list', action='store_true', help='just list the packed files')
+args = parser.parse_args()
+if args.packs is None:
+    parser.error('ATTACHMENT_PACKS_DIRECTORY is not set; use --packs')
+
+store = PackStore(args.packs)
+exported = 0
+skipped = 0
+for entry in store.entries():
+    if args.list:
+        print(f"{entry.name}\t{entry.size}\tpack {entry.pack}\t{entry.sha256}")
+        continue
+    out_file = os.path.join(args.output, entry.name)
+    if os.path.exists(out_file):
+        # The loose file takes precedence, see PackingMover.
+        skipped += 1
+        continue
+    tmp_file = f"{out_file}.tmp"
+    with open(tmp_file, 'wb') as f:
+        f.write(store.read(entry))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, out_file)
+    exported += 1
+store.close()
+if not args.list:
+    print(f"Exported {exported} files, skipped {skipped} files that already exist in {args.output}")
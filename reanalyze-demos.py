@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Re-analyzes the demos in ATTACHMENTS_DIRECTORY (and in the attachment packs) and stores the results in the demo index
+(see demo-index.py). Demos already analyzed by the current analyzer version are skipped, so an interrupted run can be
+just started again. It can run alongside the bot.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+
+from discord_downloader.db import create_current_db_engine
+from discord_downloader.db_writer import BatchingDbWriter
+from discord_downloader.demo_analyzer import DemoAnalyzer
+from discord_downloader.demo_reanalysis import DemoReanalyzer, find_archived_demos
+from discord_downloader.pack_store import PackStore
+from settings import ATTACHMENTS_DIRECTORY, ATTACHMENT_PACKS_DIRECTORY, TEMP_DIRECTORY, DEMOCLEANER_EXE, \
+    DB_WRITE_BATCH_WINDOW
+
+
+async def main(args):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    pack_store = None if args.packs is None else PackStore(args.packs)
+    db_writer = BatchingDbWriter(create_current_db_engine(), window=DB_WRITE_BATCH_WINDOW)
+    try:
+        demos = find_archived_demos(args.attachments, pack_store)
+        reanalyzer = DemoReanalyzer(
+            demo_analyzer=DemoAnalyzer(DEMOCLEANER_EXE),
+            db_writer=db_writer,
+            temp_directory=TEMP_DIRECTORY,
+            pack_store=pack_store,
+            concurrency=args.jobs,
+            progress_interval=args.progress_interval,
+        )
+        progress = await reanalyzer.run(demos, force=args.force)
+    finally:
+        # commits what has been analyzed, even when interrupted
+        await db_writer.close()
+        if pack_store is not None:
+            pack_store.close()
+    sys.exit(1 if progress.failed > 0 else 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Re-analyzes the archived demos into the demo index.')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='demos analyzed at once (default: CPU cores)')
+    parser.add_argument('--force', action='store_true', help='analyze also the demos that are up to date')
+    parser.add_argument('--attachments', default=ATTACHMENTS_DIRECTORY, help='directory with the archived files')
+    parser.add_argument('--packs', default=ATTACHMENT_PACKS_DIRECTORY, help='directory with pack files')
+    parser.add_argument('--progress-interval', type=float, default=5.0, help='seconds between progress reports')
+    loop = asyncio.ProactorEventLoop() if sys.platform == 'win32' else asyncio.SelectorEventLoop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(main(parser.parse_args()))
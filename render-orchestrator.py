@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Runs the rendering queue (DEMO_RENDERING_PROVIDER 'local-rendering' or 'render-farm') for a bot configured with
+DEMO_RENDERING_ORCHESTRATOR_PORT. The bot and this process can be started, stopped and restarted independently.
+"""
+import asyncio
+import logging
+import os
+import sys
+
+import filelock
+
+from discord_downloader.db import create_current_db_engine
+from discord_downloader.db_writer import BatchingDbWriter
+from discord_downloader.persistent_state import StoredState
+from discord_downloader.rendering_orchestrator import RenderingOrchestrator
+from discord_downloader.tracing import DbStageTracer
+from download import create_local_rendering_queue, configure_logging, monitor_event_loop
+from settings import STATE_DIRECTORY, DEMO_RENDERING_ORCHESTRATOR_PORT, DEMO_RENDERING_ORCHESTRATOR_TOKEN, \
+    DB_WRITE_BATCH_WINDOW
+
+
+async def main():
+    if DEMO_RENDERING_ORCHESTRATOR_PORT is None:
+        print("DEMO_RENDERING_ORCHESTRATOR_PORT is not set", file=sys.stderr)
+        sys.exit(1)
+    db_writer = BatchingDbWriter(create_current_db_engine(), window=DB_WRITE_BATCH_WINDOW)
+    try:
+        with filelock.FileLock(os.path.join(STATE_DIRECTORY, "orchestrator.lock")).acquire(timeout=10):
+            configure_logging()
+            monitors = monitor_event_loop('render-orchestrator')
+            # the videos of the failed events stay in the video cache until the bot has handled them
+            queue_state, queue = create_local_rendering_queue(DbStageTracer(db_writer),
+                                                              videos_in_use=lambda: orchestrator.videos_in_use())
+            orchestrator_state = StoredState(os.path.join(STATE_DIRECTORY, "orchestrator-outbox.json"),
+                                             RenderingOrchestrator.get_default_state())
+            orchestrator = RenderingOrchestrator(
+                queue=queue,
+                state=orchestrator_state,
+                port=DEMO_RENDERING_ORCHESTRATOR_PORT,
+                token=DEMO_RENDERING_ORCHESTRATOR_TOKEN
+            )
+            try:
+                await orchestrator.run()
+            finally:
+                queue_state.close()
+                orchestrator_state.close()
+                await db_writer.close()
+                for monitor in monitors:
+                    monitor.cancel()
+    except filelock.Timeout:
+        logging.getLogger().error("Unable to acquire lock. It looks like the orchestrator is already running…")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    loop = asyncio.ProactorEventLoop() if sys.platform == 'win32' else asyncio.SelectorEventLoop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Renders demos for a bot running with DEMO_RENDERING_PROVIDER = 'render-farm'. Any number of workers can run on any
+number of machines; each of them renders one demo at a time with its local oDFe (DEMO_RENDERING_LOCAL_ODFE_*).
+"""
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import sys
+
+from discord_downloader.demo_uploaders import OdfeDemoRenderer
+from discord_downloader.render_farm import RenderWorker
+from settings import RENDER_FARM_URL, RENDER_FARM_TOKEN, DEMO_RENDERING_LOCAL_ODFE_DIR, \
+    DEMO_RENDERING_LOCAL_ODFE_EXECUTABLE, DEMO_RENDERING_LOCAL_ODFE_CONFIG, DEMO_RENDERING_LOCAL_ODFE_DEMO, \
+    DEMO_RENDERING_LOCAL_ODFE_VIDEO, DEMO_RENDERING_LOCAL_ODFE_CONFIG_PREFIX
+
+parser = argparse.ArgumentParser(description='Renders demos leased from the bot.')
+parser.add_argument('--url', default=RENDER_FARM_URL, help='URL of the bot')
+parser.add_argument('--token', default=RENDER_FARM_TOKEN)
+parser.add_argument('--worker-id', default=f"{socket.gethostname()}-{os.getpid()}")
+parser.add_argument('--lease-wait', type=float, default=20.0, help='how long to wait for a job in one request')
+parser.add_argument('--odfe-dir', default=DEMO_RENDERING_LOCAL_ODFE_DIR)
+parser.add_argument('--odfe-executable', default=DEMO_RENDERING_LOCAL_ODFE_EXECUTABLE)
+parser.add_argument('--config-dir', default=DEMO_RENDERING_LOCAL_ODFE_CONFIG)
+parser.add_argument('--demo-dir', default=DEMO_RENDERING_LOCAL_ODFE_DEMO)
+parser.add_argument('--video-dir', default=DEMO_RENDERING_LOCAL_ODFE_VIDEO)
+args = parser.parse_args()
+
+logging.basicConfig(level=logging.INFO, format=f"%(asctime)s [%(levelname)s] {args.worker_id}: %(message)s")
+worker = RenderWorker(
+    coordinator_url=args.url,
+    token=args.token,
+    demo_renderer=OdfeDemoRenderer(
+        odfe_dir=args.odfe_dir,
+        odfe_executable=args.odfe_executable,
+        config_dir=args.config_dir,
+        demo_dir=args.demo_dir,
+        video_dir=args.video_dir,
+        defrag_config=DEMO_RENDERING_LOCAL_ODFE_CONFIG_PREFIX
+    ),
+    worker_id=args.worker_id,
+    lease_wait=args.lease_wait
+)
+loop = asyncio.ProactorEventLoop() if sys.platform == 'win32' else asyncio.SelectorEventLoop()
+asyncio.set_event_loop(loop)
+try:
+    loop.run_until_complete(worker.run())
+except KeyboardInterrupt:
+    pass
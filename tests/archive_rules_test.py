@@ -0,0 +1,40 @@
+import unittest
+
+from discord_downloader.archive_rules import ArchiveRule, ArchiveRules
+
+
+class ArchiveRulesTestCase(unittest.TestCase):
+
+    def test_default_rule_archives_everything(self):
+        self.assertIsNone(ArchiveRule().skip_reason('screenshot.png', 10 ** 9))
+
+    def test_demo_only(self):
+        rule = ArchiveRule(demo_only=True)
+        self.assertIsNone(rule.skip_reason('run.dm_68', 1000))
+        self.assertIsNone(rule.skip_reason('RUN.DM_68', 1000))
+        self.assertEqual(rule.skip_reason('video.mp4', 1000), 'not a demo')
+
+    def test_extensions(self):
+        rule = ArchiveRule(extensions=['.dm_68', 'ZIP'])
+        self.assertIsNone(rule.skip_reason('a.zip', 1))
+        self.assertIsNone(rule.skip_reason('a.dm_68', 1))
+        self.assertEqual(rule.skip_reason('a.png', 1), "extension 'png' not allowed")
+        self.assertEqual(rule.skip_reason('noextension', 1), "extension '' not allowed")
+
+    def test_max_size(self):
+        rule = ArchiveRule(max_size=100)
+        self.assertIsNone(rule.skip_reason('a.dm_68', 100))
+        self.assertEqual(rule.skip_reason('a.dm_68', 101), 'size 101 B exceeds 100 B')
+
+    def test_rules_per_channel(self):
+        rules = ArchiveRules({
+            None: {'demo_only': True},
+            'guild--screenshots': {'extensions': ['png'], 'max_size': 1000},
+        })
+        self.assertEqual(rules.for_channel('guild--screenshots'), ArchiveRule(extensions=['png'], max_size=1000))
+        self.assertEqual(rules.for_channel('guild--other'), ArchiveRule(demo_only=True))
+        self.assertEqual(ArchiveRules({}).for_channel('guild--other'), ArchiveRule())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import asyncio
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+from aiohttp import web
+
+from discord_downloader.attachment_downloader import ResumableAttachmentDownloader, IncompleteDownloadException
+
+DATA = bytes(range(256)) * 100
+
+
+class FakeAttachment:
+
+    def __init__(self, id: int, url: str, size: int):
+        self.id = id
+        self.url = url
+        self.size = size
+
+
+class ResumableAttachmentDownloaderTestCase(unittest.TestCase):
+
+    def _run(self, prepare_partial: bytes, served: bytes = DATA, honor_range: bool = True, size: int = len(DATA)):
+        requests = []
+
+        async def handle(request: web.Request):
+            range_header = request.headers.get('Range')
+            requests.append(range_header)
+            if range_header is not None and honor_range:
+                start = int(range_header[len('bytes='):-1])
+                return web.Response(status=206, body=served[start:],
+                                    headers={'Content-Range': f'bytes {start}-{len(served) - 1}/{len(served)}'})
+            return web.Response(body=served)
+
+        async def run(tmpdir):
+            app = web.Application()
+            app.router.add_get('/attachment', handle)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, '127.0.0.1', 0)
+            await site.start()
+            port = site._server.sockets[0].getsockname()[1]
+            try:
+                attachment = FakeAttachment(1234, f"http://127.0.0.1:{port}/attachment", size)
+                return await ResumableAttachmentDownloader(tmpdir).download(attachment)
+            finally:
+                await runner.cleanup()
+
+        with TemporaryDirectory() as tmpdir:
+            if prepare_partial is not None:
+                with open(os.path.join(tmpdir, '1234.part'), 'wb') as f:
+                    f.write(prepare_partial)
+            res = asyncio.run(run(tmpdir))
+            with open(res, 'rb') as f:
+                content = f.read()
+            self.assertEqual(os.listdir(tmpdir), ['1234.part'])
+            return content, requests
+
+    def test_fresh_download(self):
+        content, requests = self._run(prepare_partial=None)
+        self.assertEqual(content, DATA)
+        self.assertEqual(requests, [None])
+
+    def test_resumed_download(self):
+        content, requests = self._run(prepare_partial=DATA[:1000])
+        self.assertEqual(content, DATA)
+        self.assertEqual(requests, ['bytes=1000-'])
+
+    def test_range_ignored_by_server(self):
+        content, requests = self._run(prepare_partial=DATA[:1000], honor_range=False)
+        self.assertEqual(content, DATA)
+
+    def test_complete_partial_file_is_not_downloaded_again(self):
+        content, requests = self._run(prepare_partial=DATA)
+        self.assertEqual(content, DATA)
+        self.assertEqual(requests, [])
+
+    def test_size_mismatch(self):
+        with self.assertRaises(IncompleteDownloadException):
+            self._run(prepare_partial=None, served=DATA[:-10])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+import os
+import unittest
+from os.path import dirname
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from alembic.config import Config
+from alembic.script import ScriptDirectory
+
+from discord_downloader import db
+
+
+class DbTestCase(unittest.TestCase):
+
+    def test_schema_head_revision_matches_migrations(self):
+        alembic_cfg = Config()
+        alembic_cfg.set_main_option('script_location', os.path.join(dirname(__file__), "..", "alembic"))
+        self.assertEqual(ScriptDirectory.from_config(alembic_cfg).get_current_head(), db.SCHEMA_HEAD_REVISION)
+
+    def test_upgrade_only_when_needed(self):
+        with TemporaryDirectory() as tmpdir, patch.object(db, 'STATE_DIRECTORY', tmpdir):
+            self.assertIsNone(db.get_current_db_revision())
+            db.create_current_db_engine()
+            self.assertEqual(db.get_current_db_revision(), db.SCHEMA_HEAD_REVISION)
+            with patch.object(db, 'upgrade_db_schema') as upgrade:
+                db.create_current_db_engine()
+                upgrade.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import asyncio
+import sqlite3
+import unittest
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+
+from discord_downloader import db
+from discord_downloader.db import RenderedDemo, DemoStageTiming
+from discord_downloader.db_writer import BatchingDbWriter
+from discord_downloader.tracing import DbStageTracer
+
+
+class BatchingDbWriterTestCase(unittest.TestCase):
+
+    def _run(self, test):
+        async def run():
+            conn = db.create_current_db_engine()
+            db_writer = BatchingDbWriter(conn)
+            try:
+                await test(db_writer)
+            finally:
+                await db_writer.close()
+
+        with TemporaryDirectory() as tmpdir, patch.object(db, 'STATE_DIRECTORY', tmpdir):
+            asyncio.run(run())
+
+    def test_wal_mode(self):
+        async def test(db_writer: BatchingDbWriter):
+            await db_writer.execute(insert(RenderedDemo).values(url='u', filename='f'))
+            connection = sqlite3.connect(db.get_db_file())
+            self.assertEqual(connection.execute("PRAGMA journal_mode").fetchone(), ('wal',))
+            connection.close()
+
+        self._run(test)
+
+    def test_concurrent_writes_are_grouped(self):
+        async def test(db_writer: BatchingDbWriter):
+            with patch.object(db_writer, '_execute_all', wraps=db_writer._execute_all) as execute_all:
+                results = await asyncio.gather(*(
+                    db_writer.execute(insert(RenderedDemo).values(url=f'u{i}', filename=f'f{i}')) for i in range(50)
+                ))
+                self.assertEqual(results, [1] * 50)
+                self.assertEqual(execute_all.call_count, 1)
+
+        self._run(test)
+
+    def test_failing_statement_fails_only_its_caller(self):
+        async def test(db_writer: BatchingDbWriter):
+            await db_writer.execute(insert(RenderedDemo).values(url='u', filename='dup'))
+            results = await asyncio.gather(
+                db_writer.execute(insert(RenderedDemo).values(url='u1', filename='a')),
+                db_writer.execute(insert(RenderedDemo).values(url='u2', filename='dup')),
+                db_writer.execute(insert(RenderedDemo).values(url='u3', filename='b')),
+                return_exceptions=True
+            )
+            self.assertEqual(results[0], 1)
+            self.assertIsInstance(results[1], IntegrityError)
+            self.assertEqual(results[2], 1)
+            async with db_writer.engine.begin() as connection:
+                rows = (await connection.execute(select(RenderedDemo.url).order_by(RenderedDemo.id))).fetchall()
+            self.assertEqual([row.url for row in rows], ['u', 'u1', 'u3'])
+
+        self._run(test)
+
+    def test_submitted_statements_keep_order(self):
+        async def test(db_writer: BatchingDbWriter):
+            tracer = DbStageTracer(db_writer)
+            await tracer.start('t', 'render')
+            await tracer.finish('t', 'render')
+            await tracer.start('t', 'render')
+            await db_writer.flush()
+            async with db_writer.engine.begin() as connection:
+                rows = (await connection.execute(
+                    select(DemoStageTiming.finished_at).order_by(DemoStageTiming.id)
+                )).fetchall()
+            self.assertIsNotNone(rows[0].finished_at)
+            self.assertIsNone(rows[1].finished_at)
+
+        self._run(test)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+
+from sqlalchemy import create_engine, select
+
+from discord_downloader.db import Base, DemoMetadata
+from discord_downloader.demo_index import parse_time, summarize, upsert_statement, search_query, DemoSummary
+
+
+def demo_info(player='Player', mapname='st1', gameplay='Promode (CPM)', best_time='00.07.440'):
+    return {
+        'player': {'uncoloredName': player},
+        'client': {'mapname': mapname},
+        'game': {'gameplay': gameplay},
+        'record': {'bestTime': best_time},
+    }
+
+
+class DemoIndexTestCase(unittest.TestCase):
+
+    def test_parse_time(self):
+        self.assertEqual(parse_time("00.123"), 123)
+        self.assertEqual(parse_time("00.07.440"), 7440)
+        self.assertEqual(parse_time("01.23.456"), 83456)
+        self.assertEqual(parse_time("1:02:03.004"), 3723004)
+        self.assertIsNone(parse_time(None))
+        self.assertIsNone(parse_time("<unknown>"))
+
+    def test_summarize(self):
+        self.assertEqual(summarize(demo_info()), DemoSummary('Player', 'st1', 'CPM', '00.07.440', 7440))
+        info = demo_info(player=None, gameplay='VQ3', best_time=None)
+        info['player']['df_name'] = 'df'
+        self.assertEqual(summarize(info), DemoSummary('df', 'st1', 'VQ3', None, None))
+
+    def test_upsert_and_search(self):
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(engine)
+        with engine.begin() as connection:
+            connection.execute(upsert_statement('a', 'a.dm_68', summarize(demo_info(best_time='00.09.000')),
+                                                'msg-a'))
+            connection.execute(upsert_statement('b', 'b.dm_68', summarize(demo_info(player='Other')), 'msg-b'))
+            connection.execute(upsert_statement('c', 'c.dm_68', summarize(demo_info(mapname='ST2'))))
+            connection.execute(upsert_statement('d', 'd.dm_68', summarize(demo_info(gameplay='VQ3', best_time=None))))
+            # re-analysis of a known demo, without the message
+            connection.execute(upsert_statement('a', 'a.1.dm_68', summarize(demo_info(best_time='00.08.000')),
+                                                analyzer_version=2))
+
+            rows = connection.execute(select(DemoMetadata).order_by(DemoMetadata.id)).fetchall()
+            self.assertEqual(len(rows), 4)
+            self.assertEqual((rows[0].filename, rows[0].message_url, rows[0].time_ms, rows[0].analyzer_version),
+                             ('a.1.dm_68', 'msg-a', 8000, 2))
+
+            def hashes(query):
+                return [row.content_hash for row in connection.execute(query)]
+
+            self.assertEqual(hashes(search_query(map='ST1')), ['b', 'a', 'd'])
+            self.assertEqual(hashes(search_query(map='st1', physics='cpm')), ['b', 'a'])
+            self.assertEqual(hashes(search_query(player='other')), ['b'])
+            self.assertEqual(hashes(search_query(min_time_ms=7441)), ['a'])
+            self.assertEqual(hashes(search_query(max_time_ms=7440, limit=1)), ['b'])
+            plan = " ".join(str(row) for row in connection.exec_driver_sql(
+                "EXPLAIN QUERY PLAN " + str(search_query(map='st1').compile(compile_kwargs={'literal_binds': True}))
+            ))
+            self.assertIn('ix_demo_metadata_map_physics_time_ms', plan)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import asyncio
+import hashlib
+import os
+import unittest
+from os import path
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from sqlalchemy import select
+
+from discord_downloader import db
+from discord_downloader.db import DemoMetadata
+from discord_downloader.db_writer import BatchingDbWriter
+from discord_downloader.demo_reanalysis import DemoReanalyzer, find_archived_demos
+from discord_downloader.pack_store import PackStore
+
+
+class FakeDemoAnalyzer:
+
+    def __init__(self):
+        self.analyzed = []
+        self.running = 0
+        self.max_running = 0
+
+    async def analyze(self, file: str):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(0.01)
+            with open(file) as f:
+                content = f.read()
+            if content == 'broken':
+                raise Exception("Cannot parse")
+            self.analyzed.append(content)
+            return {
+                'player': {'uncoloredName': content},
+                'client': {'mapname': 'st1'},
+                'game': {'gameplay': 'Promode (CPM)'},
+                'record': {'bestTime': '00.123'},
+            }
+        finally:
+            self.running -= 1
+
+
+class DemoReanalyzerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.attachments = path.join(self.tmpdir.name, 'attachments')
+        self.temp = path.join(self.tmpdir.name, 'tmp')
+        os.mkdir(self.attachments)
+        os.mkdir(self.temp)
+        self.pack_store = PackStore(path.join(self.tmpdir.name, 'packs'))
+        for i in range(10):
+            self._write(f"run-{i}.dm_68", f"demo-{i}")
+        self._write("copy.dm_68", "demo-0")
+        self._write("broken.dm_68", "broken")
+        self._write("screenshot.png", "not a demo")
+        packed = path.join(self.temp, 'packed')
+        with open(packed, 'w') as f:
+            f.write('packed')
+        self.pack_store.add('packed.dm_68', packed, hashlib.sha256(b'packed').hexdigest())
+
+    def tearDown(self):
+        self.pack_store.close()
+        self.tmpdir.cleanup()
+
+    def _write(self, name: str, content: str):
+        with open(path.join(self.attachments, name), 'w') as f:
+            f.write(content)
+
+    def _run(self, analyzer: FakeDemoAnalyzer, **kwargs):
+        async def run():
+            db_writer = BatchingDbWriter(db.create_current_db_engine())
+            try:
+                reanalyzer = DemoReanalyzer(analyzer, db_writer, self.temp, self.pack_store, concurrency=3,
+                                            **kwargs)
+                progress = await reanalyzer.run(find_archived_demos(self.attachments, self.pack_store))
+                async with db_writer.engine.connect() as connection:
+                    rows = (await connection.execute(select(DemoMetadata))).fetchall()
+                return progress, rows
+            finally:
+                await db_writer.close()
+
+        with patch.object(db, 'STATE_DIRECTORY', self.tmpdir.name):
+            return asyncio.run(run())
+
+    def test_find_archived_demos(self):
+        self._write("packed.dm_68", "exported")
+        demos = find_archived_demos(self.attachments, self.pack_store)
+        self.assertEqual(len(demos), 13)
+        self.assertIsNone([d for d in demos if d.filename.endswith('packed.dm_68')][0].pack_entry)
+
+    def test_resumable(self):
+        analyzer = FakeDemoAnalyzer()
+        progress, rows = self._run(analyzer)
+        self.assertEqual((progress.analyzed, progress.skipped, progress.failed), (11, 1, 1))
+        self.assertEqual(sorted(analyzer.analyzed), sorted([f"demo-{i}" for i in range(10)] + ['packed']))
+        self.assertEqual(analyzer.max_running, 3)
+        self.assertEqual(len(rows), 11)
+        self.assertEqual(os.listdir(self.temp), ['packed'])  # the extracted pack entry has been removed
+
+        self._write("new.dm_68", "demo-new")
+        analyzer = FakeDemoAnalyzer()
+        progress, rows = self._run(analyzer)
+        self.assertEqual(analyzer.analyzed, ['demo-new'])
+        self.assertEqual((progress.analyzed, progress.skipped, progress.failed), (1, 12, 1))
+
+        analyzer = FakeDemoAnalyzer()
+        progress, rows = self._run(analyzer, analyzer_version=2)
+        self.assertEqual(progress.analyzed, 12)
+        self.assertEqual({row.analyzer_version for row in rows}, {2})
+
+
+if __name__ == '__main__':
+    unittest.main()
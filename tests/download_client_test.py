@@ -0,0 +1,275 @@
+import asyncio
+import os
+import subprocess
+import sys
+import unittest
+import urllib.parse
+from os import path
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+import download
+from benchmarks.fake_discord import FakeChannel, FakeGuild, FakeMessage, FakeUser, FakeAttachment, ApiCalls
+from benchmarks.ingest_benchmark import CountingRenderingQueue, FakeDemoAnalyzer
+from discord_downloader import db
+from discord_downloader.attachment_downloader import SavingAttachmentDownloader
+from discord_downloader.db_writer import BatchingDbWriter
+from discord_downloader.tracing import NopStageTracer
+
+FIRST_ID = download.DEFAULT_HISTORY_START + 1000
+
+
+class DownloaderClientTestCase(unittest.TestCase):
+    """
+    DownloaderClient with the fake Discord objects of the benchmarks.
+    """
+
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        directories = {}
+        for directory in ['state', 'attachments', 'tmp']:
+            directories[directory] = path.join(self.tmpdir.name, directory)
+            os.mkdir(directories[directory])
+        self.state_directory = directories['state']
+        self.patches = [
+            patch.object(download, 'STATE_DIRECTORY', directories['state']),
+            patch.object(db, 'STATE_DIRECTORY', directories['state']),
+            patch.object(download, 'ATTACHMENTS_DIRECTORY', directories['attachments']),
+            patch.object(download, 'TEMP_DIRECTORY', directories['tmp']),
+            patch.object(download, 'CHANNELS', {'guild--watched': []}),
+        ]
+        for p in self.patches:
+            p.start()
+        self.bot = FakeUser(1, 'bot')
+        self.author = FakeUser(2, 'author')
+        guild = FakeGuild(3, 'guild')
+        self.queue = CountingRenderingQueue()
+        self.channels = {f"guild--{name}": FakeChannel(10 + i, name, guild, ApiCalls())
+                         for i, name in enumerate(['watched', 'idle', 'mentions'])}
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        self.tmpdir.cleanup()
+
+    def post(self, name: str, mentions=(), attachment: bool = False, content: str = '',
+             extension: str = 'png') -> FakeMessage:
+        channel = self.channels[name]
+        message_id = FIRST_ID + sum(len(c.messages) for c in self.channels.values())
+        attachments = [FakeAttachment(message_id, f"{message_id}.{extension}", str(message_id).encode(),
+                                      channel.api_calls)] if attachment else []
+        message = FakeMessage(message_id, channel, f"message {message_id} {content}", attachments, list(mentions),
+                              self.author)
+        channel.messages.append(message)
+        return message
+
+    def archived(self):
+        return sorted(os.listdir(download.ATTACHMENTS_DIRECTORY))
+
+    def history_pages(self):
+        """
+        Whether the history of each channel has been read.
+        """
+        return {name: channel.api_calls['channel.history_page'] > 0 for name, channel in self.channels.items()}
+
+    def set_savepoint(self, name: str, value: int):
+        with open(path.join(self.state_directory, urllib.parse.quote(name) + ".txt"), "w") as f:
+            f.write(str(value))
+
+    def read_savepoint(self, name: str):
+        with open(path.join(self.state_directory, urllib.parse.quote(name) + ".txt")) as f:
+            return int(f.read())
+
+    def run_client(self, test):
+        async def run():
+            db_writer = BatchingDbWriter(db.create_current_db_engine())
+            client = download.DownloaderClient(
+                uploader=self.queue,
+                demo_analyzer=FakeDemoAnalyzer(latency=0.01),
+                loop=asyncio.get_running_loop(),
+                db_writer=db_writer,
+                tracer=NopStageTracer(),
+                attachment_downloader=SavingAttachmentDownloader(download.TEMP_DIRECTORY)
+            )
+            client._connection.user = self.bot
+            client._channels = self.channels
+            client._reverse_channels = {channel: name for name, channel in self.channels.items()}
+            try:
+                await test(client)
+            finally:
+                await db_writer.close()
+                await client.http.close()
+
+        asyncio.run(run())
+
+    def test_unchanged_channels_are_skipped(self):
+        for name in self.channels.keys():
+            self.post(name)
+            self.set_savepoint(name, self.channels[name].last_message_id)
+        self.post('guild--watched')
+
+        async def test(client: download.DownloaderClient):
+            await client._download_news()
+
+        self.run_client(test)
+        self.assertEqual(self.history_pages(), {'guild--watched': True, 'guild--idle': False, 'guild--mentions': False})
+        # the end of the last scanned window
+        self.assertGreaterEqual(self.read_savepoint('guild--watched'), self.channels['guild--watched'].last_message_id)
+
+    def test_history_pipeline(self):
+        self.set_savepoint('guild--watched', self.post('guild--watched').id)
+        posted = [self.post('guild--watched', attachment=i % 2 == 0) for i in range(10)]
+
+        async def test(client: download.DownloaderClient):
+            await client._download_news()
+
+        with patch.object(download, 'INGEST_DOWNLOAD_CONCURRENCY', 3), patch.object(download, 'INGEST_QUEUE_SIZE', 2):
+            self.run_client(test)
+        self.assertEqual(self.archived(), sorted(f"{m.id}.png" for m in posted if len(m.attachments) > 0))
+        self.assertGreaterEqual(self.read_savepoint('guild--watched'), posted[-1].id)
+
+    def test_history_pipeline_failure(self):
+        start = self.post('guild--watched').id
+        self.set_savepoint('guild--watched', start)
+        demos = [self.post('guild--watched', attachment=True, extension='dm_68') for _ in range(8)]
+        failing = demos[3]
+
+        async def fail(emoji):
+            raise RuntimeError("Cannot react")
+
+        failing.add_reaction = fail
+
+        async def test(client: download.DownloaderClient):
+            with self.assertRaisesRegex(Exception, 'Error when addinng reaction'):
+                await client._download_news()
+
+        with patch.object(download, 'INGEST_DOWNLOAD_CONCURRENCY', 4), patch.object(download, 'INGEST_QUEUE_SIZE', 2):
+            self.run_client(test)
+        # the demos after the failed one are neither enqueued nor replied to, as they will be processed again
+        self.assertEqual(self.queue.uploads, 3)
+        self.assertEqual(self.channels['guild--watched'].api_calls['message.add_reaction'], 3)
+        self.assertLess(self.read_savepoint('guild--watched'), failing.id)
+        self.assertEqual(os.listdir(download.TEMP_DIRECTORY), [])
+
+    def test_malformed_url(self):
+        self.set_savepoint('guild--watched', self.post('guild--watched').id)
+        posted = [self.post('guild--watched', attachment=True, content='see https://example.com:abc/x'),
+                  self.post('guild--watched', attachment=True, content='http://[::1')]
+
+        async def test(client: download.DownloaderClient):
+            await client._download_news()
+
+        self.run_client(test)
+        self.assertEqual(self.archived(), sorted(f"{m.id}.png" for m in posted))
+        self.assertGreaterEqual(self.read_savepoint('guild--watched'), posted[-1].id)
+
+    def test_savepoints_are_written_without_blocking(self):
+        self.set_savepoint('guild--watched', self.post('guild--watched').id)
+        self.set_savepoint('guild--mentions', self.post('guild--mentions').id)
+        last = [self.post(name) for name in ['guild--watched', 'guild--mentions']]
+
+        async def test(client: download.DownloaderClient):
+            await client._download_news()
+
+        # Savepoint.close blocks the event loop until the file is written
+        with patch.object(download.Savepoint, 'close', side_effect=AssertionError("blocking close")):
+            self.run_client(test)
+        for name, message in zip(['guild--watched', 'guild--mentions'], last):
+            self.assertGreaterEqual(self.read_savepoint(name), message.id)
+
+    def test_rendered_demos_are_loaded_once(self):
+        async def test(client: download.DownloaderClient):
+            with patch.object(client._rendered_demos, 'load', wraps=client._rendered_demos.load) as load:
+                await client._load_rendered_demos()
+                await client._load_rendered_demos()  # e.g., on_ready after a reconnect
+            self.assertEqual(load.call_count, 1)
+
+        self.run_client(test)
+
+    def test_empty_channel_is_skipped(self):
+        async def test(client: download.DownloaderClient):
+            await client._download_news()
+
+        self.run_client(test)
+        self.assertEqual(set(self.history_pages().values()), {False})
+
+    def test_mentions_gap_check(self):
+        self.set_savepoint('guild--mentions', self.post('guild--mentions').id)
+        mention = self.post('guild--mentions', mentions=[self.bot], attachment=True)
+        self.post('guild--mentions', attachment=True)
+        last = self.post('guild--mentions')
+
+        async def test(client: download.DownloaderClient):
+            await client._download_news()
+
+        self.run_client(test)
+        self.assertEqual(self.channels['guild--mentions'].api_calls['channel.history_page'], 1)
+        self.assertEqual(self.archived(), [f"{mention.id}.png"])
+        self.assertEqual(self.read_savepoint('guild--mentions'), last.id)
+
+    def test_mentions_gap_over_limit(self):
+        self.set_savepoint('guild--mentions', self.post('guild--mentions').id)
+        older = self.post('guild--mentions', mentions=[self.bot], attachment=True)  # beyond the limit
+        self.post('guild--mentions', attachment=True)
+        newer = [self.post('guild--mentions', mentions=[self.bot], attachment=True) for _ in range(3)]
+
+        async def test(client: download.DownloaderClient):
+            await client._download_news()
+
+        with patch.object(download, 'MENTION_GAP_CHECK_LIMIT', 3):
+            self.run_client(test)
+        # the whole gap is scanned, the other messages are not archived
+        self.assertEqual(self.archived(), sorted(f"{m.id}.png" for m in [older] + newer))
+        self.assertGreaterEqual(self.read_savepoint('guild--mentions'), newer[-1].id)
+
+    def test_mentions_gap_at_limit(self):
+        self.set_savepoint('guild--mentions', self.post('guild--mentions').id)
+        mention = self.post('guild--mentions', mentions=[self.bot], attachment=True)
+        last = [self.post('guild--mentions', attachment=True) for _ in range(2)][-1]
+
+        async def test(client: download.DownloaderClient):
+            async def archive_history(*args, **kwargs):
+                self.fail("the gap fits into the limit")
+
+            client._archive_history = archive_history
+            await client._download_news()
+
+        with patch.object(download, 'MENTION_GAP_CHECK_LIMIT', 3):
+            self.run_client(test)
+        self.assertEqual(self.archived(), [f"{mention.id}.png"])
+        self.assertEqual(self.read_savepoint('guild--mentions'), last.id)
+
+    def test_mention_events(self):
+        self.set_savepoint('guild--mentions', self.post('guild--mentions').id)
+        mention = self.post('guild--mentions', mentions=[self.bot], attachment=True)
+        other = self.post('guild--mentions', attachment=True)
+
+        async def test(client: download.DownloaderClient):
+            client._prepared = True
+            await client.on_message(mention)
+            await client.on_message(other)
+            await client.on_message(mention)  # e.g., seen by the gap check, too
+
+        self.run_client(test)
+        self.assertEqual(self.channels['guild--mentions'].api_calls['channel.history_page'], 0)
+        self.assertEqual(self.archived(), [f"{mention.id}.png"])
+        self.assertEqual(self.read_savepoint('guild--mentions'), other.id)
+
+
+class DownloadImportTestCase(unittest.TestCase):
+
+    def test_optional_subsystems_are_imported_lazily(self):
+        optional = ['discord_downloader.render_farm', 'discord_downloader.rendering_orchestrator',
+                    'discord_downloader.runtime_profiler', 'discord_downloader.pack_store',
+                    'discord_downloader.url_archive', 'discord_downloader.gateway_recorder',
+                    'discord_downloader.rendered_video_cache', 'discord_downloader.loop_monitor', 'aiohttp.web']
+        # a fresh interpreter, the other tests have imported them already
+        imported = subprocess.run(
+            [sys.executable, '-c', f"import sys, download; print([m for m in {optional!r} if m in sys.modules])"],
+            cwd=path.dirname(path.dirname(path.abspath(__file__))), capture_output=True, text=True, check=True
+        ).stdout.strip()
+        self.assertEqual(imported, '[]')
+
+
+if __name__ == '__main__':
+    unittest.main()
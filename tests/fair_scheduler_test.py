@@ -0,0 +1,89 @@
+import datetime
+import json
+import unittest
+from collections import Counter
+from os import path
+from tempfile import TemporaryDirectory
+
+from discord_downloader.additional_data import AdditionalData
+from discord_downloader.fair_scheduler import FairScheduler
+from discord_downloader.local_rendering_queue import LocalRenderingQueue
+from discord_downloader.persistent_state import StoredState
+
+
+def pick_all(scheduler: FairScheduler, items, count: int, flow_of=lambda item: (item[0], None)):
+    picked = []
+    for _ in range(count):
+        item = scheduler.pick(items, flow_of)
+        items.remove(item)
+        picked.append(item)
+    return picked
+
+
+class FairSchedulerTestCase(unittest.TestCase):
+
+    def test_flood_does_not_delay_other_channels(self):
+        scheduler = FairScheduler(FairScheduler.default_state())
+        items = [('flood', i) for i in range(200)]
+        picked = pick_all(scheduler, items, 5)
+        items.append(('small', 0))
+        picked += pick_all(scheduler, items, 2)
+        self.assertIn(('small', 0), picked[5:])
+        self.assertEqual([item for item in picked if item[0] == 'flood'], [('flood', i) for i in range(6)])
+
+    def test_weights(self):
+        scheduler = FairScheduler(FairScheduler.default_state())
+        scheduler.set_weights({'a': 2.0})
+        items = [('a', i) for i in range(100)] + [('b', i) for i in range(100)]
+        picked = Counter(channel for channel, _ in pick_all(scheduler, items, 30))
+        self.assertEqual(picked, {'a': 20, 'b': 10})
+        with self.assertRaises(ValueError):
+            scheduler.set_weights({'a': 0})
+
+    def test_idle_channel_gets_no_credit(self):
+        scheduler = FairScheduler(FairScheduler.default_state())
+        items = [('a', i) for i in range(100)]
+        pick_all(scheduler, items, 10)
+        items += [('b', i) for i in range(100)]
+        picked = [channel for channel, _ in pick_all(scheduler, items, 10)]
+        self.assertEqual(Counter(picked), {'a': 5, 'b': 5})
+
+    def test_per_user(self):
+        scheduler = FairScheduler(FairScheduler.default_state())
+        items = [('a', 'flooder', i) for i in range(50)] + [('a', 'other', 0), ('b', None, 0)]
+        picked = pick_all(scheduler, items, 3, flow_of=lambda item: (item[0], item[1]))
+        self.assertEqual(set(picked), {('a', 'flooder', 0), ('a', 'other', 0), ('b', None, 0)})
+
+
+class LocalRenderingQueueFairnessTestCase(unittest.TestCase):
+
+    def test_state_of_older_version(self):
+        def item(channel: str, author_id: int, i: int):
+            data = AdditionalData(in_channel=channel, message_id=i, title=None, description=None,
+                                  rerendering_round=None, url=f"https://example.com/{i}.dm_68", has_unknown=False,
+                                  filename=f"{i}.dm_68", author_id=author_id)
+            return [data.url, 'title', 'description', data.serialize()]
+
+        with TemporaryDirectory() as tmpdir:
+            state_file = path.join(tmpdir, 'local-rendering-queue.json')
+            rendering_queue = [item('g--flood', 1, i) for i in range(10)] + [item('g--small', 2, 10)] + \
+                              [['https://example.com/legacy.dm_68', 'title', 'description', ['g--flood', 11]]]
+            with open(state_file, 'w') as f:
+                json.dump({'rendering_queue': rendering_queue, 'upload_queue': [], 'waiting_queue': []}, f)
+
+            state = StoredState(state_file, LocalRenderingQueue.get_default_state())
+            queue = LocalRenderingQueue(None, None, state, datetime.timedelta(0), channel_weights={'g--small': 2.0})
+            first = queue._next_rendering_item()
+            queue._rendering_in_progress.append(first)
+            second = queue._next_rendering_item()
+            self.assertEqual([first[0], second[0]], ['https://example.com/0.dm_68', 'https://example.com/10.dm_68'])
+            state.close()
+
+            state = StoredState(state_file, LocalRenderingQueue.get_default_state())
+            self.assertEqual(state.value['fair_queue']['weights'], {'g--small': 2.0})
+            LocalRenderingQueue(None, None, state, datetime.timedelta(0))
+            self.assertEqual(state.value['fair_queue']['weights'], {'g--small': 2.0})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import asyncio
+import unittest
+from os import path
+from tempfile import TemporaryDirectory
+
+from benchmarks.fake_discord import FakeChannel, FakeGuild, FakeMessage, FakeAttachment, FakeUser
+from benchmarks.gateway_replay import Replay
+from discord_downloader.gateway_recorder import GatewayRecorder, read_recording
+from discord_downloader.io_executor import IoExecutor
+
+
+class GatewayRecorderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.filename = path.join(self.tmpdir.name, 'recording.jsonl')
+        self.executor = IoExecutor(lanes=1, max_workers=1)
+        self.author = FakeUser(3, 'author')
+        self.bot = FakeUser(4, 'bot')
+        self.channel = FakeChannel(2, 'demos', FakeGuild(1, 'guild'))
+        self.demo = FakeAttachment(10, 'run.dm_68', b'demo', self.channel.api_calls)
+        for i, attachments in [(100, [self.demo]), (101, [])]:
+            self.channel.messages.append(FakeMessage(i, self.channel, f"message {i}", attachments, [], self.author))
+        self.live = FakeMessage(102, self.channel, "live", [], [self.bot], self.author)
+
+    def tearDown(self):
+        self.executor.shutdown()
+        self.tmpdir.cleanup()
+
+    def record(self):
+        recorder = GatewayRecorder(self.filename, self.executor)
+        recorder.record_channels({'guild--demos': self.channel}, ['guild--demos'], self.bot)
+
+        async def read_history():
+            return [m async for m in recorder.wrap_channel(self.channel).history(limit=100, oldest_first=True)]
+
+        history = asyncio.run(read_history())
+        recorder.record_attachment(self.demo, b'demo')
+        recorder.record_attachment(self.demo, b'demo')
+        recorder.record_on_message(self.live)
+        recorder.record_on_message(self.live)
+        recorder.close()
+        return history
+
+    def test_recording(self):
+        history = self.record()
+        self.assertEqual([100, 101], [m.id for m in history])
+        records = list(read_recording(self.filename))
+        self.assertEqual(['channels', 'message', 'message', 'history', 'attachment', 'message', 'on_message',
+                          'on_message'], [r['kind'] for r in records])
+        self.assertEqual(sorted(r['t'] for r in records), [r['t'] for r in records])
+        self.assertEqual({'id': 2, 'name': 'demos', 'guild_id': 1, 'guild': 'guild', 'check_all': True},
+                         records[0]['channels'][0])
+        self.assertEqual([100, 101], records[3]['message_ids'])
+        self.assertEqual('ZGVtbw==', records[4]['data'])
+        self.assertEqual({'id': 10, 'filename': 'run.dm_68', 'size': 4, 'url': self.demo.url},
+                         records[1]['message']['attachments'][0])
+        self.assertEqual([{'id': 4, 'name': 'bot'}], records[5]['message']['mentions'])
+
+    def test_replay(self):
+        self.record()
+        replay = Replay(self.filename)
+        self.assertEqual({'guild--demos'}, replay.check_all_names)
+        self.assertEqual(4, replay.bot_user.id)
+        channel = replay.channels_by_name['guild--demos']
+        self.assertEqual([100, 101], [m.id for m in replay.backlog])
+        self.assertEqual([100, 101], [m.id for m in channel.messages])
+        self.assertEqual([102], [m.id for _, m in replay.events])
+        attachment = replay.backlog[0].attachments[0]
+
+        async def fetch():
+            return await attachment.read()
+
+        self.assertEqual(b'demo', asyncio.run(fetch()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import asyncio
+import unittest
+
+from discord_downloader.ingest_pipeline import OrderedPipeline, PipelineStage
+
+
+class ConcurrencyCounter:
+
+    def __init__(self):
+        self.running = 0
+        self.max_running = 0
+
+    async def process(self, item, delay: float):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            self.running -= 1
+        return item
+
+
+class OrderedPipelineTestCase(unittest.TestCase):
+
+    def test_order_and_concurrency(self):
+        download = ConcurrencyCounter()
+        analyze = ConcurrencyCounter()
+        committed = []
+
+        async def run():
+            async def items():
+                for i in range(20):
+                    yield i
+
+            async def commit(item):
+                committed.append(item)
+
+            pipeline = OrderedPipeline([
+                # later items are faster, so they would overtake the earlier ones
+                PipelineStage('download', lambda i: download.process(i, 0.001 * (20 - i)), 4),
+                PipelineStage('analyze', lambda i: analyze.process(i, 0.005), 2),
+            ], queue_size=3)
+            await pipeline.run(items(), commit)
+
+        asyncio.run(run())
+        self.assertEqual(committed, list(range(20)))
+        self.assertEqual(download.max_running, 4)
+        self.assertEqual(analyze.max_running, 2)
+
+    def test_backpressure(self):
+        read = []
+
+        async def run():
+            async def items():
+                for i in range(100):
+                    read.append(i)
+                    yield i
+
+            pipeline = OrderedPipeline([PipelineStage('stalled', lambda item: asyncio.sleep(10), 2)], queue_size=3)
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(pipeline.run(items(), lambda item: asyncio.sleep(0)), 0.05)
+
+        asyncio.run(run())
+        # the source is not read beyond the queues of the stalled stage
+        self.assertLess(len(read), 15)
+
+    def test_stage_failure(self):
+        committed = []
+        submitted = []
+        discarded = []
+
+        async def run():
+            async def items():
+                for i in range(20):
+                    yield i
+
+            async def download(item):
+                await asyncio.sleep(0.001 * (item % 3))
+                return item
+
+            async def discard(item):
+                discarded.append(item)
+
+            async def submit(item):
+                if item == 5:
+                    raise ValueError("broken")
+                submitted.append(item)
+                return item
+
+            async def commit(item):
+                committed.append(item)
+
+            await OrderedPipeline([
+                PipelineStage('download', download, 3, discard=discard),
+                PipelineStage('submit', submit, 1),
+            ], queue_size=2).run(items(), commit)
+
+        with self.assertRaises(ValueError):
+            asyncio.run(run())
+        self.assertEqual(committed, [0, 1, 2, 3, 4])
+        self.assertEqual(submitted, [0, 1, 2, 3, 4])
+        # all the downloads after the failed item are discarded
+        self.assertGreater(len(discarded), 0)
+        self.assertEqual(sorted(discarded), list(range(6, 6 + len(discarded))))
+
+    def test_source_failure(self):
+        committed = []
+
+        async def run():
+            async def items():
+                for i in range(3):
+                    yield i
+                raise ValueError("no access")
+
+            async def process(item):
+                await asyncio.sleep(0.01)
+                return item
+
+            async def commit(item):
+                committed.append(item)
+
+            await OrderedPipeline([PipelineStage('process', process, 3)], queue_size=2).run(items(), commit)
+
+        with self.assertRaises(ValueError):
+            asyncio.run(run())
+        self.assertEqual(committed, [0, 1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import asyncio
+import json
+import threading
+import time
+import unittest
+from datetime import timedelta
+from os import path
+from tempfile import TemporaryDirectory
+
+from discord_downloader.io_executor import IoExecutor
+from discord_downloader.loop_monitor import LoopBlockDetector
+from discord_downloader.persistent_state import StoredState
+
+
+class IoExecutorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = IoExecutor(lanes=2, max_workers=4)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_same_key_in_order(self):
+        log = []
+
+        def append(i):
+            time.sleep(0.01 if i % 2 == 0 else 0)
+            log.append(i)
+
+        async def run():
+            await asyncio.gather(*(self.executor.run(append, i, key='state.json') for i in range(10)))
+
+        asyncio.run(run())
+        self.assertEqual(list(range(10)), log)
+
+    def test_runs_off_the_loop(self):
+        async def run():
+            loop_thread = threading.get_ident()
+            thread = await self.executor.run(threading.get_ident)
+            self.assertNotEqual(loop_thread, thread)
+
+        asyncio.run(run())
+
+    def test_stored_state_writes_are_ordered(self):
+        with TemporaryDirectory() as tmpdir:
+            filename = path.join(tmpdir, 'state.json')
+            state = StoredState(filename, {'counter': 0}, io_executor=self.executor)
+
+            async def run():
+                flushes = []
+                for i in range(1, 20):
+                    state.value['counter'] = i
+                    flushes.append(asyncio.get_running_loop().create_task(state.flush()))
+                await asyncio.gather(*flushes)
+
+            asyncio.run(run())
+            with open(filename) as f:
+                self.assertEqual({'counter': 19}, json.load(f))
+            state.value['counter'] = 20
+            state.close()
+            self.assertEqual({'counter': 20}, StoredState(filename, None).value)
+
+
+class LoopBlockDetectorTestCase(unittest.TestCase):
+
+    def test_logs_blocking_call(self):
+        def block_the_loop():
+            time.sleep(0.3)
+
+        async def run():
+            detector = asyncio.get_running_loop().create_task(
+                LoopBlockDetector(timedelta(milliseconds=100), check_interval=0.02).run()
+            )
+            await asyncio.sleep(0.05)
+            block_the_loop()
+            await asyncio.sleep(0.05)
+            detector.cancel()
+            await asyncio.gather(detector, return_exceptions=True)
+
+        with self.assertLogs('LoopBlockDetector', level='WARNING') as logs:
+            asyncio.run(run())
+        [message] = logs.output
+        self.assertIn('blocked for', message)
+        self.assertIn('block_the_loop', message)
+
+
+if __name__ == '__main__':
+    unittest.main()
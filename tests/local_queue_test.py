@@ -1,26 +1,18 @@
 import asyncio
-import itertools
 import os
 import tempfile
 import unittest
 from typing import Optional
-from unittest.mock import MagicMock, call
+from unittest.mock import AsyncMock, call
 
 from discord_downloader.demo_uploaders import NopUploader, UploadResult, DemoUploader, QueueFullException
 from discord_downloader.local_queue import LocallyQueuedUploader
 from discord_downloader.persistent_state import StoredState
 
 
-async def async_result(result):
-    return result
-
-
 def sync(coro):
-    return asyncio.get_event_loop().run_until_complete(coro)
-
-
-def raise_it(e):
-    raise e
+    # asyncio.run doesn't depend on a current event loop, which other tests may have closed
+    return asyncio.run(coro)
 
 
 class LocallyQueuedUploaderTestCase(unittest.TestCase):
@@ -71,8 +63,8 @@ class LocallyQueuedUploaderTestCase(unittest.TestCase):
 
     def upload_single(self, id=42863, url='a', resolution=1, title='asdfsd', description='sdfdsf', queue_full=False,
                       queue_already_full=False):
-        self.fake_uploader.upload = (MagicMock(side_effect=self.raise_queue_full) if queue_full else
-                                     MagicMock(return_value=async_result(UploadResult(True, id))))
+        self.fake_uploader.upload = (AsyncMock(side_effect=self.raise_queue_full) if queue_full else
+                                     AsyncMock(return_value=UploadResult(True, id)))
 
         sync(self.lqu.upload(url, resolution, title, description))
 
@@ -84,17 +76,17 @@ class LocallyQueuedUploaderTestCase(unittest.TestCase):
             )
 
     def check_single_unfinished_upload(self):
-        self.fake_uploader.check_status = MagicMock(return_value=async_result(None))
+        self.fake_uploader.check_status = AsyncMock(return_value=None)
         self.assertEqual(self.check_for_done(), [])
         self.fake_uploader.check_status.assert_called_once_with(42863)
 
     def check_no_finished_upload(self):
-        self.fake_uploader.check_status = MagicMock(return_value=async_result(None))
+        self.fake_uploader.check_status = AsyncMock(return_value=None)
         self.assertEqual(self.check_for_done(), [])
         self.fake_uploader.check_status.assert_not_called()
 
     def check_single_finished_upload(self):
-        self.fake_uploader.check_status = MagicMock(return_value=async_result('https://www.example.com/uploaded_video'))
+        self.fake_uploader.check_status = AsyncMock(return_value='https://www.example.com/uploaded_video')
         self.assertEqual(self.check_for_done(), [('ok', 'https://www.example.com/uploaded_video', None)])
         self.fake_uploader.check_status.assert_called_once_with(42863)
 
@@ -102,7 +94,7 @@ class LocallyQueuedUploaderTestCase(unittest.TestCase):
         raise Exception('Foo error')
 
     def check_single_failed_upload(self):
-        self.fake_uploader.check_status = MagicMock(side_effect=self.throw_check_status_error)
+        self.fake_uploader.check_status = AsyncMock(side_effect=self.throw_check_status_error)
         self.assertEqual(str(self.check_for_done()), str([('error', 42863, Exception('Foo error'))]))
         self.fake_uploader.check_status.assert_called_once_with(42863)
 
@@ -117,9 +109,8 @@ class LocallyQueuedUploaderTestCase(unittest.TestCase):
         self.upload_single(id=8, queue_already_full=True, url='alpha')
         self.upload_single(id=8, queue_already_full=True, url='beta')
 
-        self.fake_uploader.upload = MagicMock(side_effect=itertools.chain(map(lambda id: async_result(UploadResult(True, id)), [
-            5, 6
-        ]), map(raise_it, [QueueFullException()])))
+        self.fake_uploader.upload = AsyncMock(side_effect=[UploadResult(True, 5), UploadResult(True, 6),
+                                                           QueueFullException()])
         sync(self.lqu.retry_uploads())
         self.assertEqual(self.fake_uploader.upload.call_count, 3)  # Including QueueFullException
         self.fake_uploader.upload.assert_has_calls([
@@ -128,9 +119,7 @@ class LocallyQueuedUploaderTestCase(unittest.TestCase):
             call(url='z', resolution=1, title='asdfsd', description='sdfdsf'),
         ])
 
-        self.fake_uploader.upload = MagicMock(side_effect=itertools.chain(map(lambda id: async_result(UploadResult(True, id)), [
-            7
-        ]), map(raise_it, [QueueFullException()])))
+        self.fake_uploader.upload = AsyncMock(side_effect=[UploadResult(True, 7), QueueFullException()])
         sync(self.lqu.retry_uploads())
         self.assertEqual(self.fake_uploader.upload.call_count, 2)  # Including QueueFullException
         self.fake_uploader.upload.assert_has_calls([
@@ -158,9 +147,8 @@ class LocallyQueuedUploaderTestCase(unittest.TestCase):
         self.upload_single(id=8, queue_already_full=True, url='beta')
         self.simulate_restart()
 
-        self.fake_uploader.upload = MagicMock(side_effect=itertools.chain(map(lambda id: async_result(UploadResult(True, id)), [
-            5, 6
-        ]), map(raise_it, [QueueFullException()])))
+        self.fake_uploader.upload = AsyncMock(side_effect=[UploadResult(True, 5), UploadResult(True, 6),
+                                                           QueueFullException()])
         sync(self.lqu.retry_uploads())
         self.assertEqual(self.fake_uploader.upload.call_count, 3)  # Including QueueFullException
         self.fake_uploader.upload.assert_has_calls([
@@ -170,9 +158,7 @@ class LocallyQueuedUploaderTestCase(unittest.TestCase):
         ])
         self.simulate_restart()
 
-        self.fake_uploader.upload = MagicMock(side_effect=itertools.chain(map(lambda id: async_result(UploadResult(True, id)), [
-            7
-        ]), map(raise_it, [QueueFullException()])))
+        self.fake_uploader.upload = AsyncMock(side_effect=[UploadResult(True, 7), QueueFullException()])
         sync(self.lqu.retry_uploads())
         self.assertEqual(self.fake_uploader.upload.call_count, 2)  # Including QueueFullException
         self.fake_uploader.upload.assert_has_calls([
@@ -0,0 +1,113 @@
+import asyncio
+import datetime
+import unittest
+from os import path
+from tempfile import TemporaryDirectory
+from typing import Optional
+from unittest.mock import patch
+
+from discord_downloader import local_rendering_queue
+from discord_downloader.additional_data import AdditionalData
+from discord_downloader.demo_uploaders import DemoRenderer
+from discord_downloader.local_rendering_queue import LocalRenderingQueue
+from discord_downloader.persistent_state import StoredState
+from discord_downloader.tracing import StageTracer, STAGE_ENQUEUE, STAGE_RENDER
+
+
+class RecordingTracer(StageTracer):
+
+    def __init__(self):
+        self.events = []
+
+    async def start(self, trace_id: Optional[str], stage: str) -> None:
+        self.events.append(('start', trace_id, stage))
+
+    async def finish(self, trace_id: Optional[str], stage: str) -> None:
+        self.events.append(('finish', trace_id, stage))
+
+
+class FakeResponse:
+
+    async def read(self):
+        return b'demo'
+
+
+class FakeSession:
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def get(self, url: str):
+        return FakeResponse()
+
+
+class FakeRenderer(DemoRenderer):
+
+    async def render(self, demo_filename: str, demo_data: bytes, round_id: Optional[int]) -> str:
+        return f"{demo_filename}.mp4"
+
+
+class LocalRenderingQueueTracingTestCase(unittest.TestCase):
+
+    def test_rerendering_round_does_not_finish_enqueue(self):
+        def item(i: int, rerendering_round: Optional[int]):
+            data = AdditionalData(in_channel='g--c', message_id=i, title=None, description=None,
+                                  rerendering_round=rerendering_round, url=f"https://example.com/{i}.dm_68",
+                                  has_unknown=False, filename=f"{i}.dm_68", trace_id=f"trace{i}")
+            return [data.url, 'title', 'description', data.serialize()]
+
+        async def fail_callback(url, e, additional_data):
+            pass
+
+        async def run(state: StoredState, tracer: RecordingTracer):
+            queue = LocalRenderingQueue(FakeRenderer(), None, state, datetime.timedelta(0), tracer=tracer)
+            queue.add_fail_callback(fail_callback)
+            for i, rerendering_round in enumerate([None, 0]):
+                await queue.upload(f"https://example.com/{i}.dm_68", 28, 'title', 'description',
+                                   item(i, rerendering_round)[3])
+            for queued in list(queue._rendering_queue):
+                await queue._render_item(queued)
+
+        with TemporaryDirectory() as tmpdir, patch.object(local_rendering_queue, 'ClientSession', FakeSession):
+            state = StoredState(path.join(tmpdir, 'local-rendering-queue.json'), LocalRenderingQueue.get_default_state())
+            tracer = RecordingTracer()
+            asyncio.run(run(state, tracer))
+            state.close()
+        self.assertEqual(tracer.events, [
+            ('finish', 'trace0', STAGE_ENQUEUE), ('start', 'trace0', STAGE_RENDER), ('finish', 'trace0', STAGE_RENDER),
+            ('start', 'trace1', STAGE_RENDER), ('finish', 'trace1', STAGE_RENDER),
+        ])
+
+
+class LocalRenderingQueueVideosInUseTestCase(unittest.TestCase):
+
+    def test_reported_video_is_in_use_until_the_callback_is_done(self):
+        in_callback = []
+
+        async def run(state: StoredState):
+            queue = LocalRenderingQueue(FakeRenderer(), None, state, datetime.timedelta(0))
+
+            async def fail_callback(url, e, additional_data):
+                in_callback.append(queue.videos_in_use())
+
+            queue.add_fail_callback(fail_callback)
+            data = AdditionalData(in_channel='g--c', message_id=1, title=None, description=None, rerendering_round=0,
+                                  url="https://example.com/1.dm_68", has_unknown=False, filename="1.dm_68")
+            await queue.upload(data.url, 28, 'title', 'description', data.serialize())
+            await queue._render_item(queue._rendering_queue[0])
+            return queue.videos_in_use()
+
+        with TemporaryDirectory() as tmpdir, patch.object(local_rendering_queue, 'ClientSession', FakeSession):
+            state = StoredState(path.join(tmpdir, 'local-rendering-queue.json'), LocalRenderingQueue.get_default_state())
+            in_use_after = asyncio.run(run(state))
+            state.close()
+        # a re-render round is passed to the fail callback as VideoUploadException
+        self.assertEqual(in_callback, [['https://example.com/1.dm_68.mp4']])
+        self.assertEqual(in_use_after, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
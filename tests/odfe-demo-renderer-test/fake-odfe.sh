@@ -14,6 +14,31 @@ if [ "$1" != "+exec" ]; then
   exit 1
 fi
 
+# optional knobs for benchmarks: startup latency and latency per demo in seconds, failure rate in percent
+sleep "${FAKE_ODFE_LATENCY:-0}"
+if [ "$((RANDOM % 100))" -lt "${FAKE_ODFE_FAILURE_PERCENT:-0}" ]; then
+  echo "simulated failure"
+  exit 2
+fi
+if [ -n "${FAKE_ODFE_LAUNCH_LOG:-}" ]; then
+  echo "$2" >> "$FAKE_ODFE_LAUNCH_LOG"
+fi
+
 dn=$(dirname "$(realpath "$0")")/..
-cat $dn/config/$2
-touch $dn/video/$(basename $2 .cfg | sed 's/^file-//').mp4
+# plays the demos chained by 'set nextdemo "exec ..."'; a demo containing just "broken" produces no video, a demo
+# containing just "crash" crashes the engine
+cfg=$2
+while [ -n "$cfg" ]; do
+  cat "$dn/config/$cfg"
+  sleep "${FAKE_ODFE_DEMO_LATENCY:-0}"
+  demo=$(sed -n 's/^demo "\(.*\)"$/\1/p' "$dn/config/$cfg")
+  video=$(sed -n 's/^video-pipe "\(.*\)"$/\1/p' "$dn/config/$cfg")
+  if grep -qx crash "$dn/demo/$demo"; then
+    echo "simulated crash"
+    exit 3
+  fi
+  if ! grep -qx broken "$dn/demo/$demo"; then
+    touch "$dn/video/$video"
+  fi
+  cfg=$(sed -n 's/^set nextdemo "exec \(.*\)"$/\1/p' "$dn/config/$cfg")
+done
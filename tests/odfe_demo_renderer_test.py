@@ -1,3 +1,4 @@
+import asyncio
 import os
 import shutil
 import unittest
@@ -5,6 +6,7 @@ from asyncio import run
 from os import path, mkdir
 from os.path import dirname
 from tempfile import TemporaryDirectory
+from unittest import mock
 
 from discord_downloader.demo_uploaders import OdfeDemoRenderer
 
@@ -31,8 +33,112 @@ class OdfeDemoRendererTestCase(unittest.TestCase):
                 video_dir=video_dir,
                 defrag_config="// prefix"
             )
-            res = run(renderer.render('sdf.dm_62', b''))
+            res = run(renderer.render('sdf.dm_62', b'', None))
             os.remove(fake_odfe_file)
             os.remove(res)
             for dir in tmpdirs:
                 self.assertEqual(os.listdir(dir), [])
+
+
+    def test_start_removes_orphans(self):
+        with TemporaryDirectory() as tmpdir:
+            config_dir = path.join(tmpdir, 'config')
+            demo_dir = path.join(tmpdir, 'demo')
+            for dir in [config_dir, demo_dir]:
+                mkdir(dir)
+
+            def renderer():
+                return OdfeDemoRenderer(odfe_dir=tmpdir, odfe_executable='odfe', config_dir=config_dir,
+                                        demo_dir=demo_dir, video_dir=tmpdir, defrag_config="// prefix")
+
+            # another worker sharing the directories, in the middle of a render
+            sibling = renderer()
+            run(sibling.start())
+            job = sibling._prepare_job('in-flight.dm_68', b'', None)
+            in_flight = [path.join(demo_dir, job.demo_basename), path.join(config_dir, job.cfg_basename)]
+            open(in_flight[1], 'w').close()
+            # a crashed worker
+            dead = 'a' * 12
+            orphans = [path.join(demo_dir, f'{dead}-1700000000.123-{"0" * 32}.dm_68'),
+                       path.join(config_dir, f'file-{dead}-1700000000.123-{"0" * 32}.cfg'),
+                       path.join(demo_dir, f'odfe-{dead}.lock')]
+            others = [path.join(demo_dir, 'user-demo.dm_68'), path.join(config_dir, 'autoexec.cfg')]
+            for file in orphans + others:
+                open(file, 'w').close()
+
+            restarted = renderer()
+            run(restarted.start())
+            self.assertEqual([path.exists(file) for file in orphans], [False, False, False])
+            self.assertEqual([path.exists(file) for file in in_flight + others], [True, True, True, True])
+            run(restarted.close())
+            run(sibling.close())
+
+
+class OdfeDemoRendererBatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._tmpdir = TemporaryDirectory()
+        tmpdir = self._tmpdir.name
+        for directory in ['config', 'demo', 'video', 'executable']:
+            mkdir(path.join(tmpdir, directory))
+        self._fake_odfe = path.join(tmpdir, 'executable', 'fake-odfe.sh')
+        shutil.copy(path.join(dirname(__file__), 'odfe-demo-renderer-test', 'fake-odfe.sh'), self._fake_odfe)
+        self._launch_log = path.join(tmpdir, 'launches.log')
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def _render_all(self, demos):
+        tmpdir = self._tmpdir.name
+        renderer = OdfeDemoRenderer(
+            odfe_dir=tmpdir,
+            odfe_executable=self._fake_odfe,
+            config_dir=path.join(tmpdir, 'config'),
+            demo_dir=path.join(tmpdir, 'demo'),
+            video_dir=path.join(tmpdir, 'video'),
+            defrag_config="// prefix",
+            max_batch_size=4,
+            batch_window=0.05
+        )
+
+        async def render_all():
+            try:
+                return await asyncio.gather(*(renderer.render(f'{i}.dm_68', data, None)
+                                              for i, data in enumerate(demos)), return_exceptions=True)
+            finally:
+                await renderer.close()
+
+        with mock.patch.dict(os.environ, {'FAKE_ODFE_LAUNCH_LOG': self._launch_log}):
+            return run(render_all())
+
+    def _launches(self) -> int:
+        with open(self._launch_log) as f:
+            return len(f.readlines())
+
+    def test_one_launch_per_batch(self):
+        results = self._render_all([b''] * 6)
+        for result in results:
+            self.assertTrue(path.exists(result))
+        self.assertEqual(6, len(set(results)))
+        self.assertEqual(2, self._launches())
+        self.assertEqual([], os.listdir(path.join(self._tmpdir.name, 'config')))
+        self.assertEqual([], os.listdir(path.join(self._tmpdir.name, 'demo')))
+
+    def test_failing_demo(self):
+        [ok1, broken, ok2] = self._render_all([b'', b'broken\n', b''])
+        self.assertTrue(path.exists(ok1))
+        self.assertIsInstance(broken, Exception)
+        self.assertTrue(path.exists(ok2))
+        self.assertEqual(1, self._launches())
+
+    def test_crashing_demo(self):
+        [ok1, crash, ok2] = self._render_all([b'', b'crash\n', b''])
+        self.assertTrue(path.exists(ok1))
+        self.assertIsInstance(crash, Exception)
+        self.assertTrue(path.exists(ok2))
+        # the batch and then each of the demos alone
+        self.assertEqual(4, self._launches())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import os
+import unittest
+from os import path
+from tempfile import TemporaryDirectory
+
+from discord_downloader.pack_store import PackStore, PackingMover
+
+
+class PackingMoverTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmpdir = TemporaryDirectory()
+        self.attachments = path.join(self.tmpdir.name, 'attachments')
+        self.temp = path.join(self.tmpdir.name, 'tmp')
+        os.mkdir(self.attachments)
+        os.mkdir(self.temp)
+        self.store = PackStore(path.join(self.tmpdir.name, 'packs'), max_pack_size=300)
+        self.mover = PackingMover(self.store, self.temp, max_file_size=1000)
+
+    def tearDown(self) -> None:
+        self.store.close()
+        self.tmpdir.cleanup()
+
+    def _move(self, name: str, content: bytes):
+        src = path.join(self.temp, 'download')
+        with open(src, 'wb') as f:
+            f.write(content)
+        res = self.mover.move(src, path.join(self.attachments, name))
+        self.assertFalse(path.exists(src))
+        return res
+
+    def _read(self, stored_file: str) -> bytes:
+        with self.mover.local_file(stored_file) as local_file:
+            with open(local_file, 'rb') as f:
+                return f.read()
+
+    def test_small_demos_are_packed(self):
+        stored, is_new = self._move('a.dm_68', b'demo' * 50)
+        self.assertEqual((stored, is_new), (path.join(self.attachments, 'a.dm_68'), True))
+        self.assertEqual(os.listdir(self.attachments), [])
+        self.assertEqual(self._read(stored), b'demo' * 50)
+        self.assertEqual(os.listdir(self.temp), [])
+
+    def test_other_files_stay_loose(self):
+        stored, is_new = self._move('a.png', b'png')
+        self.assertTrue(is_new)
+        self.assertEqual(os.listdir(self.attachments), ['a.png'])
+        stored, is_new = self._move('big.dm_68', b'x' * 1001)
+        self.assertTrue(path.exists(stored))
+
+    def test_deduplication(self):
+        self.assertEqual(self._move('a.dm_68', b'first'), (path.join(self.attachments, 'a.dm_68'), True))
+        self.assertEqual(self._move('a.dm_68', b'first'), (path.join(self.attachments, 'a.dm_68'), False))
+        self.assertEqual(self._move('a.dm_68', b'second'), (path.join(self.attachments, 'a.1.dm_68'), True))
+        self.assertEqual(self._read(path.join(self.attachments, 'a.1.dm_68')), b'second')
+
+    def test_loose_file_takes_precedence(self):
+        with open(path.join(self.attachments, 'a.dm_68'), 'wb') as f:
+            f.write(b'loose')
+        self.assertEqual(self._move('a.dm_68', b'loose'), (path.join(self.attachments, 'a.dm_68'), False))
+        self.assertEqual(self._move('a.dm_68', b'other'), (path.join(self.attachments, 'a.1.dm_68'), True))
+
+    def test_concurrent_writers(self):
+        # e.g., backfill.py running next to the bot; its lookup misses the entry added by the bot meanwhile
+        other_store = PackStore(path.join(self.tmpdir.name, 'packs'), max_pack_size=300)
+        real_get = other_store.get
+        lookups = []
+
+        def stale_get(name: str):
+            lookups.append(name)
+            return None if len(lookups) == 1 else real_get(name)
+
+        other_store.get = stale_get
+        other_mover = PackingMover(other_store, self.temp, max_file_size=1000)
+        try:
+            self.assertEqual(self._move('a.dm_68', b'bot'), (path.join(self.attachments, 'a.dm_68'), True))
+            src = path.join(self.temp, 'download')
+            with open(src, 'wb') as f:
+                f.write(b'backfill')
+            self.assertEqual(other_mover.move(src, path.join(self.attachments, 'a.dm_68')),
+                             (path.join(self.attachments, 'a.1.dm_68'), True))
+            self.assertEqual(self._read(path.join(self.attachments, 'a.dm_68')), b'bot')
+            self.assertEqual(self._read(path.join(self.attachments, 'a.1.dm_68')), b'backfill')
+            self.assertEqual(len(list(self.store.entries())), 2)
+        finally:
+            other_store.close()
+
+    def test_packs_are_rotated(self):
+        for i in range(20):
+            self._move(f"{i}.dm_68", os.urandom(100))
+        self.assertGreater(len([f for f in os.listdir(path.join(self.tmpdir.name, 'packs')) if f.endswith('.zpk')]), 1)
+        for entry in self.store.entries():
+            self.assertEqual(len(self.store.read(entry)), 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
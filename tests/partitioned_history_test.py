@@ -0,0 +1,96 @@
+import asyncio
+import datetime
+import unittest
+from typing import List
+
+import discord
+
+from discord_downloader.partitioned_history import snowflake_windows, PartitionedHistory
+
+START = datetime.datetime(2022, 1, 1)
+
+
+def snowflake(days: float) -> int:
+    return discord.utils.time_snowflake(START + datetime.timedelta(days=days))
+
+
+class FakeMessage:
+
+    def __init__(self, id: int):
+        self.id = id
+
+
+class FakeChannel:
+
+    def __init__(self, ids: List[int]):
+        self.ids = ids
+        self.calls = []
+        self.fetched = 0
+
+    async def history(self, limit=None, oldest_first=None, after=None, before=None):
+        self.calls.append((after.id, None if before is None else before.id))
+        # later windows finish first, so the ordering can't come from the timing
+        await asyncio.sleep(0.001 * (len(self.ids) - len(self.calls)))
+        for id in self.ids:
+            if id > after.id and (before is None or id < before.id):
+                self.fetched += 1
+                yield FakeMessage(id)
+
+
+class PartitionedHistoryTestCase(unittest.TestCase):
+
+    def test_windows_are_contiguous(self):
+        after_id = snowflake(0)
+        before_id = snowflake(95)
+        windows = snowflake_windows(after_id, before_id, datetime.timedelta(days=30))
+        self.assertEqual(len(windows), 4)
+        self.assertEqual(windows[0][0], after_id)
+        self.assertEqual(windows[-1][1], before_id)
+        for (_, previous_before), (next_after, _) in zip(windows, windows[1:]):
+            self.assertEqual(next_after, previous_before - 1)
+
+    def test_open_ended_window(self):
+        windows = snowflake_windows(snowflake(0), None, datetime.timedelta(days=30),
+                                    now=START + datetime.timedelta(days=45))
+        self.assertEqual(len(windows), 2)
+        self.assertIsNone(windows[-1][1])
+
+    def test_short_range_is_single_window(self):
+        self.assertEqual(snowflake_windows(snowflake(0), snowflake(1), datetime.timedelta(days=30)),
+                         [(snowflake(0), snowflake(1))])
+
+    def test_windows_are_returned_in_order(self):
+        ids = [snowflake(day) + 1 for day in range(1, 100, 3)]
+        channel = FakeChannel(ids)
+        history = PartitionedHistory(channel, after_id=snowflake(0), before_id=snowflake(101),
+                                     window=datetime.timedelta(days=10), parallelism=4)
+
+        async def collect():
+            res = []
+            async for last_id, messages in history.windows():
+                messages = [m async for m in messages]
+                self.assertTrue(all(m.id <= last_id for m in messages))
+                res.extend(m.id for m in messages)
+            return res
+
+        self.assertEqual(asyncio.run(collect()), ids)
+        self.assertEqual(len(channel.calls), 11)
+
+    def test_prefetch_is_bounded(self):
+        ids = [snowflake(1) + i for i in range(1000)]
+        channel = FakeChannel(ids)
+        history = PartitionedHistory(channel, after_id=snowflake(0), before_id=snowflake(2),
+                                     window=datetime.timedelta(days=30), parallelism=4, prefetch_pages=1)
+
+        async def read_some():
+            async for last_id, messages in history.windows():
+                async for m in messages:
+                    await asyncio.sleep(0.05)  # the fetching can run ahead meanwhile
+                    return m.id
+
+        self.assertEqual(asyncio.run(read_some()), ids[0])
+        self.assertLessEqual(channel.fetched, 102)
+
+
+if __name__ == '__main__':
+    unittest.main()
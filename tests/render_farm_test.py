@@ -0,0 +1,122 @@
+import asyncio
+import datetime
+import os
+import shutil
+import signal
+import sys
+import unittest
+from os import path
+from os.path import dirname
+from tempfile import TemporaryDirectory
+
+from aiohttp import ClientSession
+
+from discord_downloader.render_farm import RenderFarmCoordinator, RenderFarmException
+
+REPO_DIR = path.join(dirname(__file__), '..')
+TOKEN = 'test-token'
+
+
+class RenderFarmTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._tmpdir = TemporaryDirectory()
+        tmpdir = self._tmpdir.name
+        for directory in ['config', 'demo', 'video', 'executable', 'farm']:
+            os.mkdir(path.join(tmpdir, directory))
+        self._fake_odfe = path.join(tmpdir, 'executable', 'fake-odfe.sh')
+        shutil.copy(path.join(dirname(__file__), 'odfe-demo-renderer-test', 'fake-odfe.sh'), self._fake_odfe)
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def _coordinator(self, max_attempts: int = 3) -> RenderFarmCoordinator:
+        return RenderFarmCoordinator(host='127.0.0.1', port=0, token=TOKEN,
+                                     video_dir=path.join(self._tmpdir.name, 'farm'),
+                                     lease_duration=datetime.timedelta(seconds=1.5), max_attempts=max_attempts)
+
+    async def _start_worker(self, coordinator: RenderFarmCoordinator, worker_id: str, **env):
+        tmpdir = self._tmpdir.name
+        return await asyncio.create_subprocess_exec(
+            sys.executable, path.join(REPO_DIR, 'render-worker.py'),
+            f'--url=http://127.0.0.1:{coordinator.port}',
+            f'--token={TOKEN}',
+            f'--worker-id={worker_id}',
+            '--lease-wait=1',
+            f'--odfe-dir={tmpdir}',
+            f'--odfe-executable={self._fake_odfe}',
+            f'--config-dir={path.join(tmpdir, "config")}',
+            f'--demo-dir={path.join(tmpdir, "demo")}',
+            f'--video-dir={path.join(tmpdir, "video")}',
+            cwd=REPO_DIR,
+            env={**os.environ, **env},
+            # the worker and its (fake) oDFe are killed together
+            start_new_session=True,
+        )
+
+    @staticmethod
+    async def _kill(worker):
+        try:
+            os.killpg(worker.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        await worker.wait()
+
+    @staticmethod
+    async def _wait_for_lease(coordinator: RenderFarmCoordinator, worker_id: str):
+        while not any(job.worker_id == worker_id for job in coordinator._jobs.values()):
+            await asyncio.sleep(0.05)
+
+    def test_failover_to_another_worker(self):
+        async def run():
+            coordinator = self._coordinator()
+            await coordinator.start()
+            workers = []
+            try:
+                render = asyncio.get_running_loop().create_task(coordinator.render('x.dm_68', b'demo', None))
+                stuck = await self._start_worker(coordinator, 'stuck', FAKE_ODFE_LATENCY='60')
+                workers.append(stuck)
+                await asyncio.wait_for(self._wait_for_lease(coordinator, 'stuck'), 30)
+                await self._kill(stuck)
+                workers.append(await self._start_worker(coordinator, 'healthy'))
+                video_file = await asyncio.wait_for(render, 60)
+                self.assertTrue(path.exists(video_file))
+                self.assertEqual(os.listdir(path.join(self._tmpdir.name, 'farm')), [path.basename(video_file)])
+            finally:
+                for worker in workers:
+                    await self._kill(worker)
+                await coordinator.close()
+
+        asyncio.run(run())
+
+    def test_failing_render_is_retried_and_reported(self):
+        async def run():
+            coordinator = self._coordinator(max_attempts=2)
+            await coordinator.start()
+            worker = await self._start_worker(coordinator, 'failing', FAKE_ODFE_FAILURE_PERCENT='100')
+            try:
+                with self.assertRaises(RenderFarmException):
+                    await asyncio.wait_for(coordinator.render('x.dm_68', b'demo', None), 60)
+            finally:
+                await self._kill(worker)
+                await coordinator.close()
+
+        asyncio.run(run())
+
+    def test_token_is_required(self):
+        async def run():
+            coordinator = self._coordinator()
+            await coordinator.start()
+            try:
+                async with ClientSession() as session:
+                    async with session.post(f'http://127.0.0.1:{coordinator.port}/jobs/lease',
+                                            json={'worker_id': 'w'}) as response:
+                        self.assertEqual(response.status, 401)
+            finally:
+                await coordinator.close()
+
+        asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import asyncio
+import threading
+import unittest
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from sqlalchemy import insert
+
+from discord_downloader import db
+from discord_downloader.db import RenderedDemo
+from discord_downloader.db_writer import BatchingDbWriter
+from discord_downloader.rendered_demo_cache import RenderedDemoCache
+
+
+class RenderedDemoCacheTestCase(unittest.TestCase):
+
+    def test_record_and_reload(self):
+        async def run():
+            conn = db.create_current_db_engine()
+            db_writer = BatchingDbWriter(conn)
+            cache = RenderedDemoCache(db_writer)
+            await cache.load()
+            self.assertIsNone(cache.get('hash1'))
+            await cache.record('https://youtu.be/1', 'a.dm_68', 'hash1')
+            # the same video posted to another channel
+            await cache.record('https://youtu.be/1', 'a.dm_68', 'hash1')
+            self.assertEqual(cache.get('hash1'), 'https://youtu.be/1')
+            # a different demo with the same original name is not considered rendered
+            self.assertIsNone(cache.get('hash2', legacy_filename='a.dm_68'))
+
+            reloaded = RenderedDemoCache(db_writer)
+            await reloaded.load()
+            self.assertEqual(reloaded.get('hash1'), 'https://youtu.be/1')
+            await db_writer.close()
+
+        with TemporaryDirectory() as tmpdir, patch.object(db, 'STATE_DIRECTORY', tmpdir):
+            asyncio.run(run())
+
+    def test_legacy_rows(self):
+        async def run():
+            conn = db.create_current_db_engine()
+            async with conn.begin() as connection:
+                await connection.execute(insert(RenderedDemo).values(url='https://youtu.be/old', filename='old.dm_68'))
+                await connection.execute(insert(RenderedDemo).values(url='https://youtu.be/copy',
+                                                                     filename='copy.dm_68'))
+                await connection.execute(insert(RenderedDemo).values(url='https://youtu.be/gone',
+                                                                     filename='gone.dm_68'))
+            hashes = {'old.dm_68': 'oldhash', 'copy.dm_68': 'oldhash'}
+            loop_thread = threading.get_ident()
+
+            def hasher(filename):
+                self.assertNotEqual(threading.get_ident(), loop_thread)
+                return hashes.get(filename)
+
+            db_writer = BatchingDbWriter(conn)
+            cache = RenderedDemoCache(db_writer)
+            await cache.load(hasher)
+            self.assertEqual(cache.get('oldhash'), 'https://youtu.be/old')
+            self.assertEqual(cache.get('otherhash', legacy_filename='gone.dm_68'), 'https://youtu.be/gone')
+
+            # the hashes have been stored, also the one of the other render of the same demo, so they are not
+            # computed again
+            reloaded = RenderedDemoCache(db_writer)
+            await reloaded.load(lambda filename: self.fail(filename) if filename != 'gone.dm_68' else None)
+            self.assertEqual(reloaded.get('oldhash'), 'https://youtu.be/old')
+            await db_writer.close()
+
+        with TemporaryDirectory() as tmpdir, patch.object(db, 'STATE_DIRECTORY', tmpdir):
+            asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import asyncio
+import os
+import time
+import unittest
+from os import path
+from tempfile import TemporaryDirectory
+from typing import Optional
+
+from discord_downloader.demo_uploaders import DemoRenderer
+from discord_downloader.io_executor import IoExecutor
+from discord_downloader.rendered_video_cache import RenderedVideoCache
+
+
+class FakeDemoRenderer(DemoRenderer):
+
+    def __init__(self, video_dir: str):
+        self.video_dir = video_dir
+        self.rendered = []
+
+    async def render(self, demo_filename: str, demo_data: bytes, round_id: Optional[int]) -> str:
+        self.rendered.append((demo_filename, round_id))
+        await asyncio.sleep(0.01)
+        if demo_data == b'broken':
+            raise Exception("Cannot render")
+        video_file = path.join(self.video_dir, f"{len(self.rendered)}.mp4")
+        with open(video_file, 'wb') as f:
+            f.write(b'v' * 100)
+        return video_file
+
+
+class RenderedVideoCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.video_dir = path.join(self.tmpdir.name, 'video')
+        self.cache_dir = path.join(self.video_dir, 'cache')
+        os.mkdir(self.video_dir)
+        self.executor = IoExecutor()
+        self.renderer = FakeDemoRenderer(self.video_dir)
+        self.in_use = []
+        self.cache = RenderedVideoCache(self.renderer, self.cache_dir, max_size=250,
+                                        render_config=lambda round_id: f"crf {round_id}",
+                                        in_use=lambda: self.in_use, io_executor=self.executor)
+
+    def tearDown(self):
+        self.executor.shutdown()
+        self.tmpdir.cleanup()
+
+    def _run(self, coro):
+        async def run():
+            await self.cache.start()
+            try:
+                return await coro
+            finally:
+                await self.cache.close()
+
+        return asyncio.run(run())
+
+    def _cached(self):
+        return sorted(os.listdir(self.cache_dir))
+
+    def test_reuse(self):
+        async def render_all():
+            first = await self.cache.render('a.dm_68', b'a', None)
+            again = await self.cache.render('renamed-a.dm_68', b'a', None)
+            other_round = await self.cache.render('a.dm_68', b'a', 0)
+            concurrent = await asyncio.gather(*(self.cache.render('b.dm_68', b'b', None) for _ in range(3)))
+            return first, again, other_round, concurrent
+
+        first, again, other_round, concurrent = self._run(render_all())
+        self.assertEqual(first, again)
+        self.assertNotEqual(first, other_round)
+        self.assertEqual(len(set(concurrent)), 1)
+        self.assertEqual(self.renderer.rendered, [('a.dm_68', None), ('a.dm_68', 0), ('b.dm_68', None)])
+        self.assertEqual(os.listdir(self.video_dir), ['cache'])
+        self.assertEqual(path.dirname(first), self.cache_dir)
+
+    def test_lru_eviction(self):
+        async def render_all():
+            a = await self.cache.render('a.dm_68', b'a', None)
+            b = await self.cache.render('b.dm_68', b'b', None)
+            os.utime(a, (time.time() - 10, time.time() - 10))
+            os.utime(b, (time.time() - 20, time.time() - 20))
+            await self.cache.render('a.dm_68', b'a', None)  # hit, a becomes the most recently used one
+            c = await self.cache.render('c.dm_68', b'c', None)
+            return a, b, c
+
+        a, b, c = self._run(render_all())
+        self.assertEqual(self._cached(), sorted(path.basename(f) for f in [a, c]))
+
+    def test_videos_in_use_are_kept(self):
+        async def render_all():
+            a = await self.cache.render('a.dm_68', b'a', None)
+            self.in_use.append(a)
+            b = await self.cache.render('b.dm_68', b'b', None)
+            os.utime(a, (time.time() - 10, time.time() - 10))
+            c = await self.cache.render('c.dm_68', b'c', None)
+            return a, b, c
+
+        a, b, c = self._run(render_all())
+        self.assertEqual(self._cached(), sorted(path.basename(f) for f in [a, c]))
+
+    def test_failure_and_partial_files(self):
+        os.makedirs(self.cache_dir)
+        open(path.join(self.cache_dir, 'x.mp4.part'), 'w').close()
+
+        async def render_all():
+            return await asyncio.gather(self.cache.render('broken.dm_68', b'broken', None),
+                                        self.cache.render('broken.dm_68', b'broken', None), return_exceptions=True)
+
+        results = self._run(render_all())
+        self.assertTrue(all(isinstance(result, Exception) for result in results))
+        self.assertEqual(len(self.renderer.rendered), 1)
+        self.assertEqual(self._cached(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
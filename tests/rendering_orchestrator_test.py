@@ -0,0 +1,200 @@
+import asyncio
+import unittest
+from os import path
+from tempfile import TemporaryDirectory
+from typing import Callable, Any, Awaitable, List
+
+from discord_downloader.demo_uploaders import VideoUploadException
+from discord_downloader.local_queue import AutonomousRenderingQueue
+from discord_downloader.persistent_state import StoredState
+from discord_downloader.rendering_orchestrator import RenderingOrchestrator, RemoteRenderingQueue
+
+TOKEN = 'test-token'
+
+
+class FakeRenderingQueue(AutonomousRenderingQueue):
+
+    def __init__(self):
+        self.uploads = []
+        self._done_callbacks: List[Callable[[str, Any], Awaitable[None]]] = []
+        self._fail_callbacks: List[Callable[[int, Exception, Any], Awaitable[None]]] = []
+
+    def add_done_callback(self, done_callback: Callable[[str, Any], Awaitable[None]]):
+        self._done_callbacks.append(done_callback)
+
+    def add_fail_callback(self, failed_callback: Callable[[int, Exception, Any], Awaitable[None]]):
+        self._fail_callbacks.append(failed_callback)
+
+    async def upload(self, url: str, resolution: int, title: str, description: str, additional_data=None) -> None:
+        self.uploads.append((url, additional_data))
+
+    async def run(self):
+        await asyncio.Event().wait()
+
+    async def finish(self, video_url, additional_data):
+        for callback in self._done_callbacks:
+            await callback(video_url, additional_data)
+
+    async def fail(self, id, e, additional_data):
+        for callback in self._fail_callbacks:
+            await callback(id, e, additional_data)
+
+
+async def wait_for(condition: Callable[[], bool], timeout: float = 10):
+    async def poll():
+        while not condition():
+            await asyncio.sleep(0.01)
+    await asyncio.wait_for(poll(), timeout)
+
+
+class RenderingOrchestratorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._tmpdir = TemporaryDirectory()
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def _state(self, name, cls):
+        return StoredState(path.join(self._tmpdir.name, name), cls.get_default_state())
+
+    def _remote_queue(self, port: int, token: str = TOKEN):
+        remote = RemoteRenderingQueue(port=port, token=token, state=self._state('bot.json', RemoteRenderingQueue),
+                                      reconnect_interval=0.05)
+        done = []
+        failed = []
+
+        async def on_done(video_url, additional_data):
+            done.append((video_url, additional_data))
+
+        async def on_failed(id, e, additional_data):
+            failed.append((id, e, additional_data))
+
+        remote.add_done_callback(on_done)
+        remote.add_fail_callback(on_failed)
+        return remote, done, failed
+
+    @staticmethod
+    async def _cancel(*tasks):
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def test_upload_and_events(self):
+        async def run():
+            queue = FakeRenderingQueue()
+            orchestrator = RenderingOrchestrator(queue, self._state('orchestrator.json', RenderingOrchestrator),
+                                                 port=0, token=TOKEN)
+            orchestrator_task = asyncio.get_running_loop().create_task(orchestrator.run())
+            await orchestrator.wait_until_listening()
+            remote, done, failed = self._remote_queue(orchestrator.port)
+            remote_task = asyncio.get_running_loop().create_task(remote.run())
+            try:
+                await remote.upload('https://example.com/a.dm_68', 1080, 'title', 'description', ['a'])
+                await wait_for(lambda: len(queue.uploads) == 1)
+                await wait_for(lambda: remote._state.value['pending_uploads'] == [])
+                self.assertEqual([('https://example.com/a.dm_68', ['a'])], queue.uploads)
+
+                await queue.finish('https://youtube.com/a', ['a'])
+                await queue.fail(1, VideoUploadException('no video', '/tmp/b.mp4'), ['b'])
+                self.assertEqual(['/tmp/b.mp4'], orchestrator.videos_in_use())  # until the bot acks the event
+                await wait_for(lambda: len(done) == 1 and len(failed) == 1)
+                await wait_for(lambda: orchestrator._state.value['events'] == [])
+                self.assertEqual([], orchestrator.videos_in_use())
+                self.assertEqual([('https://youtube.com/a', ['a'])], done)
+                [(id, e, additional_data)] = failed
+                self.assertIsInstance(e, VideoUploadException)
+                self.assertEqual('/tmp/b.mp4', e.video_file)
+                self.assertEqual(['b'], additional_data)
+            finally:
+                await self._cancel(remote_task, orchestrator_task)
+
+        asyncio.run(run())
+
+    def test_delivery_while_disconnected(self):
+        async def run():
+            queue = FakeRenderingQueue()
+            orchestrator = RenderingOrchestrator(queue, self._state('orchestrator.json', RenderingOrchestrator),
+                                                 port=0, token=TOKEN)
+            orchestrator_task = asyncio.get_running_loop().create_task(orchestrator.run())
+            await orchestrator.wait_until_listening()
+            remote, done, failed = self._remote_queue(orchestrator.port)
+            try:
+                # The bot is down: its upload waits in its state, the orchestrator's event waits in the other one.
+                await remote.upload('https://example.com/a.dm_68', 1080, 'title', 'description', ['a'])
+                await queue.finish('https://youtube.com/x', ['x'])
+
+                # restarted bot
+                remote, done, failed = self._remote_queue(orchestrator.port)
+                remote_task = asyncio.get_running_loop().create_task(remote.run())
+                try:
+                    await wait_for(lambda: len(queue.uploads) == 1 and len(done) == 1)
+                    await wait_for(lambda: orchestrator._state.value['events'] == [])
+                finally:
+                    await self._cancel(remote_task)
+
+                # an event that has been handled, but whose ack has been lost, must not be handled again
+                orchestrator._state.value['events'].append({'type': 'done', 'seq': 1, 'video_url': 'dup',
+                                                            'additional_data': None})
+                remote_task = asyncio.get_running_loop().create_task(remote.run())
+                try:
+                    await wait_for(lambda: orchestrator._state.value['events'] == [])
+                    await asyncio.sleep(0.1)
+                    self.assertEqual([('https://youtube.com/x', ['x'])], done)
+                    self.assertEqual(1, len(queue.uploads))
+                finally:
+                    await self._cancel(remote_task)
+            finally:
+                await self._cancel(orchestrator_task)
+
+        asyncio.run(run())
+
+    def test_event_added_during_replay(self):
+        async def run():
+            queue = FakeRenderingQueue()
+            orchestrator = RenderingOrchestrator(queue, self._state('orchestrator.json', RenderingOrchestrator),
+                                                 port=0, token=TOKEN)
+            orchestrator_task = asyncio.get_running_loop().create_task(orchestrator.run())
+            await orchestrator.wait_until_listening()
+            for i in range(3):
+                await queue.finish(f'https://youtube.com/{i}', [i])  # while the bot is down
+            send = orchestrator._send
+
+            async def send_finishing_during_replay(writer, message):
+                if message.get('seq') == 1:
+                    await queue.finish('https://youtube.com/3', [3])
+                await send(writer, message)
+
+            orchestrator._send = send_finishing_during_replay
+            remote, done, failed = self._remote_queue(orchestrator.port)
+            remote_task = asyncio.get_running_loop().create_task(remote.run())
+            try:
+                await wait_for(lambda: orchestrator._state.value['events'] == [])
+                self.assertEqual([(f'https://youtube.com/{i}', [i]) for i in range(4)], done)
+            finally:
+                await self._cancel(remote_task, orchestrator_task)
+
+        asyncio.run(run())
+
+    def test_wrong_token(self):
+        async def run():
+            queue = FakeRenderingQueue()
+            orchestrator = RenderingOrchestrator(queue, self._state('orchestrator.json', RenderingOrchestrator),
+                                                 port=0, token=TOKEN)
+            orchestrator_task = asyncio.get_running_loop().create_task(orchestrator.run())
+            await orchestrator.wait_until_listening()
+            remote, done, failed = self._remote_queue(orchestrator.port, token='wrong')
+            remote_task = asyncio.get_running_loop().create_task(remote.run())
+            try:
+                await remote.upload('https://example.com/a.dm_68', 1080, 'title', 'description', ['a'])
+                await asyncio.sleep(0.3)
+                self.assertEqual([], queue.uploads)
+                self.assertEqual(1, len(remote._state.value['pending_uploads']))
+            finally:
+                await self._cancel(remote_task, orchestrator_task)
+
+        asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
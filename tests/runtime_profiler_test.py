@@ -0,0 +1,98 @@
+import asyncio
+import datetime
+import os
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+from tempfile import TemporaryDirectory
+
+from discord_downloader.runtime_profiler import RuntimeProfiler, classify_stack, PROFILE_STAGE_CALLBACKS, \
+    PROFILE_STAGE_ANALYZE, PROFILE_STAGE_IDLE, PROFILE_STAGE_OTHER, profile_trigger_file
+
+TEST_RULES = [('busy', 'runtime_profiler_test.py', 'busy_stage')]
+
+
+async def busy_stage(seconds: float, chunk: int = 1000):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        sum(range(chunk))
+        await asyncio.sleep(0)
+
+
+class ClassifyStackTestCase(unittest.TestCase):
+
+    def test_priority(self):
+        # a callback called by the rendering queue
+        stack = [('http.py', 'request'), ('download.py', '_after_upload'),
+                 ('local_rendering_queue.py', '_run_publishing')]
+        self.assertEqual(PROFILE_STAGE_CALLBACKS, classify_stack(stack))
+        # analysis of an ingested message
+        stack = [('demo_analyzer.py', 'analyze'), ('download.py', '_post_to_igmdb'),
+                 ('download.py', 'archive_message'), ('download.py', '_archive_history')]
+        self.assertEqual(PROFILE_STAGE_ANALYZE, classify_stack(stack))
+
+    def test_idle_and_other(self):
+        self.assertEqual(PROFILE_STAGE_IDLE,
+                         classify_stack([('selectors.py', 'select'), ('base_events.py', '_run_once')]))
+        self.assertEqual(PROFILE_STAGE_OTHER, classify_stack([('gateway.py', 'poll_event')]))
+
+
+class RuntimeProfilerTestCase(unittest.TestCase):
+
+    def test_triggered_by_file(self):
+        with TemporaryDirectory() as tmpdir:
+            profiler = RuntimeProfiler(tmpdir, datetime.timedelta(seconds=60), sample_interval=0.005,
+                                       trigger_poll_interval=0.01, rules=TEST_RULES, role='bot')
+
+            async def run():
+                task = asyncio.get_running_loop().create_task(profiler.run())
+                # meant for another process sharing the state directory
+                with open(path.join(tmpdir, profile_trigger_file('backfill')), 'w') as f:
+                    f.write('0.3')
+                with open(path.join(tmpdir, profile_trigger_file('bot')), 'w') as f:
+                    f.write('0.3')
+                try:
+                    await busy_stage(0.5)
+                    while not any(f.endswith('.folded') for f in os.listdir(tmpdir)):
+                        await asyncio.sleep(0.05)
+                finally:
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+
+            asyncio.run(run())
+            [summary_file] = [f for f in os.listdir(tmpdir) if f.endswith('.txt')]
+            self.assertTrue(summary_file.startswith('profile-bot-'))
+            with open(path.join(tmpdir, summary_file)) as f:
+                summary = f.read()
+            self.assertIn('CPU samples by stage:', summary)
+            self.assertIn('[busy] self:', summary)
+            self.assertIn('Top memory growth:', summary)
+            self.assertFalse(path.exists(path.join(tmpdir, profile_trigger_file('bot'))))
+            self.assertTrue(path.exists(path.join(tmpdir, profile_trigger_file('backfill'))))
+            [folded_file] = [f for f in os.listdir(tmpdir) if f.endswith('.folded')]
+            with open(path.join(tmpdir, folded_file)) as f:
+                self.assertTrue(any(line.startswith('busy;') and 'busy_stage' in line for line in f))
+
+    def test_loop_outside_of_main_thread(self):
+        # signals can't be used, so the stacks are sampled by a thread
+        with TemporaryDirectory() as tmpdir:
+            profiler = RuntimeProfiler(tmpdir, datetime.timedelta(seconds=60), sample_interval=0.005, rules=TEST_RULES)
+
+            async def run():
+                profiling = asyncio.get_running_loop().create_task(profiler.profile(datetime.timedelta(seconds=0.3)))
+                await asyncio.sleep(0.1)  # the sampler starts after the first memory snapshot
+                # the sampler gets the GIL when the loop yields it, so the synchronous chunks must be long
+                await busy_stage(0.5, chunk=100000)
+                return await profiling
+
+            with ThreadPoolExecutor(1) as executor:
+                summary_file = executor.submit(asyncio.run, run()).result()
+            with open(summary_file) as f:
+                summary = f.read()
+            self.assertIn('of wall-clock time', summary)
+            self.assertIn('[busy] self:', summary)
+
+
+if __name__ == '__main__':
+    unittest.main()
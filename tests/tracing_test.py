@@ -0,0 +1,42 @@
+import unittest
+
+from discord_downloader.additional_data import AdditionalData
+from discord_downloader.tracing import percentile, stage_statistics, StageStatistics
+
+
+class TracingTestCase(unittest.TestCase):
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile([7], 95), 7)
+
+    def test_stage_statistics_order(self):
+        stats = stage_statistics([
+            ('upload', 3.0),
+            ('custom', 1.0),
+            ('archive', 2.0),
+            ('archive', 4.0),
+        ])
+        self.assertEqual(stats, [
+            StageStatistics(stage='archive', count=2, p50=2.0, p95=4.0),
+            StageStatistics(stage='upload', count=1, p50=3.0, p95=3.0),
+            StageStatistics(stage='custom', count=1, p50=1.0, p95=1.0),
+        ])
+
+    def test_trace_id_roundtrip(self):
+        data = AdditionalData(in_channel='a--b', message_id=1, title='t', description='d', rerendering_round=None,
+                              url='https://example.com/x.dm_68', has_unknown=False, filename='x.dm_68',
+                              trace_id='abc')
+        self.assertEqual(AdditionalData.reconstruct(data.serialize()), data)
+        self.assertEqual(AdditionalData.trace_id_of(data.serialize()), 'abc')
+
+    def test_legacy_additional_data_has_no_trace_id(self):
+        legacy = ['a--b', 1, 't', 'd', None, 'https://example.com/x.dm_68', False, 'x.dm_68']
+        self.assertIsNone(AdditionalData.reconstruct(legacy).trace_id)
+        self.assertIsNone(AdditionalData.trace_id_of(None))
+
+
+if __name__ == '__main__':
+    unittest.main()
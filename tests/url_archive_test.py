@@ -0,0 +1,51 @@
+import unittest
+
+from sqlalchemy import create_engine, select
+
+from discord_downloader.db import Base, ArchivedUrl
+from discord_downloader.url_archive import normalize_url, reverse_domain, upsert_statement, domain_query, \
+    prefix_query
+
+
+class UrlArchiveTestCase(unittest.TestCase):
+
+    def test_normalize_url(self):
+        self.assertEqual(normalize_url("HTTPS://Example.COM"), "https://example.com/")
+        self.assertEqual(normalize_url("https://example.com:443/a?b=C"), "https://example.com/a?b=C")
+        self.assertEqual(normalize_url("http://example.com:8080/x"), "http://example.com:8080/x")
+        self.assertEqual(normalize_url("https://example.com/x."), "https://example.com/x")
+        self.assertEqual(normalize_url("https://example.com/x),"), "https://example.com/x")
+        self.assertEqual(normalize_url("https://en.wikipedia.org/wiki/Foo_(bar)"),
+                         "https://en.wikipedia.org/wiki/Foo_(bar)")
+        for malformed in ["https://example.com:abc/x", "http://[::1", "https://foo:99999/"]:
+            self.assertEqual(normalize_url(malformed), malformed)
+
+    def test_reverse_domain(self):
+        self.assertEqual(reverse_domain("www.Example.com"), "com.example.www")
+
+    def test_dedup_and_queries(self):
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(engine)
+        with engine.begin() as connection:
+            connection.execute(upsert_statement("https://example.com/a", "msg1", seen_at=1))
+            connection.execute(upsert_statement("HTTPS://EXAMPLE.COM/a.", "msg2", seen_at=2))
+            connection.execute(upsert_statement("https://www.example.com/b", "msg3", seen_at=3))
+            connection.execute(upsert_statement("https://notexample.com/", "msg4", seen_at=4))
+            connection.execute(upsert_statement("https://example.community/", "msg5", seen_at=5))
+
+            rows = connection.execute(select(ArchivedUrl).order_by(ArchivedUrl.id)).fetchall()
+            self.assertEqual(len(rows), 4)
+            self.assertEqual((rows[0].url, rows[0].first_message_url, rows[0].occurrences, rows[0].last_seen_at),
+                             ("https://example.com/a", "msg1", 2, 2))
+
+            def urls(query):
+                return [row.normalized_url for row in connection.execute(query)]
+
+            self.assertEqual(urls(domain_query("example.com")),
+                             ["https://example.com/a", "https://www.example.com/b"])
+            self.assertEqual(urls(domain_query("example.com", include_subdomains=False)), ["https://example.com/a"])
+            self.assertEqual(urls(prefix_query("https://www.")), ["https://www.example.com/b"])
+
+
+if __name__ == '__main__':
+    unittest.main()
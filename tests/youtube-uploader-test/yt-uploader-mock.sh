@@ -1,5 +1,12 @@
 #!/usr/bin/env bash
 
+# optional knobs for benchmarks: latency in seconds, failure rate in percent
+sleep "${YT_UPLOADER_MOCK_LATENCY:-0}"
+if [ "$((RANDOM % 100))" -lt "${YT_UPLOADER_MOCK_FAILURE_PERCENT:-0}" ]; then
+  echo "simulated failure"
+  exit 1
+fi
+
 cat "$2"
 cat "$3" > /dev/stderr
 
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+import argparse
+import re
+import time
+
+from sqlalchemy import create_engine, select
+
+from discord_downloader.db import ArchivedUrl, get_blocking_db_connection_url, create_current_db_engine
+from discord_downloader.url_archive import domain_query, prefix_query, export_line, upsert_statement
+from settings import URLS_FILE
+
+URLS_FILE_LINE_REGEX = re.compile(r'^(\S+) \((\S+)\)(?: \[skipped: (.*)\])?$')
+
+parser = argparse.ArgumentParser(description='Queries the archive of URLs posted to the watched channels.')
+subparsers = parser.add_subparsers(dest='command', required=True)
+domain_parser = subparsers.add_parser('domain', help='URLs of the given domain')
+domain_parser.add_argument('domain')
+domain_parser.add_argument('--exact', action='store_true', help='do not include subdomains')
+prefix_parser = subparsers.add_parser('prefix', help='URLs starting with the given prefix')
+prefix_parser.add_argument('prefix')
+export_parser = subparsers.add_parser('export', help='writes all URLs in the format of the former urls.txt')
+export_parser.add_argument('--output', default=URLS_FILE)
+import_parser = subparsers.add_parser('import', help='imports URLs from urls.txt written by older versions')
+import_parser.add_argument('--input', default=URLS_FILE)
+args = parser.parse_args()
+
+create_current_db_engine()  # upgrades the schema if needed
+engine = create_engine(get_blocking_db_connection_url())
+
+if args.command == 'import':
+    imported = 0
+    now = time.time()
+    with open(args.input) as f, engine.begin() as connection:
+        for line in f:
+            match = URLS_FILE_LINE_REGEX.match(line.rstrip('\n'))
+            if match is None:
+                print(f"Skipping unparseable line: {line.rstrip()}")
+                continue
+            url, message_url, skip_reason = match.groups()
+            connection.execute(upsert_statement(url, message_url, skip_reason, seen_at=now))
+            imported += 1
+    print(f"Imported {imported} lines from {args.input}")
+else:
+    if args.command == 'domain':
+        query = domain_query(args.domain, include_subdomains=not args.exact)
+    elif args.command == 'prefix':
+        query = prefix_query(args.prefix)
+    else:
+        query = select(ArchivedUrl).order_by(ArchivedUrl.first_seen_at)
+    with engine.connect() as connection:
+        rows = connection.execute(query).fetchall()
+    if args.command == 'export':
+        with open(args.output, 'w') as f:
+            for row in rows:
+                f.write(export_line(row))
+        print(f"Exported {len(rows)} URLs to {args.output}")
+    else:
+        for row in rows:
+            print(f"{row.url}\t{row.occurrences}\t{row.first_message_url}")